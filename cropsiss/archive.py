@@ -0,0 +1,163 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Archival of the sold rows to the archive tabs of the Google Spreadsheet"""
+import datetime
+import logging
+import time
+import typing as t
+
+from cropsiss import google, lookup, shard
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SHEET_ID = 1000000
+ARCHIVE_TITLE = f"{shard.SHEET_TITLE}-アーカイブ"
+ARCHIVE_HEADER = ["CropsissID", "商品名", "メルカリ商品ID", "ヤフオク!オークションID", "売却済み", "アーカイブ日時"]
+
+
+def row_data(cells: t.Iterable[str]) -> dict[str, t.Any]:
+    return {"values": [{"userEnteredValue": {"stringValue": cell}} for cell in cells]}
+
+
+def archived_row(cropsiss_id: str) -> list[str]:
+    """Make the row left on a shard for an archived CropsissID."""
+    return [cropsiss_id, *[""] * (lookup.SOLD_COLUMN_INDEX - 1), lookup.ARCHIVED]
+
+
+def is_archived(row: list[str]) -> bool:
+    """Whether the row has been archived."""
+    return row[lookup.SOLD_COLUMN_INDEX:lookup.SOLD_COLUMN_INDEX + 1] == [lookup.ARCHIVED]
+
+
+def add_archive_sheet_requests() -> list[dict[str, t.Any]]:
+    """Make the requests to add the archive tab with its header."""
+    return [
+        {
+            "addSheet": {
+                "properties": {
+                    "sheetId": ARCHIVE_SHEET_ID,
+                    "title": ARCHIVE_TITLE
+                }
+            }
+        },
+        {
+            "appendCells": {
+                "sheetId": ARCHIVE_SHEET_ID,
+                "rows": [row_data(ARCHIVE_HEADER)],
+                "fields": "userEnteredValue"
+            }
+        }
+    ]
+
+
+def archive_requests(
+    sheet_shard: shard.Shard,
+    rows: t.Mapping[int, list[str]],
+    archived_at: str
+) -> list[dict[str, t.Any]]:
+    """Make the requests to move rows of a shard to the archive tab of its spreadsheet.
+
+    The rows are appended to the archive tab along with the time of the archival.
+    On the shard, the cells of the rows but the CropsissID are cleared together with their tags of the item IDs,
+    and the sold column is set to `ARCHIVED` so that the IDs are not reused.
+    The rows themselves are not deleted, since the router places each ID on a fixed row,
+    so the shard costs as much to read as before.
+    """
+    requests: list[dict[str, t.Any]] = [{
+        "appendCells": {
+            "sheetId": ARCHIVE_SHEET_ID,
+            "rows": [row_data([*row, archived_at]) for row in rows.values()],
+            "fields": "userEnteredValue"
+        }
+    }]
+    for index, row in rows.items():
+        requests.append({
+            "updateCells": {
+                "range": {
+                    "sheetId": sheet_shard.sheet_id,
+                    "startRowIndex": index + 1,
+                    "endRowIndex": index + 2,
+                    "startColumnIndex": 1,
+                    "endColumnIndex": lookup.SOLD_COLUMN_INDEX + 1
+                },
+                "rows": [{"values": [
+                    *[{}] * (lookup.SOLD_COLUMN_INDEX - 1),
+                    {"userEnteredValue": {"stringValue": lookup.ARCHIVED}}
+                ]}],
+                "fields": "userEnteredValue"
+            }
+        })
+        requests.extend(lookup.tag_requests(index, archived_row(row[0]), sheet_shard.sheet_id))
+    return requests
+
+
+def archive_sold_rows(
+    api: google.SpreadsheetAPI,
+    sheet_lookup: lookup.ShardedLookup,
+    days: float,
+    scan: bool = False
+) -> int:
+    """Move the rows sold more than `days` days ago to the archive tabs.
+
+    A row is stamped in its snapshot when it is marked as sold, and it is archived once the stamp is old enough.
+    Only the shards with such rows are read, so nothing is read while no row is due.
+    With `scan`, all of the shards are read and the sold rows without a stamp, e.g. marked by hand, are stamped now.
+    The rows are moved by one batchUpdate per spreadsheet.
+
+    Parameters
+    ----------
+    api : SpreadsheetAPI
+        The API to the spreadsheets.
+    sheet_lookup : cropsiss.lookup.ShardedLookup
+        The lookup whose snapshots hold the stamps.
+    days : float
+        The days since the rows were sold.
+    scan : bool
+        Whether to stamp the sold rows without a stamp.
+
+    Returns
+    -------
+    int
+        The number of the archived rows.
+    """
+    now = time.time()
+    until = now - days * 86400
+    shards = [
+        sheet_shard for sheet_shard in sheet_lookup.router.shards
+        if scan or sheet_lookup.snapshots[sheet_shard].stamped_until(until)
+    ]
+    due: dict[shard.Shard, dict[int, list[str]]] = {}
+    for sheet_shard, item_table in zip(shards, sheet_lookup.refresh(shards)):
+        sheet_snapshot = sheet_lookup.snapshots[sheet_shard]
+        if scan:
+            for index, row in enumerate(item_table.rows()):
+                if row[lookup.SOLD_COLUMN_INDEX] == "TRUE" and sheet_snapshot.get_stamp(index) is None:
+                    sheet_snapshot.stamp_row(index, now)
+        rows = {index: item_table.row(index) for index in sheet_snapshot.stamped_until(until)}
+        # The stamps of the rows which are no longer sold, e.g. unchecked by hand, are dropped.
+        sheet_snapshot.unstamp_rows(index for index, row in rows.items() if row[lookup.SOLD_COLUMN_INDEX] != "TRUE")
+        if sold_rows := {index: row for index, row in rows.items() if row[lookup.SOLD_COLUMN_INDEX] == "TRUE"}:
+            due[sheet_shard] = sold_rows
+    archived_at = datetime.datetime.fromtimestamp(now).isoformat(sep=" ", timespec="seconds")
+    spreadsheets: dict[str, list[shard.Shard]] = {}
+    for sheet_shard in due:
+        spreadsheets.setdefault(sheet_shard.spreadsheet_id, []).append(sheet_shard)
+    for spreadsheet_id, spreadsheet_shards in spreadsheets.items():
+        has_archive = any(sheet["sheetId"] == ARCHIVE_SHEET_ID for sheet in api.get_sheets(spreadsheet_id))
+        api.batch_update(
+            spreadsheet_id=spreadsheet_id,
+            requests={"requests": [
+                *([] if has_archive else add_archive_sheet_requests()),
+                *(
+                    request for sheet_shard in spreadsheet_shards
+                    for request in archive_requests(sheet_shard, due[sheet_shard], archived_at)
+                )
+            ]}
+        )
+        for sheet_shard in spreadsheet_shards:
+            for index, row in due[sheet_shard].items():
+                sheet_lookup.snapshots[sheet_shard].update_row(index, archived_row(row[0]))
+            sheet_lookup.snapshots[sheet_shard].unstamp_rows(due[sheet_shard])
+            logger.info(f"{len(due[sheet_shard])} rows of {sheet_shard.key} were archived")
+    sheet_lookup.forget(due)
+    return sum(len(rows) for rows in due.values())
@@ -9,6 +9,7 @@ from cropsiss.cli import root
 
 
 CHROME_DATA_DIR = root.APPDIR / "chrome-user-data"
+CHROME_WORKER_DATA_DIR = root.APPDIR / "chrome-worker-data"
 DEFAULT_CHROME_ARGS = [f"--user-data-dir={CHROME_DATA_DIR}"]
 
 
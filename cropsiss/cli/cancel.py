@@ -1,6 +1,8 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
-import base64
+from concurrent import futures
+import dataclasses
 import functools
+import itertools
 import logging
 import re
 import typing as t
@@ -9,7 +11,7 @@ import click
 from selenium import webdriver
 
 import cropsiss
-from cropsiss import platforms, exceptions
+from cropsiss import archive, lookup, platforms, exceptions, shard, workers
 from cropsiss import google
 from cropsiss.cli import root, config, login, sheet, browse
 
@@ -18,11 +20,89 @@ logger = logging.getLogger(__name__)
 
 
 DONE_LABEL = "cropsiss-done"
+HISTORY_FILE = root.APPDIR / "history_id"
 
 item_ids = click.argument(
     "item_ids",
     nargs=-1,
 )
+concurrency = click.option(
+    "--concurrency", "-j",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of the browsers to cancel items with in parallel, each on its own copy of the profile"
+)
+tabs = click.option(
+    "--tabs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="The number of the tabs to cancel items in at once in one browser, instead of --concurrency"
+)
+
+
+def parse_backends(ctx: click.Context, param: click.Parameter, values: tuple[str, ...]) -> dict[str, str]:
+    """Parse the backends given as `CODE=NAME` for a platform or as `NAME` for all of the platforms supporting it."""
+    backends: dict[str, str] = {}
+    for value in values:
+        code, _, name = value.rpartition("=")
+        targets = [p for p in cropsiss.PLATFORMS if p.code == code or (not code and name in p.backends)]
+        if not targets:
+            raise click.BadParameter(f"No platform can cancel items with {value!r}", ctx, param)
+        for platform in targets:
+            if name not in platform.backends:
+                raise click.BadParameter(
+                    f"{platform.code} can cancel items only with {', '.join(platform.backends)}", ctx, param
+                )
+            backends[platform.code] = name
+    return backends
+
+
+backend = click.option(
+    "--backend",
+    multiple=True,
+    callback=parse_backends,
+    metavar="[CODE=]NAME",
+    help="The backend to cancel items with on the platform of the code, or on all of the platforms supporting it: "
+    "webdriver (default) drives Chrome with chromedriver, cdp drives Chrome directly over the DevTools Protocol, "
+    "and http submits the cancel form with the cookies of the browser, falling back to webdriver"
+)
+
+
+def parse_timeouts(
+    ctx: click.Context,
+    param: click.Parameter,
+    values: tuple[str, ...]
+) -> dict[str, dict[str, float]]:
+    """Parse the timeouts given as `CODE.STEP=SECONDS` for a platform or as `STEP=SECONDS` for all of the platforms."""
+    steps = [field.name for field in dataclasses.fields(platforms.Timeouts)]
+    timeouts: dict[str, dict[str, float]] = {}
+    for value in values:
+        target, _, seconds = value.partition("=")
+        code, _, step = target.rpartition(".")
+        codes = [p.code for p in cropsiss.PLATFORMS if p.code == code or not code]
+        if not codes or step not in steps:
+            raise click.BadParameter(
+                f"{value!r} is not [CODE.]STEP=SECONDS, where STEP is one of {', '.join(steps)}", ctx, param
+            )
+        try:
+            second = float(seconds)
+        except ValueError as err:
+            raise click.BadParameter(f"{seconds!r} of {value!r} is not seconds", ctx, param) from err
+        for platform_code in codes:
+            timeouts.setdefault(platform_code, {})[step] = second
+    return timeouts
+
+
+timeout = click.option(
+    "--timeout",
+    multiple=True,
+    callback=parse_timeouts,
+    metavar="[CODE.]STEP=SECONDS",
+    help="The seconds to wait for a step of a cancellation on the platform of the code, or on all of the platforms: "
+    "page_load for the cancel page, button for the cancel button and confirm for the page to confirm the cancellation"
+)
 
 
 @root.main.group(
@@ -34,16 +114,36 @@ def main() -> None:
 
 
 def cancel(
-    item_id: str,
+    item_ids: t.Iterable[str],
     platform: platforms.AbstractPlatform,
-    chrome_options: webdriver.ChromeOptions
+    chrome_options: webdriver.ChromeOptions,
+    concurrency: int = 1,
+    tabs: int = 1,
+    backends: dict[str, str] | None = None,
+    timeouts: dict[str, dict[str, float]] | None = None
 ) -> None:
-    try:
-        platform.cancel(item_id, chrome_options)
-        click.echo(f"{item_id}: succeeded")
-    except exceptions.NotCancelError as err:
-        logger.error(err)
-        click.echo(f"{item_id}: failed")
+    with open_cancel_pool(chrome_options, concurrency, tabs, backends, timeouts) as pool:
+        submitted = [(item_id, pool.submit(platform, item_id)) for item_id in item_ids]
+        pool.flush()
+        for item_id, future in submitted:
+            try:
+                future.result()
+                click.echo(f"{item_id}: succeeded")
+            except exceptions.NotCancelError as err:
+                logger.error(err)
+                click.echo(f"{item_id}: failed")
+
+
+def open_cancel_pool(
+    chrome_options: webdriver.ChromeOptions,
+    concurrency: int,
+    tabs: int = 1,
+    backends: dict[str, str] | None = None,
+    timeouts: dict[str, dict[str, float]] | None = None
+) -> workers.CancelPool:
+    if concurrency > 1 and tabs > 1:
+        raise click.UsageError("--concurrency and --tabs cannot be used together")
+    return workers.CancelPool(chrome_options, concurrency, browse.CHROME_WORKER_DATA_DIR, tabs, backends, timeouts)
 
 
 @main.command(
@@ -51,14 +151,20 @@ def cancel(
     help="Cancel one or more items selling on Mercari"
 )
 @item_ids
+@concurrency
+@tabs
+@backend
+@timeout
 @browse.chrome_options
 def cancel_mercari(
     item_ids: tuple[str, ...],
+    concurrency: int,
+    tabs: int,
+    backend: dict[str, str],
+    timeout: dict[str, dict[str, float]],
     chrome_options: webdriver.ChromeOptions
 ) -> None:
-    platform = platforms.Mercari()
-    for item_id in item_ids:
-        cancel(item_id, platform, chrome_options)
+    cancel(item_ids, platforms.Mercari(), chrome_options, concurrency, tabs, backend, timeout)
 
 
 @main.command(
@@ -66,14 +172,20 @@ def cancel_mercari(
     help="Cancel one or more items selling on Yahoo!Auction"
 )
 @item_ids
+@concurrency
+@tabs
+@backend
+@timeout
 @browse.chrome_options
 def cancel_yahuoku(
     item_ids: tuple[str, ...],
+    concurrency: int,
+    tabs: int,
+    backend: dict[str, str],
+    timeout: dict[str, dict[str, float]],
     chrome_options: webdriver.ChromeOptions
 ) -> None:
-    platform = platforms.YahooAuction()
-    for item_id in item_ids:
-        cancel(item_id, platform, chrome_options)
+    cancel(item_ids, platforms.YahooAuction(), chrome_options, concurrency, tabs, backend, timeout)
 
 
 @main.command(
@@ -86,11 +198,32 @@ def cancel_yahuoku(
     default="",
     help="An email is sent to the address when a cancellation is executed"
 )
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Skip searching the sold mails when no mail has arrived since the last run"
+)
+@click.option(
+    "--archive-after",
+    type=click.FloatRange(min=0),
+    default=None,
+    help="Move the rows sold more than the days ago to the archive tab at the end of the run"
+)
+@concurrency
+@tabs
+@backend
+@timeout
 @browse.chrome_options
 @login.credentials_option
 @config.config_file_option
 def cancel_through_mail(
     mail_to: str,
+    incremental: bool,
+    archive_after: float | None,
+    concurrency: int,
+    tabs: int,
+    backend: dict[str, str],
+    timeout: dict[str, dict[str, float]],
     chrome_options: webdriver.ChromeOptions,
     credentials: google.Credentials,
     config_file: str
@@ -98,52 +231,148 @@ def cancel_through_mail(
     cfg = config.Config.load(config_file)
     sheet_api = google.SpreadsheetAPI(credentials)
     gmail_api = google.GmailAPI(credentials)
-    system = root.System(gmail_api)
-    RANGE = f"A2:{sheet.SOLD_COLUMN}"
-    values = sheet_api.get_values(
-        spreadsheet_id=cfg.spreadsheet_id,
-        range=RANGE,
-        major_dimension="ROWS"
-    )
-    logger.info(f"Getting values of {RANGE} on the Google Spreadsheet succeeded")
-    logger.debug(
-        f"The values of {RANGE}:\n"
-        "\n".join(f"row {i}: {row}" for (i, row) in enumerate(values))
-    )
-    for platform in cropsiss.PLATFORMS:
-        item_id_to_index = {
-            str(row[platform.column_index]): idx
-            for idx, row in enumerate(values)
-            if row[platform.column_index]
-        }
-        for item_id in filter(item_id_to_index.__contains__, generate_sold_item_ids(gmail_api, platform)):
-            index = item_id_to_index[item_id]
-            update_sold_to_true(sheet_api, cfg.spreadsheet_id, index)
-            row = [str(val) for val in values[index]]
-            cropsiss_id = row[0]
-            logger.info(f"Item:{cropsiss_id} should be canceled")
-            for platform_to_cancel in filter(lambda p: p.id != platform.id, cropsiss.PLATFORMS):
-                if item_id := row[platform_to_cancel.column_index]:
-                    try:
-                        platform_to_cancel.cancel(item_id, chrome_options)
-                        logger.info(f"{item_id} of {platform_to_cancel.name} was canceled")
-                        if mail_to:
-                            system.notify_success(
-                                mail_to=mail_to,
-                                platform=platform_to_cancel,
-                                item_id=item_id,
-                                cropsiss_id=cropsiss_id
-                            )
-                    except exceptions.NotCancelError as err:
-                        logger.error(err)
-                        logger.error(f"Faild cancelling {cropsiss_id} - {item_id} on {platform_to_cancel.name}")
-                        if mail_to:
-                            system.notify_fail(
-                                mail_to=mail_to,
-                                platform=platform_to_cancel,
-                                item_id=item_id,
-                                cropsiss_id=cropsiss_id
-                            )
+    # Sold flags left in the journal by the previous run are replayed when the buffer is created.
+    with google.SpreadsheetWriteBuffer(sheet_api, sheet.JOURNAL_FILE) as sheet_buffer:
+        if incremental:
+            new_mail_ids, history_id = sync_history(gmail_api)
+            # The new mails only tell whether to search at all. The search is not narrowed down to them,
+            # since it may lag behind the history, and the done-label keeps the processed mails out of it.
+            if new_mail_ids is not None and not new_mail_ids:
+                logger.info("No new mail has arrived since the last run")
+                save_history_id(history_id)
+                return
+        system = root.System(gmail_api)
+        with lookup.ShardedLookup(sheet_api, sheet.get_router(cfg), sheet.SNAPSHOT_FILE) as sheet_lookup, \
+                open_cancel_pool(chrome_options, concurrency, tabs, backend, timeout) as pool:
+            notifications: list[futures.Future[None]] = []
+
+            def finish_cancellations() -> None:
+                pool.flush()
+                futures.wait(notifications)
+                notifications.clear()
+
+            for platform in cropsiss.PLATFORMS:
+                # The mails of a chunk are labeled only after the cancellations of its items have been notified,
+                # so that the mails are processed again by the next run if it is interrupted meanwhile.
+                for sold_item_id in generate_sold_item_ids(gmail_api, platform, finish_cancellations):
+                    if (found := sheet_lookup.find(platform.column_index, sold_item_id)) is None:
+                        continue
+                    sold_shard, index, row = found
+                    update_sold_to_true(sheet_buffer, sold_shard, [index])
+                    sheet_lookup.snapshots[sold_shard].update_row(index, [*row[:lookup.SOLD_COLUMN_INDEX], "TRUE"])
+                    sheet_lookup.snapshots[sold_shard].stamp_row(index)
+                    notifications.extend(
+                        cancel_on_other_platforms(platform, row, chrome_options, system, mail_to, pool)
+                    )
+            finish_cancellations()
+            if archive_after is not None:
+                # The sold flags must be on the sheet before the rows are read for the archival.
+                sheet_buffer.flush()
+                archived = archive.archive_sold_rows(sheet_api, sheet_lookup, archive_after)
+                logger.info(f"{archived} sold rows were archived")
+        if incremental:
+            save_history_id(history_id)
+
+
+def cancel_on_other_platforms(
+    sold_platform: platforms.AbstractPlatform,
+    row: list[str],
+    chrome_options: webdriver.ChromeOptions,
+    system: root.System,
+    mail_to: str,
+    pool: workers.CancelPool | None = None
+) -> list["futures.Future[None]"]:
+    """Cancel the item of the row on the platforms but the sold one, and notify the results.
+
+    With a pool of more than one worker or tab, this returns without waiting for the cancellations,
+    and the results are notified as they are done.
+
+    Returns
+    -------
+    list[concurrent.futures.Future[None]]
+        The futures which are done once the results of the cancellations have been notified.
+    """
+    cropsiss_id = row[0]
+    logger.info(f"Item:{cropsiss_id} should be canceled")
+    pool = pool or workers.CancelPool(chrome_options)
+    notifications: list[futures.Future[None]] = []
+    for platform in filter(lambda p: p.id != sold_platform.id, cropsiss.PLATFORMS):
+        if item_id := row[platform.column_index]:
+            notification: futures.Future[None] = futures.Future()
+            future = pool.submit(platform, item_id)
+            future.add_done_callback(
+                functools.partial(notify_cancellation, platform, item_id, cropsiss_id, system, mail_to)
+            )
+            # The callbacks are called in the order they were added, i.e. after the result has been notified.
+            future.add_done_callback(functools.partial(mark_notified, notification))
+            notifications.append(notification)
+    return notifications
+
+
+def notify_cancellation(
+    platform: platforms.AbstractPlatform,
+    item_id: str,
+    cropsiss_id: str,
+    system: root.System,
+    mail_to: str,
+    future: "futures.Future[None]"
+) -> None:
+    try:
+        future.result()
+    except Exception as err:
+        # Not only NotCancelError but any error, e.g. of the browser or of a dead worker, fails the cancellation.
+        logger.error(err, exc_info=not isinstance(err, exceptions.NotCancelError))
+        logger.error(f"Faild cancelling {cropsiss_id} - {item_id} on {platform.name}")
+        if mail_to:
+            system.notify_fail(
+                mail_to=mail_to,
+                platform=platform,
+                item_id=item_id,
+                cropsiss_id=cropsiss_id
+            )
+    else:
+        logger.info(f"{item_id} of {platform.name} was canceled")
+        if mail_to:
+            system.notify_success(
+                mail_to=mail_to,
+                platform=platform,
+                item_id=item_id,
+                cropsiss_id=cropsiss_id
+            )
+
+
+def mark_notified(notification: "futures.Future[None]", future: "futures.Future[None]") -> None:
+    notification.set_result(None)
+
+
+def load_history_id() -> str:
+    try:
+        with open(HISTORY_FILE) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+def save_history_id(history_id: str) -> None:
+    with open(HISTORY_FILE, "w") as f:
+        f.write(history_id)
+    logger.info(f"History:{history_id} was saved as the last synced history")
+
+
+def sync_history(api: google.GmailAPI) -> tuple[set[str] | None, str]:
+    """Get the IDs of the mails added since the last run and the current history ID.
+
+    The mails are the ones added with any label, including the ones a filter skipped the inbox for.
+    The IDs are None if all of the mails must be searched, i.e. on the first run or when the last history has expired.
+    """
+    if start_history_id := load_history_id():
+        try:
+            mail_ids, history_id = api.list_history(start_history_id)
+            logger.info(f"{len(mail_ids)} mails have arrived since History:{start_history_id}")
+            return set(mail_ids), history_id
+        except exceptions.HistoryExpiredError:
+            logger.warning(f"History:{start_history_id} has expired. Falling back to a full search")
+    return None, api.get_history_id()
 
 
 @functools.lru_cache()
@@ -163,35 +392,51 @@ def generate_sold_mail_ids(
     api: google.GmailAPI,
     platform: platforms.AbstractPlatform
 ) -> t.Generator[str, None, None]:
-    DONELABEL_ID = get_donelabel_id(api)
+    """Generate the IDs of the sold mails without the done-label."""
     QUERY = platform.sold_mail_query + " AND -{label:" + DONE_LABEL + "}"
-    for mail_id in api.search_mail(QUERY):
-        yield mail_id
-        api.add_labels(mail_id, [DONELABEL_ID])
-        logger.info(f"The done-label was added to Mail: {mail_id}")
+    yield from api.iter_search_mail(QUERY)
 
 
 def generate_sold_item_ids(
     api: google.GmailAPI,
-    platform: platforms.AbstractPlatform
+    platform: platforms.AbstractPlatform,
+    before_labeling: t.Callable[[], None] | None = None
 ) -> t.Generator[str, None, None]:
-    for mail_id in generate_sold_mail_ids(api, platform):
-        gmail = api.get_mail(mail_id)
-        body = base64.urlsafe_b64decode(gmail["payload"]["body"]["data"]).decode("utf-8")
-        if match := re.search(platform.item_id_pattern, body):
-            yield match[0]
+    """Generate the item IDs in the sold mails, and add the done-label to the mails by chunks.
+
+    `before_labeling` is called after the items of a chunk have been processed and before its mails are labeled.
+    """
+    DONELABEL_ID = get_donelabel_id(api)
+    # The search excludes the labeled mails, so all of its pages are read before any mail is labeled,
+    # since the page tokens are not guaranteed to be stable while the results change.
+    mail_ids = iter(list(generate_sold_mail_ids(api, platform)))
+    while chunk := list(itertools.islice(mail_ids, google.mail.BATCH_SIZE)):
+        # The mails which were not found, e.g. deleted meanwhile, are not fetched and not labeled.
+        fetched: list[str] = []
+        for gmail in api.get_mails(chunk, fields=google.mail.BODY_FIELDS):
+            fetched.append(str(gmail["id"]))
+            body = google.mail.get_body_text(gmail)
+            if match := re.search(platform.item_id_pattern, body):
+                yield match[0]
+        # The done-label is added after the items of the chunk have been processed.
+        if fetched:
+            if before_labeling is not None:
+                before_labeling()
+            api.batch_add_labels(fetched, [DONELABEL_ID])
+            logger.info(f"The done-label was added to Mails: {', '.join(fetched)}")
 
 
 def update_sold_to_true(
-    api: google.SpreadsheetAPI,
-    spreadsheet_id: str,
-    index: int
+    api: google.SpreadsheetWriteBuffer,
+    sheet_shard: shard.Shard,
+    indexes: t.Iterable[int]
 ) -> None:
-    RANGE = f"{sheet.SOLD_COLUMN}{index+2}"
-    api.update_values(
-        spreadsheet_id=spreadsheet_id,
-        range=RANGE,
-        values=[["TRUE"]],
-        input_option="USER_ENTERED"
-    )
-    logger.info(f"The value of {RANGE} was updated to TRUE")
+    for index in indexes:
+        RANGE = sheet_shard.a1(f"{lookup.SOLD_COLUMN}{index+2}")
+        api.update_values(
+            spreadsheet_id=sheet_shard.spreadsheet_id,
+            range=RANGE,
+            values=[["TRUE"]],
+            input_option="USER_ENTERED"
+        )
+        logger.info(f"The value of {RANGE} will be updated to TRUE")
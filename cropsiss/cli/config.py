@@ -20,6 +20,8 @@ class Config:
     spreadsheet_id: str = ""        # required
     client_id: str = ""             # optional
     client_secret: str = ""         # optional
+    shard_tabs: str = "1"           # optional
+    shard_spreadsheet_ids: str = ""  # optional, comma-separated
 
     @property
     def required_fields(self) -> list[str]:
@@ -92,6 +92,10 @@ class RootGroup(click.Group):
             exit(f"The required fields of config are not sufficient.\n{err}")
         except exceptions.GoogleCredentialsInvalidError:  # pragma: no cover
             exit("No credentials. Run `cropsiss login`.")
+        except exceptions.ShardSheetConflictError as err:  # pragma: no cover
+            exit(f"{err}\nRename or move the tab, or change shard_tabs of config.")
+        except exceptions.ShardLayoutChangedError as err:  # pragma: no cover
+            exit(f"{err}\nRestore shard_tabs and shard_spreadsheet_ids of config.")
 
 
 @click.group(
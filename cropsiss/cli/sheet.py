@@ -1,18 +1,30 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 import logging
+import typing as t
 import webbrowser
 
 import click
+from googleapiclient import errors
 
 import cropsiss
-from cropsiss import google
+from cropsiss import archive, google, ids, layout, lookup, shard
 from cropsiss.cli import root, config, login
 
 
 logger = logging.getLogger(__name__)
 
-SOLD_COLUMN = "E"
-SOLD_COLUMN_INDEX = ord(SOLD_COLUMN) - 65
+SOLD_COLUMN = lookup.SOLD_COLUMN
+SOLD_COLUMN_INDEX = lookup.SOLD_COLUMN_INDEX
+JOURNAL_FILE = root.APPDIR / "sheet-journal.jsonl"
+SNAPSHOT_FILE = root.APPDIR / "sheet-snapshot.sqlite3"
+INITIAL_ID_COUNT = 999
+ARCHIVE_DAYS = 30.0
+
+
+def get_router(cfg: config.Config) -> shard.ShardRouter:
+    """Get the router to the shards configured by `shard_tabs` and `shard_spreadsheet_ids`."""
+    spreadsheet_ids = [cfg.spreadsheet_id, *filter(None, map(str.strip, cfg.shard_spreadsheet_ids.split(",")))]
+    return shard.ShardRouter(shard.make_shards(spreadsheet_ids, int(cfg.shard_tabs)))
 
 
 @root.main.group(
@@ -23,16 +35,35 @@ def main() -> None:
     pass
 
 
-CLEAR = {
-    "deleteRange": {
-        "range": {
-            "sheetId": 0,
-            "startColumnIndex": 0,
-            "endColumnIndex": SOLD_COLUMN_INDEX + 1
-        },
-        "shiftDimension": "COLUMNS"
+CLEAR: list[dict[str, t.Any]] = [
+    {
+        "updateCells": {
+            "range": {
+                "sheetId": 0,
+                "startRowIndex": 1,
+                "startColumnIndex": 0,
+                "endColumnIndex": SOLD_COLUMN_INDEX
+            },
+            "fields": "userEnteredValue"
+        }
+    },
+    {
+        "repeatCell": {
+            "range": {
+                "sheetId": 0,
+                "startRowIndex": 1,
+                "startColumnIndex": SOLD_COLUMN_INDEX,
+                "endColumnIndex": SOLD_COLUMN_INDEX + 1
+            },
+            "cell": {
+                "userEnteredValue": {
+                    "boolValue": False
+                }
+            },
+            "fields": "userEnteredValue"
+        }
     }
-}
+]
 SET_SHEET_NAME = {
     "updateSheetProperties": {
         "properties": {
@@ -299,7 +330,7 @@ FORMAT_YAHUOKU_COLUMN = [
         }
     }
 ]
-FORMAT_SOLD_COLUMN = [
+FORMAT_SOLD_COLUMN: list[dict[str, t.Any]] = [
     {
         "updateDimensionProperties": {
             "range": {
@@ -397,7 +428,7 @@ FORMAT_SOLD_COLUMN = [
         }
     }
 ]
-INIT_REQUESTS = [
+INIT_REQUESTS: list[dict[str, t.Any]] = [
     SET_SHEET_NAME,
     *FORMAT_NAME_CULUMN,
     *FORMAT_CROPSISS_COLUMN,
@@ -414,7 +445,7 @@ INIT_REQUESTS = [
 @click.option(
     "--clear",
     is_flag=True,
-    help=f"Clear all of the cells in A:{SOLD_COLUMN}"
+    help=f"Clear the items in A:{SOLD_COLUMN}"
 )
 @login.credentials_option
 @config.config_file_option
@@ -425,20 +456,53 @@ def init_sheet(
 ) -> None:
     cfg = config.Config.load(config_file)
     SHEET_API = google.SpreadsheetAPI(credentials)
-    requests = [CLEAR, *INIT_REQUESTS] if clear else INIT_REQUESTS
-    SHEET_API.batch_update(
-        spreadsheet_id=cfg.spreadsheet_id,
-        requests={"requests": requests}
-    )
-    SHEET_API.update_values(
-        spreadsheet_id=cfg.spreadsheet_id,
-        range="A2:A1000",
-        values=[[f"c{i:05}" for i in range(1, 1000)]],
-        major_dimension="COLUMNS"
+    ROUTER = get_router(cfg)
+    layout.add_shard_sheets(SHEET_API, ROUTER)
+    SPREADSHEETS: dict[str, list[shard.Shard]] = {}
+    for sheet_shard in ROUTER.shards:
+        SPREADSHEETS.setdefault(sheet_shard.spreadsheet_id, []).append(sheet_shard)
+    ROUTER.fan_out(
+        lambda s: layout.init_spreadsheet(
+            SHEET_API, SPREADSHEETS[s.spreadsheet_id], INIT_REQUESTS, CLEAR if clear else []
+        ),
+        [shards[0] for shards in SPREADSHEETS.values()]
     )
+    with lookup.ShardedLookup(SHEET_API, ROUTER, SNAPSHOT_FILE) as LOOKUP:
+        ALLOCATOR = ids.IdAllocator(SHEET_API, ROUTER, LOOKUP.snapshots)
+        if clear:
+            for SNAPSHOT in LOOKUP.snapshots.values():
+                SNAPSHOT.refresh([])
+            ALLOCATOR.reset()
+        if (number := INITIAL_ID_COUNT - ALLOCATOR.count) > 0:
+            ALLOCATOR.allocate(number)
     click.echo("Initialized the Google Spreadsheet")
 
 
+@main.command(
+    name="add",
+    help="Add new cropsiss IDs to the Google Spreadsheet"
+)
+@click.option(
+    "--number", "-n",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of the IDs to add"
+)
+@login.credentials_option
+@config.config_file_option
+def add_ids(
+    number: int,
+    credentials: google.Credentials,
+    config_file: str
+) -> None:
+    cfg = config.Config.load(config_file)
+    SHEET_API = google.SpreadsheetAPI(credentials)
+    ROUTER = get_router(cfg)
+    with lookup.ShardedLookup(SHEET_API, ROUTER, SNAPSHOT_FILE) as LOOKUP:
+        CROPSISS_IDS = ids.IdAllocator(SHEET_API, ROUTER, LOOKUP.snapshots).allocate(number)
+    click.echo(f"Added {CROPSISS_IDS[0]} to {CROPSISS_IDS[-1]}")
+
+
 @main.command(
     name="open",
     help="Open the Google Spreadsheet"
@@ -485,20 +549,74 @@ def update_sheet(
 ) -> None:
     cfg = config.Config.load(config_file)
     SHEET_API = google.SpreadsheetAPI(credentials)
-    CROPSISS_IDS = SHEET_API.get_values(
-        spreadsheet_id=cfg.spreadsheet_id,
-        range="A2:A",
-        major_dimension="COLUMNS"
-    )[0]
-    try:
-        idx = CROPSISS_IDS.index(cropsiss_id)
-    except ValueError:
-        exit(f"cropsissID-{cropsiss_id} does not exist on the Google Spreadsheet")
-    COLUMNS: dict[str, str] = {p.code: chr(p.column_index+65) for p in cropsiss.PLATFORMS}
-    CELL = f"{COLUMNS[platform]}{idx+2}"
-    SHEET_API.update_values(
-        spreadsheet_id=cfg.spreadsheet_id,
-        range=CELL,
-        values=[[value]]
-    )
+    with lookup.ShardedLookup(SHEET_API, get_router(cfg), SNAPSHOT_FILE) as LOOKUP:
+        if (found := LOOKUP.find(0, cropsiss_id)) is None:
+            exit(f"cropsissID-{cropsiss_id} does not exist on the Google Spreadsheet")
+        SHARD, idx, row = found
+        if archive.is_archived(row):
+            exit(f"cropsissID-{cropsiss_id} has been archived. Please allocate a new one")
+        COLUMNS: dict[str, int] = {p.code: p.column_index for p in cropsiss.PLATFORMS}
+        CELL = SHARD.a1(f"{shard.column_letter(COLUMNS[platform])}{idx+2}")
+        SHEET_API.update_values(
+            spreadsheet_id=SHARD.spreadsheet_id,
+            range=CELL,
+            values=[[value]]
+        )
+        row[COLUMNS[platform]] = value
+        LOOKUP.snapshots[SHARD].update_row(idx, row)
+        try:
+            SHEET_API.batch_update(
+                spreadsheet_id=SHARD.spreadsheet_id,
+                requests={"requests": lookup.tag_requests(idx, row, SHARD.sheet_id)}
+            )
+        except errors.HttpError as err:
+            # The row is still found through the snapshot or by reading the sheet.
+            logger.warning(f"Tagging the row {idx+2} of {SHARD.key} failed: {err}")
     click.echo(f"Updated {CELL} to {value}")
+
+
+@main.command(
+    name="tag",
+    help="Tag the rows on the Google Spreadsheet with their IDs for server-side lookups"
+)
+@login.credentials_option
+@config.config_file_option
+def tag_sheet(
+    credentials: google.Credentials,
+    config_file: str
+) -> None:
+    cfg = config.Config.load(config_file)
+    SHEET_API = google.SpreadsheetAPI(credentials)
+    ROUTER = get_router(cfg)
+    RESULTS = ROUTER.fan_out(lambda s: lookup.tag_rows(SHEET_API, s))
+    click.echo(f"Tagged {sum(tagged for tagged, _ in RESULTS)} rows")
+    if UNTAGGED := sum(untagged for _, untagged in RESULTS):
+        click.echo(
+            f"{UNTAGGED} rows were left untagged, since the tags of a sheet are limited to "
+            f"{lookup.METADATA_CHAR_LIMIT} characters. They are still found by reading the sheet"
+        )
+
+
+@main.command(
+    name="archive",
+    help="Move the sold rows to the archive tab of the Google Spreadsheet"
+)
+@click.option(
+    "--older-than",
+    type=click.FloatRange(min=0),
+    default=ARCHIVE_DAYS,
+    show_default=True,
+    help="Archive the rows sold more than the days ago"
+)
+@login.credentials_option
+@config.config_file_option
+def archive_sheet(
+    older_than: float,
+    credentials: google.Credentials,
+    config_file: str
+) -> None:
+    cfg = config.Config.load(config_file)
+    SHEET_API = google.SpreadsheetAPI(credentials)
+    with lookup.ShardedLookup(SHEET_API, get_router(cfg), SNAPSHOT_FILE) as LOOKUP:
+        COUNT = archive.archive_sold_rows(SHEET_API, LOOKUP, older_than, scan=True)
+    click.echo(f"Archived {COUNT} rows")
@@ -15,3 +15,23 @@ class GoogleCredentialsInvalidError(Exception):
 
 class NotCancelError(Exception):
     """Raises on error when canceling"""
+
+
+class UnexpectedResponseError(NotCancelError):
+    """Raises when a platform responds unexpectedly to a cancellation over HTTP"""
+
+
+class CDPError(Exception):
+    """Raises when Chrome can't be driven over the DevTools Protocol"""
+
+
+class HistoryExpiredError(Exception):
+    """Raises when the start history ID of Gmail is no longer available"""
+
+
+class ShardSheetConflictError(Exception):
+    """Raises when a tab of the spreadsheet has the sheet ID or the title of a shard but not both"""
+
+
+class ShardLayoutChangedError(Exception):
+    """Raises when the shards are configured differently from the ones the IDs were allocated on"""
@@ -5,11 +5,13 @@ from .credentials import Credentials
 from .abstract import AbstractAPI
 from .mail import GmailAPI
 from .sheet import SpreadsheetAPI
+from .buffer import SpreadsheetWriteBuffer
 
 
 __all__ = [
     "Credentials",
     "AbstractAPI",
     "GmailAPI",
-    "SpreadsheetAPI"
+    "SpreadsheetAPI",
+    "SpreadsheetWriteBuffer"
 ]
@@ -1,13 +1,20 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 import abc
 import dataclasses
+import threading
 import typing as t
 
-from googleapiclient import discovery
+import google_auth_httplib2
+from googleapiclient import discovery, http
 
 from cropsiss.google import credentials
 
 
+ServiceKey = tuple[str, str | None, int]
+
+_local = threading.local()
+
+
 @dataclasses.dataclass()  # type: ignore[misc]
 class AbstractAPI(abc.ABC):
     """Abstract class for Google API."""
@@ -38,5 +45,57 @@ def build_service(api: AbstractAPI) -> t.Any:
     return discovery.build(
         serviceName=api.service_name,
         version=api.version,
-        credentials=api.credentials._credentials
+        credentials=api.credentials._credentials,
+        cache_discovery=False,
+        static_discovery=True
     )
+
+
+def get_service(api: AbstractAPI) -> t.Any:
+    """Get a Resource for interacting with an API, building it only once.
+
+    Resources are cached per thread, because the HTTP client of a Resource is not thread-safe,
+    and keyed on the service name, the version and the credentials of the API.
+    The cache of a thread is dropped together with the thread.
+
+    Parameters
+    ----------
+    api : cropsiss.google.abstract.AbstractAPI
+        An API to interact.
+
+    Returns
+    -------
+    Any
+       A Resource object with methods for interacting with the service.
+    """
+    services = _thread_services()
+    key = (api.service_name, api.version, id(api.credentials))
+    cached = services.get(key)
+    if cached is None or cached[0] is not api.credentials:
+        cached = (api.credentials, build_service(api))
+        services[key] = cached
+    return cached[1]
+
+
+def _thread_services() -> dict[ServiceKey, tuple[credentials.Credentials, t.Any]]:
+    services: dict[ServiceKey, tuple[credentials.Credentials, t.Any]] = _local.__dict__.setdefault("services", {})
+    return services
+
+
+def new_http(api: AbstractAPI) -> t.Any:
+    """Construct a new authorized HTTP client for an API.
+
+    httplib2 is not thread-safe, so a request executed on a thread other than the one
+    using the cached Resource must be given its own client, e.g. `request.execute(http=new_http(api))`.
+
+    Parameters
+    ----------
+    api : cropsiss.google.abstract.AbstractAPI
+        An API to interact.
+
+    Returns
+    -------
+    Any
+       An HTTP client authorized with the credentials of the API.
+    """
+    return google_auth_httplib2.AuthorizedHttp(api.credentials._credentials, http=http.build_http())
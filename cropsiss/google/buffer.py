@@ -0,0 +1,148 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+import dataclasses
+import json
+import logging
+import os
+import time
+import types
+import typing as t
+
+from cropsiss.google import sheet
+
+
+logger = logging.getLogger(__name__)
+
+InputOption = t.Literal["RAW", "USER_ENTERED"]
+
+
+@dataclasses.dataclass()
+class SpreadsheetWriteBuffer:
+    """Write-behind buffer in front of `SpreadsheetAPI.update_values`.
+
+    Writes are appended to a journal file and kept in memory, where repeated writes to the same range are merged.
+    They are flushed as one batch update per spreadsheet when the buffer holds `max_size` ranges,
+    when `max_delay` seconds have passed since the oldest pending write, or when the buffer is closed.
+    The journal is cleared only after a successful flush, so the writes left in it are replayed
+    by the next buffer created on the same journal file.
+    """
+    api: sheet.SpreadsheetAPI
+    """The API to flush the writes through."""
+    journal_file: str | os.PathLike[str]
+    """The path to the append-only journal."""
+    max_size: int = 100
+    """The number of pending ranges to trigger a flush."""
+    max_delay: float = 10.0
+    """The seconds since the oldest pending write to trigger a flush."""
+    _pending: dict[tuple[str, InputOption], dict[str, list[list[str]]]] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+    _oldest: float | None = dataclasses.field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.replay()
+
+    def __len__(self) -> int:
+        return sum(len(data) for data in self._pending.values())
+
+    def __enter__(self) -> "SpreadsheetWriteBuffer":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: types.TracebackType | None
+    ) -> None:
+        self.close()
+
+    def replay(self) -> int:
+        """Load the writes left in the journal into the buffer.
+
+        Returns
+        -------
+        int
+            The number of the loaded writes.
+        """
+        count = 0
+        try:
+            with open(self.journal_file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipped a broken entry in {self.journal_file}: {line!r}")
+                        continue
+                    self._buffer(entry["spreadsheet_id"], entry["range"], entry["values"], entry["input_option"])
+                    count += 1
+        except FileNotFoundError:
+            pass
+        if count:
+            logger.info(f"{count} writes were loaded from {self.journal_file}")
+        return count
+
+    def update_values(
+        self,
+        spreadsheet_id: str,
+        range: str,
+        values: list[list[str]],
+        input_option: InputOption = "RAW"
+    ) -> None:
+        """Set values in a range of a spreadsheet, behind the buffer.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet to update.
+        range : str
+            The A1 notation of the values to update.
+            Only writes to the same notation are merged.
+        values : list[list[str]]
+            The values in the row-major order.
+        input_option : Literal["RAW", "USER_ENTERED"]
+            How the input data should be interpreted.
+        """
+        entry = {"spreadsheet_id": spreadsheet_id, "range": range, "values": values, "input_option": input_option}
+        with open(self.journal_file, "a") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer(spreadsheet_id, range, values, input_option)
+        if len(self) >= self.max_size or (
+            self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+        ):
+            self._try_flush()
+
+    def flush(self) -> None:
+        """Write all of the pending values to the spreadsheets.
+
+        The pending values are kept if any of the batch updates fails.
+        """
+        for (spreadsheet_id, input_option), data in self._pending.items():
+            self.api.batch_update_values(
+                spreadsheet_id=spreadsheet_id,
+                data=data,
+                input_option=input_option
+            )
+        logger.info(f"{len(self)} writes were flushed")
+        self._pending.clear()
+        self._oldest = None
+        with open(self.journal_file, "w"):
+            pass
+
+    def close(self) -> None:
+        """Flush the pending values, leaving them in the journal on failure."""
+        if self._pending and not self._try_flush():
+            logger.error(f"{len(self)} writes remain in {self.journal_file} and will be replayed")
+
+    def _buffer(self, spreadsheet_id: str, range: str, values: list[list[str]], input_option: InputOption) -> None:
+        self._pending.setdefault((spreadsheet_id, input_option), {})[range] = values
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def _try_flush(self) -> bool:
+        try:
+            self.flush()
+            return True
+        except Exception as err:
+            logger.warning(f"Flushing {len(self)} writes failed: {err}")
+            return False
@@ -2,11 +2,33 @@
 import base64
 from email.mime import text
 import dataclasses
+import itertools
+import logging
+import time
 import typing as t
 
+from googleapiclient import errors
+
+from cropsiss import exceptions
 from cropsiss.google import abstract
 
 
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+"""The maximum number of calls in a batch request, above which Gmail is likely to limit the rate."""
+BATCH_RETRIES = 5
+"""The maximum number of times to retry the calls of a batch request which failed temporarily."""
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+"""The HTTP statuses of the temporary failures."""
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+"""The reasons of the 403 errors by the rate limit, which are temporary failures as well."""
+BATCH_MODIFY_SIZE = 1000
+"""The maximum number of message IDs in a batchModify request."""
+BODY_FIELDS = "id,payload(mimeType,body/data,parts(mimeType,body/data,parts(mimeType,body/data)))"
+"""The partial response fields to get only the ID and the body of a message."""
+
+
 @dataclasses.dataclass()
 class GmailAPI(abstract.AbstractAPI):
     user_id: str = "me"
@@ -21,7 +43,7 @@ class GmailAPI(abstract.AbstractAPI):
 
     @property
     def _service(self) -> t.Any:
-        return abstract.build_service(self)
+        return abstract.get_service(self)
 
     def send_email(
         self,
@@ -79,6 +101,51 @@ class GmailAPI(abstract.AbstractAPI):
         ).execute().get("messages", [])
         return [message["id"] for message in messages]
 
+    def iter_search_mail(
+        self,
+        query: str = "",
+        page_size: int = 100,
+        limit: int | None = None
+    ) -> t.Iterator[str]:
+        """Iterate over Gmail IDs in the mailbox, following the page tokens lazily.
+
+        Parameters
+        ----------
+        query : str
+            The same query as the Gmail search box.
+        page_size : int
+            Maximum number of messages to request per page.
+        limit : int | None
+            Maximum number of messages to yield in total. If None, all of the messages are yielded.
+
+        Yields
+        ------
+        str
+            Mail ID.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/reference/rest/v1/users.messages/list
+        """
+        count = 0
+        page_token: str | None = None
+        while limit is None or count < limit:
+            kwargs: dict[str, t.Any] = {
+                "userId": self.user_id,
+                "q": str(query),
+                "maxResults": page_size if limit is None else min(page_size, limit - count),
+                "fields": "messages/id,nextPageToken"
+            }
+            if page_token:
+                kwargs["pageToken"] = page_token
+            response = self._service.users().messages().list(**kwargs).execute()
+            for message in response.get("messages", []):
+                yield str(message["id"])
+                count += 1
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+
     def get_mail(self, mail_id: str) -> dict[str, t.Any]:
         """Get the specified Gmail message.
 
@@ -101,6 +168,156 @@ class GmailAPI(abstract.AbstractAPI):
         gmail = self._service.users().messages().get(userId="me", id=mail_id).execute()
         return {str(key): gmail[key] for key in gmail}
 
+    def get_mails(
+        self,
+        mail_ids: t.Iterable[str],
+        fields: str | None = None
+    ) -> t.Iterator[dict[str, t.Any]]:
+        """Get the specified Gmail messages through batch requests.
+
+        Up to `BATCH_SIZE` messages are fetched in a single HTTP request.
+        The calls which failed temporarily, e.g. by the rate limit, are retried in another batch
+        with an exponential backoff, and the messages which are not found are skipped.
+
+        Parameters
+        ----------
+        mail_ids : Iterable[str]
+            Gmail IDs.
+        fields : str | None
+            If specified, only the fields are included in the response, e.g. `BODY_FIELDS`.
+
+        Yields
+        ------
+        dict[str, Any]
+            Gmail object, in the same order as `mail_ids`.
+
+        Raises
+        ------
+        googleapiclient.errors.HttpError
+            If a call failed for another reason, or still failed after `BATCH_RETRIES` retries.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/guides/batch
+        """
+        kwargs: dict[str, t.Any] = {"userId": self.user_id}
+        if fields:
+            kwargs.update(format="full", fields=fields)
+        _mail_ids = iter(mail_ids)
+        while chunk := list(itertools.islice(_mail_ids, BATCH_SIZE)):
+            gmails: dict[str, t.Any] = {}
+            pending = chunk
+            for retry in itertools.count():
+                fetched, failed = self._execute_batch_get(pending, kwargs)
+                gmails.update(fetched)
+                if not failed:
+                    break
+                permanent = [err for err in failed.values() if not is_temporary_error(err)]
+                if permanent or retry >= BATCH_RETRIES:
+                    raise (permanent or list(failed.values()))[0]
+                delay = 2 ** retry
+                logger.warning(f"Fetching {len(failed)} mails failed temporarily. Retrying in {delay} seconds")
+                time.sleep(delay)
+                pending = list(failed)
+            for mail_id in chunk:
+                if (gmail := gmails.get(mail_id)) is not None:
+                    yield {str(key): gmail[key] for key in gmail}
+
+    def _execute_batch_get(
+        self,
+        mail_ids: list[str],
+        kwargs: dict[str, t.Any]
+    ) -> tuple[dict[str, t.Any], dict[str, Exception]]:
+        gmails: dict[str, t.Any] = {}
+        failed: dict[str, Exception] = {}
+
+        def callback(request_id: str, response: t.Any, exception: Exception | None) -> None:
+            mail_id = mail_ids[int(request_id)]
+            if exception is None:
+                gmails[mail_id] = response
+            elif isinstance(exception, errors.HttpError) and exception.resp.status == 404:
+                logger.warning(f"Mail:{mail_id} was skipped since it was not found")
+            else:
+                failed[mail_id] = exception
+
+        batch = self._service.new_batch_http_request(callback=callback)
+        for i, mail_id in enumerate(mail_ids):
+            batch.add(
+                self._service.users().messages().get(id=mail_id, **kwargs),
+                request_id=str(i)
+            )
+        batch.execute()
+        return gmails, failed
+
+    def get_history_id(self) -> str:
+        """Get the ID of the current history record of the mailbox.
+
+        Returns
+        -------
+        str
+            The current history ID.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/reference/rest/v1/users/getProfile
+        """
+        profile = self._service.users().getProfile(
+            userId=self.user_id,
+            fields="historyId"
+        ).execute()
+        return str(profile["historyId"])
+
+    def list_history(
+        self,
+        start_history_id: str,
+        label_id: str | None = None
+    ) -> tuple[list[str], str]:
+        """List the messages added to the mailbox since the specified history record.
+
+        Parameters
+        ----------
+        start_history_id : str
+            The history ID to start listing from.
+        label_id : str | None
+            If specified, only the messages with the label are listed.
+
+        Returns
+        -------
+        tuple[list[str], str]
+            List of the added mail IDs and the current history ID.
+
+        Raises
+        ------
+        cropsiss.exceptions.HistoryExpiredError
+            If the start history ID is out of date.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/reference/rest/v1/users.history/list
+        """
+        mail_ids: list[str] = []
+        kwargs: dict[str, t.Any] = {
+            "userId": self.user_id,
+            "startHistoryId": start_history_id,
+            "historyTypes": ["messageAdded"],
+            "fields": "history/messagesAdded/message/id,historyId,nextPageToken"
+        }
+        if label_id:
+            kwargs["labelId"] = label_id
+        while True:
+            try:
+                response = self._service.users().history().list(**kwargs).execute()
+            except errors.HttpError as err:
+                if err.resp.status == 404:
+                    raise exceptions.HistoryExpiredError(start_history_id) from err
+                raise
+            for history in response.get("history", []):
+                for added in history.get("messagesAdded", []):
+                    mail_ids.append(str(added["message"]["id"]))
+            if not (page_token := response.get("nextPageToken")):
+                return mail_ids, str(response["historyId"])
+            kwargs["pageToken"] = page_token
+
     def get_labels(self) -> list[dict[str, t.Any]]:
         """Get a list of all labels in the user's mailbox.
 
@@ -190,5 +407,84 @@ class GmailAPI(abstract.AbstractAPI):
             body=body
         ).execute()
 
+    def batch_add_labels(self, mail_ids: t.Iterable[str], label_ids: list[str]) -> None:
+        """Add the labels on the specified messages.
+
+        Parameters
+        ----------
+        mail_ids : Iterable[str]
+            The IDs of the messages to modify.
+        label_ids : list[str]
+            A list of IDs of labels to add to the messages.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/reference/rest/v1/users.messages/batchModify
+        """
+        self._batch_modify(mail_ids, {"addLabelIds": label_ids})
+
+    def batch_remove_labels(self, mail_ids: t.Iterable[str], label_ids: list[str]) -> None:
+        """Remove the labels on the specified messages.
+
+        Parameters
+        ----------
+        mail_ids : Iterable[str]
+            The IDs of the messages to modify.
+        label_ids : list[str]
+            A list of IDs of labels to remove from the messages.
+
+        See Also
+        --------
+        https://developers.google.com/gmail/api/reference/rest/v1/users.messages/batchModify
+        """
+        self._batch_modify(mail_ids, {"removeLabelIds": label_ids})
+
+    def _batch_modify(self, mail_ids: t.Iterable[str], body: dict[str, t.Any]) -> None:
+        _mail_ids = iter(mail_ids)
+        while chunk := list(itertools.islice(_mail_ids, BATCH_MODIFY_SIZE)):
+            self._service.users().messages().batchModify(
+                userId=self.user_id,
+                body={"ids": chunk, **body}
+            ).execute()
+
     def __hash__(self) -> int:
         return hash((self.version, self.user_id))
+
+
+def is_temporary_error(err: Exception) -> bool:
+    """Whether the error of a call is temporary, so that the call may succeed when retried."""
+    if not isinstance(err, errors.HttpError):
+        return False
+    if err.resp.status in RETRY_STATUSES:
+        return True
+    return err.resp.status == 403 and any(reason.encode() in (err.content or b"") for reason in RATE_LIMIT_REASONS)
+
+
+def get_body_text(gmail: dict[str, t.Any]) -> str:
+    """Decode the body text of a Gmail message.
+
+    For a multipart message, only the first text part is decoded.
+
+    Parameters
+    ----------
+    gmail : dict[str, Any]
+        Gmail object, which has at least `BODY_FIELDS`.
+
+    Returns
+    -------
+    str
+        The body text, or an empty string if the message has no text part.
+    """
+    part = _find_text_part(gmail["payload"])
+    if part is None:
+        return ""
+    return base64.urlsafe_b64decode(part["body"]["data"]).decode("utf-8")
+
+
+def _find_text_part(part: dict[str, t.Any]) -> dict[str, t.Any] | None:
+    if str(part.get("mimeType", "text/")).startswith("text/") and part.get("body", {}).get("data"):
+        return part
+    for subpart in part.get("parts", []):
+        if (text_part := _find_text_part(subpart)) is not None:
+            return text_part
+    return None
@@ -1,4 +1,5 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from concurrent import futures
 import dataclasses
 import typing as t
 
@@ -17,7 +18,7 @@ class SpreadsheetAPI(abstract.AbstractAPI):
 
     @property
     def _service(self) -> t.Any:
-        return abstract.build_service(self)
+        return abstract.get_service(self)
 
     def get_values(
         self,
@@ -52,6 +53,298 @@ class SpreadsheetAPI(abstract.AbstractAPI):
         ).execute()
         return [list(row) for row in response["values"]]
 
+    def get_sheets(self, spreadsheet_id: str) -> list[dict[str, t.Any]]:
+        """Get the properties of the sheets of a spreadsheet.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet.
+
+        Returns
+        -------
+        list[dict[str, Any]]
+            The IDs and the titles of the sheets, e.g. `{"sheetId": 0, "title": "Sheet1"}`.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets/get
+        """
+        response = self._service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields="sheets/properties(sheetId,title)"
+        ).execute()
+        return [dict(sheet["properties"]) for sheet in response.get("sheets", [])]
+
+    def search_developer_metadata(self, spreadsheet_id: str, key: str) -> list[dict[str, t.Any]]:
+        """Get the developer metadata of the key on a spreadsheet itself, not on its sheets or ranges.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet.
+        key : str
+            The key of the metadata.
+
+        Returns
+        -------
+        list[dict[str, Any]]
+            The metadata, e.g. `{"metadataId": 1, "metadataKey": "key", "metadataValue": "value"}`.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.developerMetadata/search
+        """
+        response = self._service.spreadsheets().developerMetadata().search(
+            spreadsheetId=spreadsheet_id,
+            body={"dataFilters": [{
+                "developerMetadataLookup": {
+                    "metadataKey": key,
+                    "locationType": "SPREADSHEET"
+                }
+            }]}
+        ).execute()
+        return [dict(matched["developerMetadata"]) for matched in response.get("matchedDeveloperMetadata", [])]
+
+    def get_formats(
+        self,
+        spreadsheet_id: str,
+        ranges: list[str]
+    ) -> list[dict[str, t.Any]]:
+        """Get the properties, the conditional format rules and the cells in ranges of the sheets of a spreadsheet.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet.
+        ranges : list[str]
+            The A1 notations of the cells to get, at most one for each sheet.
+
+        Returns
+        -------
+        list[dict[str, Any]]
+            The sheets with `properties`, `conditionalFormats` and `data`,
+            where the cells have their values and formats and the columns have their widths.
+            Fields with default values are omitted by the API.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets/get
+        """
+        response = self._service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            fields=(
+                "sheets(properties(sheetId,title),conditionalFormats,"
+                "data(rowData/values(userEnteredValue,userEnteredFormat),columnMetadata/pixelSize))"
+            )
+        ).execute()
+        return [dict(sheet) for sheet in response.get("sheets", [])]
+
+    def get_row_count(
+        self,
+        spreadsheet_id: str,
+        range: str
+    ) -> int:
+        """Get the number of the rows of the sheet a range is on.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet to retrieve data from.
+        range : str
+            The A1 notation of a range on the sheet.
+
+        Returns
+        -------
+        int
+            The number of the rows of the sheet, including empty ones.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets/get
+        """
+        response = self._service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            ranges=[range],
+            fields="sheets/properties/gridProperties/rowCount"
+        ).execute()
+        return int(response["sheets"][0]["properties"]["gridProperties"]["rowCount"])
+
+    def iter_values(
+        self,
+        spreadsheet_id: str,
+        first_column: str,
+        last_column: str,
+        first_row: int = 1,
+        chunk_size: int = 1000,
+        prefetch: bool = False,
+        value_render_option: t.Literal["FORMATTED_VALUE", "UNFORMATTED_VALUE", "FORMULA"] = "FORMATTED_VALUE",
+        sheet_title: str | None = None
+    ) -> t.Iterator[list[t.Any]]:
+        """Iterate over the rows of the columns from a row to the end of the sheet, reading a window of rows at a time.
+
+        The rows are the same as the ones `get_values` returns for `{first_column}{first_row}:{last_column}`,
+        but only a window of `chunk_size` rows is held in memory at a time.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet to retrieve data from.
+        first_column : str
+            The first column to retrieve, e.g. "A".
+        last_column : str
+            The last column to retrieve, e.g. "E".
+        first_row : int
+            The 1-based number of the first row to retrieve.
+        chunk_size : int
+            The number of the rows to read in a request.
+        prefetch : bool
+            Whether to read the next window in a background thread while the current one is consumed.
+        value_render_option : Literal["FORMATTED_VALUE", "UNFORMATTED_VALUE", "FORMULA"]
+            How values should be represented in the output.
+        sheet_title : str | None
+            The title of the sheet to retrieve data from, or None for the first sheet.
+
+        Yields
+        ------
+        list[Any]
+            The values of a row. Empty rows are yielded as empty lists, except the trailing ones.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.values/get
+        """
+        prefix = "" if sheet_title is None else f"'{sheet_title}'!"
+        row_count = self.get_row_count(spreadsheet_id, f"{prefix}{first_column}{first_row}:{last_column}")
+        windows = [
+            (f"{prefix}{first_column}{start}:{last_column}{min(start + chunk_size - 1, row_count)}",
+             min(chunk_size, row_count - start + 1))
+            for start in range(first_row, row_count + 1, chunk_size)
+        ]
+        requests = [
+            self._service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=window,
+                valueRenderOption=value_render_option,
+                majorDimension="ROWS"
+            )
+            for window, _ in windows
+        ]
+        empty_rows = 0
+        for (_, size), values in zip(windows, self._execute_all(requests, prefetch)):
+            for row in values:
+                if row:
+                    yield from ([] for _ in range(empty_rows))
+                    empty_rows = 0
+                    yield list(row)
+                else:
+                    empty_rows += 1
+            empty_rows += size - len(values)
+
+    def _execute_all(self, requests: list[t.Any], prefetch: bool) -> t.Iterator[list[list[t.Any]]]:
+        if not prefetch:
+            for request in requests:
+                yield request.execute().get("values", [])
+            return
+        http = abstract.new_http(self)
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            pending = [executor.submit(request.execute, http=http) for request in requests[:1]]
+            for request in requests[1:]:
+                response = pending.pop().result()
+                pending.append(executor.submit(request.execute, http=http))
+                yield response.get("values", [])
+            for future in pending:
+                yield future.result().get("values", [])
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def batch_get_values(
+        self,
+        spreadsheet_id: str,
+        ranges: list[str],
+        value_render_option: t.Literal["FORMATTED_VALUE", "UNFORMATTED_VALUE", "FORMULA"] = "FORMATTED_VALUE",
+        major_dimension: t.Literal["ROWS", "COLUMNS"] = "ROWS"
+    ) -> list[list[list[t.Any]]]:
+        """Get one or more ranges of values from a spreadsheet.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet to retrieve data from.
+        ranges : list[str]
+            The A1 notation or R1C1 notation of the ranges to retrieve.
+        value_render_option : Literal["FORMATTED_VALUE", "UNFORMATTED_VALUE", "FORMULA"]
+            How values should be represented in the output.
+            See also https://developers.google.com/sheets/api/reference/rest/v4/ValueRenderOption
+        major_dimension : Literal["ROWS", "COLUMNS"]
+            The major dimension that results should use.
+
+        Returns
+        -------
+        list[list[list[Any]]]
+            The values of each range, in the same order as `ranges`.
+            The values of an empty range are an empty list.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.values/batchGet
+        """
+        response = self._service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            valueRenderOption=value_render_option,
+            majorDimension=major_dimension
+        ).execute()
+        return [
+            [list(row) for row in value_range.get("values", [])]
+            for value_range in response.get("valueRanges", [])
+        ]
+
+    def batch_get_values_by_data_filter(
+        self,
+        spreadsheet_id: str,
+        data_filters: list[dict[str, t.Any]],
+        major_dimension: t.Literal["ROWS", "COLUMNS"] = "ROWS"
+    ) -> list[tuple[str, list[list[t.Any]]]]:
+        """Get the ranges of values that match the data filters from a spreadsheet.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet to retrieve data from.
+        data_filters : list[dict[str, Any]]
+            The data filters to match the ranges to retrieve.
+            See also https://developers.google.com/sheets/api/reference/rest/v4/DataFilter
+        major_dimension : Literal["ROWS", "COLUMNS"]
+            The major dimension that results should use.
+
+        Returns
+        -------
+        list[tuple[str, list[list[Any]]]]
+            The A1 notation and the values of each matched range.
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.values/batchGetByDataFilter
+        """
+        body = {
+            "dataFilters": data_filters,
+            "majorDimension": major_dimension
+        }
+        response = self._service.spreadsheets().values().batchGetByDataFilter(
+            spreadsheetId=spreadsheet_id,
+            body=body
+        ).execute()
+        return [
+            (
+                str(matched["valueRange"]["range"]),
+                [list(row) for row in matched["valueRange"].get("values", [])]
+            )
+            for matched in response.get("valueRanges", [])
+        ]
+
     def update_values(
         self,
         spreadsheet_id: str,
@@ -90,6 +383,47 @@ class SpreadsheetAPI(abstract.AbstractAPI):
             body=body
         ).execute()
 
+    def batch_update_values(
+        self,
+        spreadsheet_id: str,
+        data: dict[str, list[list[str]]],
+        major_dimension: t.Literal["ROWS", "COLUMNS"] = "ROWS",
+        input_option: t.Literal["RAW", "USER_ENTERED"] = "RAW"
+    ) -> None:
+        """Set values in one or more ranges of a spreadsheet.
+
+        Parameters
+        ----------
+        spreadsheet_id : str
+            The ID of the spreadsheet to update.
+        data : dict[str, list[list[str]]]
+            The values to update, keyed on the A1 notation of their range.
+        major_dimension : Literal["ROWS", "COLUMNS"]
+            The major dimension of the values.
+        input_option : Literal["RAW", "USER_ENTERED"]
+            How the input data should be interpreted.
+            See also https://developers.google.com/sheets/api/reference/rest/v4/ValueInputOption
+
+        See Also
+        --------
+        https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.values/batchUpdate
+        """
+        body = {
+            "valueInputOption": input_option,
+            "data": [
+                {
+                    "range": range,
+                    "majorDimension": major_dimension,
+                    "values": values
+                }
+                for range, values in data.items()
+            ]
+        }
+        self._service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body=body
+        ).execute()
+
     def clear_values(
         self,
         spreadsheet_id: str,
@@ -0,0 +1,218 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Allocation of the CropsissIDs on the Google Spreadsheet"""
+import json
+import logging
+import typing as t
+
+from cropsiss import exceptions, google, lookup, shard, snapshot
+
+
+logger = logging.getLogger(__name__)
+
+ID_CHUNK_SIZE = 10000
+ID_COUNT_META = "cropsiss_id_count"
+LAYOUT_METADATA_KEY = "cropsiss_shard_layout"
+
+
+def format_cropsiss_id(number: int) -> str:
+    return f"c{number:05}"
+
+
+def grow_requests(row_count: int, length: int, sheet_id: int = 0) -> list[dict[str, t.Any]]:
+    """Make the requests to append rows to the grid, formatted like the first item row."""
+    return [
+        {
+            "appendDimension": {
+                "sheetId": sheet_id,
+                "dimension": "ROWS",
+                "length": length
+            }
+        },
+        {
+            "copyPaste": {
+                "source": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": 1,
+                    "endRowIndex": 2,
+                    "startColumnIndex": 0,
+                    "endColumnIndex": lookup.SOLD_COLUMN_INDEX + 1
+                },
+                "destination": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": row_count,
+                    "endRowIndex": row_count + length,
+                    "startColumnIndex": 0,
+                    "endColumnIndex": lookup.SOLD_COLUMN_INDEX + 1
+                },
+                "pasteType": "PASTE_FORMAT"
+            }
+        },
+        {
+            "repeatCell": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": row_count,
+                    "endRowIndex": row_count + length,
+                    "startColumnIndex": lookup.SOLD_COLUMN_INDEX,
+                    "endColumnIndex": lookup.SOLD_COLUMN_INDEX + 1
+                },
+                "cell": {
+                    "userEnteredValue": {
+                        "boolValue": False
+                    }
+                },
+                "fields": "userEnteredValue"
+            }
+        }
+    ]
+
+
+class IdAllocator:
+    """Allocate new CropsissIDs below the ones on the shards of the Google Spreadsheet.
+
+    The number of the allocated IDs is kept in the snapshot of the first shard as the high-water mark,
+    so that allocating IDs needs no read of the ID column.
+    The columns are read only to recover the mark when the snapshot does not have it.
+    The IDs are placed by the router, the grids are grown with appendDimension as needed,
+    and the IDs are written to the shards in parallel, in chunks of `ID_CHUNK_SIZE`.
+
+    The router places an ID by the number of the shards, so the keys of the shards are stored
+    in the developer metadata of the first spreadsheet at the first allocation,
+    and no ID is allocated while the shards differ from them, since the new IDs would overwrite the existing ones.
+    """
+    _api: google.SpreadsheetAPI
+    _router: shard.ShardRouter
+    _snapshots: t.Mapping[shard.Shard, snapshot.SheetSnapshot]
+
+    def __init__(
+        self,
+        api: google.SpreadsheetAPI,
+        router: shard.ShardRouter,
+        snapshots: t.Mapping[shard.Shard, snapshot.SheetSnapshot]
+    ) -> None:
+        self._api = api
+        self._router = router
+        self._snapshots = snapshots
+
+    @property
+    def _mark_snapshot(self) -> snapshot.SheetSnapshot:
+        return self._snapshots[self._router.shards[0]]
+
+    @property
+    def count(self) -> int:
+        """The number of the allocated IDs."""
+        if (value := self._mark_snapshot.get_meta(ID_COUNT_META)) is None:
+            count = max(self._router.fan_out(self._recover_count))
+            self._mark_snapshot.set_meta(ID_COUNT_META, str(count))
+            logger.info(f"The number of the allocated IDs was recovered from the sheet: {count}")
+            return count
+        return int(value)
+
+    def reset(self) -> None:
+        """Forget the allocated IDs and the shards they were allocated on, e.g. after the sheet has been cleared."""
+        self._api.batch_update(
+            spreadsheet_id=self._router.shards[0].spreadsheet_id,
+            requests={"requests": [{
+                "deleteDeveloperMetadata": {
+                    "dataFilter": {
+                        "developerMetadataLookup": {
+                            "metadataKey": LAYOUT_METADATA_KEY,
+                            "locationType": "SPREADSHEET"
+                        }
+                    }
+                }
+            }]}
+        )
+        self._mark_snapshot.set_meta(ID_COUNT_META, "0")
+
+    def allocate(self, number: int) -> list[str]:
+        """Write new IDs to the rows below the allocated ones.
+
+        The high-water mark is advanced only after all of the IDs are written.
+        IDs are always placed on the same rows, so a failed allocation is simply retried.
+
+        Returns
+        -------
+        list[str]
+            The new IDs.
+
+        Raises
+        ------
+        cropsiss.exceptions.ShardLayoutChangedError
+            If the shards differ from the ones the IDs were allocated on.
+        """
+        start = self.count
+        self._check_layout(start)
+        numbers = range(start + 1, start + number + 1)
+        placed: dict[shard.Shard, tuple[int, list[str]]] = {}
+        for cropsiss_number in numbers:
+            sheet_shard, index = self._router.route(format_cropsiss_id(cropsiss_number))
+            placed.setdefault(sheet_shard, (index, []))[1].append(format_cropsiss_id(cropsiss_number))
+        shards = list(placed)
+        self._router.fan_out(lambda s: self._write(s, *placed[s]), shards)
+        for sheet_shard in shards:
+            first, cropsiss_ids = placed[sheet_shard]
+            self._snapshots[sheet_shard].update_column(0, cropsiss_ids, start=first)
+        self._mark_snapshot.set_meta(ID_COUNT_META, str(start + number))
+        return [format_cropsiss_id(cropsiss_number) for cropsiss_number in numbers]
+
+    def _check_layout(self, count: int) -> None:
+        first = self._router.shards[0]
+        keys = [sheet_shard.key for sheet_shard in self._router.shards]
+        if metadata := self._api.search_developer_metadata(first.spreadsheet_id, LAYOUT_METADATA_KEY):
+            stored = json.loads(metadata[0]["metadataValue"])
+        else:
+            # The IDs allocated before the shards were stored are on the first tab, which was the only one then.
+            stored = [first.key] if count else keys
+        if stored != keys:
+            raise exceptions.ShardLayoutChangedError(
+                f"The IDs were allocated on {len(stored)} shards ({', '.join(stored)}), "
+                f"but {len(keys)} shards are configured ({', '.join(keys)})"
+            )
+        if not metadata:
+            self._api.batch_update(
+                spreadsheet_id=first.spreadsheet_id,
+                requests={"requests": [{
+                    "createDeveloperMetadata": {
+                        "developerMetadata": {
+                            "metadataKey": LAYOUT_METADATA_KEY,
+                            "metadataValue": json.dumps(keys),
+                            "location": {"spreadsheet": True},
+                            "visibility": "DOCUMENT"
+                        }
+                    }
+                }]}
+            )
+            logger.info(f"The shards of the IDs were stored to {first.spreadsheet_id}: {', '.join(keys)}")
+
+    def _recover_count(self, sheet_shard: shard.Shard) -> int:
+        count = 0
+        for index, row in enumerate(self._api.iter_values(
+            spreadsheet_id=sheet_shard.spreadsheet_id,
+            first_column="A",
+            last_column="A",
+            first_row=2,
+            chunk_size=lookup.SNAPSHOT_CHUNK_SIZE,
+            sheet_title=sheet_shard.title
+        )):
+            if row and row[0]:
+                count = self._router.number(sheet_shard, index)
+        return count
+
+    def _write(self, sheet_shard: shard.Shard, first: int, cropsiss_ids: list[str]) -> None:
+        row_count = self._api.get_row_count(sheet_shard.spreadsheet_id, sheet_shard.a1(lookup.SNAPSHOT_RANGE))
+        if (length := first + len(cropsiss_ids) + 1 - row_count) > 0:
+            self._api.batch_update(
+                spreadsheet_id=sheet_shard.spreadsheet_id,
+                requests={"requests": grow_requests(row_count, length, sheet_shard.sheet_id)}
+            )
+            logger.info(f"{length} rows were appended to {sheet_shard.key}")
+        for offset in range(0, len(cropsiss_ids), ID_CHUNK_SIZE):
+            chunk = cropsiss_ids[offset:offset+ID_CHUNK_SIZE]
+            row = first + offset
+            self._api.update_values(
+                spreadsheet_id=sheet_shard.spreadsheet_id,
+                range=sheet_shard.a1(f"A{row+2}:A{row+len(chunk)+1}"),
+                values=[chunk],
+                major_dimension="COLUMNS"
+            )
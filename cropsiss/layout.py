@@ -0,0 +1,180 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Layout of the tabs of the Google Spreadsheet, applied only where the tabs differ from it"""
+import logging
+import typing as t
+
+from cropsiss import exceptions, google, lookup, shard
+
+
+logger = logging.getLogger(__name__)
+
+INIT_RANGE = f"A1:{lookup.SOLD_COLUMN}2"
+
+
+def for_sheet(requests: t.Any, sheet_id: int) -> t.Any:
+    """Copy requests with all of their `sheetId` replaced."""
+    if isinstance(requests, dict):
+        return {key: sheet_id if key == "sheetId" else for_sheet(value, sheet_id) for key, value in requests.items()}
+    if isinstance(requests, list):
+        return [for_sheet(value, sheet_id) for value in requests]
+    return requests
+
+
+def init_spreadsheet(
+    api: google.SpreadsheetAPI,
+    shards: t.Sequence[shard.Shard],
+    init_requests: t.Sequence[dict[str, t.Any]],
+    clear_requests: t.Sequence[dict[str, t.Any]] = ()
+) -> int:
+    """Send the init requests whose result is not on the tabs of the shards yet.
+
+    The tabs of a spreadsheet are read once, and the requests for all of them are sent by one batchUpdate,
+    or not at all if the spreadsheet is already initialized.
+    The requests are made for the first tab, and they are copied for each tab with its sheet ID.
+    The tabs of the shards with their own titles are not renamed.
+
+    Parameters
+    ----------
+    api : SpreadsheetAPI
+        The API to the spreadsheet.
+    shards : Sequence[Shard]
+        The shards on the same spreadsheet.
+    init_requests : Sequence[dict[str, Any]]
+        The requests to initialize a tab.
+    clear_requests : Sequence[dict[str, Any]]
+        The requests to clear the items of a tab, which are always sent.
+
+    Returns
+    -------
+    int
+        The number of the sent requests.
+    """
+    spreadsheet_id = shards[0].spreadsheet_id
+    states = {
+        state.get("properties", {}).get("sheetId", 0): state
+        for state in api.get_formats(spreadsheet_id, [sheet_shard.a1(INIT_RANGE) for sheet_shard in shards])
+    }
+    requests: list[dict[str, t.Any]] = []
+    for sheet_shard in shards:
+        requests.extend(for_sheet(list(clear_requests), sheet_shard.sheet_id))
+        requests.extend(diff_requests(
+            for_sheet(
+                [r for r in init_requests if sheet_shard.title is None or "updateSheetProperties" not in r],
+                sheet_shard.sheet_id
+            ),
+            states.get(sheet_shard.sheet_id, {})
+        ))
+    if requests:
+        api.batch_update(spreadsheet_id=spreadsheet_id, requests={"requests": requests})
+        logger.info(f"{len(requests)} init requests were sent to {spreadsheet_id}")
+    return len(requests)
+
+
+def diff_requests(requests: t.Iterable[dict[str, t.Any]], state: dict[str, t.Any]) -> list[dict[str, t.Any]]:
+    """Pick the init requests whose result differs from the state of a tab read by `SpreadsheetAPI.get_formats`.
+
+    A request on cells is kept also when it overlaps a kept one, since the kept one overwrites its result.
+    """
+    pending: list[dict[str, t.Any]] = []
+    for request in requests:
+        if not is_applied(request, state) or any(
+            overlaps(cell_range(request), cell_range(kept)) for kept in pending
+        ):
+            pending.append(request)
+    return pending
+
+
+def is_applied(request: dict[str, t.Any], state: dict[str, t.Any]) -> bool:
+    """Whether the result of an init request is on the tab already.
+
+    Cells are checked on the header row and the first item row in `INIT_RANGE`.
+    The values of the item rows belong to the items, so only the formats are checked there.
+    """
+    kind, body = next(iter(request.items()))
+    data = (state.get("data") or [{}])[0]
+    if kind == "updateSheetProperties":
+        return contains(state.get("properties"), body["properties"])
+    if kind == "updateDimensionProperties":
+        columns = data.get("columnMetadata", [])
+        index = body["range"]["startIndex"]
+        return index < len(columns) and contains(columns[index], body["properties"])
+    if kind == "repeatCell":
+        row_index = 0 if body["range"].get("endRowIndex") == 1 else 1
+        rows = data.get("rowData", [])
+        cells = rows[row_index].get("values", []) if row_index < len(rows) else []
+        column_index = body["range"].get("startColumnIndex", 0)
+        cell = cells[column_index] if column_index < len(cells) else {}
+        fields = [field for field in body["fields"].split(",") if row_index == 0 or field != "userEnteredValue"]
+        return all(contains(cell.get(field), body["cell"].get(field)) for field in fields)
+    if kind == "addConditionalFormatRule":
+        rule = dict(body["rule"])
+        if isinstance(rule["ranges"], dict):
+            rule["ranges"] = [rule["ranges"]]
+        return any(contains(existing, rule) for existing in state.get("conditionalFormats", []))
+    return False
+
+
+def contains(actual: t.Any, desired: t.Any) -> bool:
+    """Whether the actual value read from the API has all of the desired one.
+
+    The API omits fields with default values, so missing numbers and booleans match their zero values.
+    """
+    if isinstance(desired, dict):
+        actual = {} if actual is None else actual
+        return isinstance(actual, dict) and all(contains(actual.get(key), value) for key, value in desired.items())
+    if isinstance(desired, list):
+        return isinstance(actual, list) and len(actual) == len(desired) and all(map(contains, actual, desired))
+    if isinstance(desired, bool):
+        return bool(actual) == desired
+    if isinstance(desired, (int, float)):
+        return isinstance(actual or 0, (int, float)) and abs((actual or 0) - desired) < 0.001
+    return bool(actual == desired)
+
+
+def cell_range(request: dict[str, t.Any]) -> dict[str, t.Any] | None:
+    """Get the grid range of a request on cells, or None for other requests."""
+    kind, body = next(iter(request.items()))
+    return dict(body["range"]) if kind in ("repeatCell", "updateCells") else None
+
+
+def overlaps(a: dict[str, t.Any] | None, b: dict[str, t.Any] | None) -> bool:
+    """Whether two grid ranges share any cell, where missing bounds are unbounded."""
+    if a is None or b is None or a.get("sheetId", 0) != b.get("sheetId", 0):
+        return False
+    return all(
+        a.get(f"start{dim}Index", 0) < b.get(f"end{dim}Index", float("inf"))
+        and b.get(f"start{dim}Index", 0) < a.get(f"end{dim}Index", float("inf"))
+        for dim in ("Row", "Column")
+    )
+
+
+def add_shard_sheets(api: google.SpreadsheetAPI, router: shard.ShardRouter) -> None:
+    """Add the tabs of the shards which do not exist yet.
+
+    A tab is taken to be the one of a shard only when both its sheet ID and its title are the shard's,
+    since the ranges of the shard refer to the tab by its title and the requests by its sheet ID.
+
+    Raises
+    ------
+    cropsiss.exceptions.ShardSheetConflictError
+        If another tab has the sheet ID or the title of a shard.
+    """
+    titled: dict[str, list[shard.Shard]] = {}
+    for sheet_shard in router.shards:
+        if sheet_shard.title is not None:
+            titled.setdefault(sheet_shard.spreadsheet_id, []).append(sheet_shard)
+    for spreadsheet_id, shards in titled.items():
+        sheets = {sheet["sheetId"]: sheet["title"] for sheet in api.get_sheets(spreadsheet_id)}
+        sheet_ids = {title: sheet_id for sheet_id, title in sheets.items()}
+        for s in shards:
+            if sheets.get(s.sheet_id, s.title) != s.title or sheet_ids.get(s.title, s.sheet_id) != s.sheet_id:
+                raise exceptions.ShardSheetConflictError(
+                    f"The tab {s.title!r} with the sheet ID {s.sheet_id} can't be added to {spreadsheet_id}, "
+                    f"which has a tab with either of them: {', '.join(f'{t!r} ({i})' for i, t in sheets.items())}"
+                )
+        if requests := [
+            {"addSheet": {"properties": {"sheetId": s.sheet_id, "title": s.title}}}
+            for s in shards if s.sheet_id not in sheets
+        ]:
+            api.batch_update(spreadsheet_id=spreadsheet_id, requests={"requests": requests})
+            logger.info(f"{len(requests)} tabs were added to {spreadsheet_id}")
@@ -0,0 +1,427 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Lookups of the rows on the Google Spreadsheet through the local snapshots and the tags of the rows"""
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import types
+import typing as t
+
+from googleapiclient import errors
+
+import cropsiss
+from cropsiss import google, shard, snapshot, table
+
+
+logger = logging.getLogger(__name__)
+
+SOLD_COLUMN = "E"
+SOLD_COLUMN_INDEX = ord(SOLD_COLUMN) - 65
+ARCHIVED = "ARCHIVED"
+"""The value left in the sold column of a row moved to the archive tab."""
+SNAPSHOT_RANGE = f"A2:{SOLD_COLUMN}"
+SNAPSHOT_CHUNK_SIZE = 5000
+METADATA_KEYS = {
+    0: "cropsiss.cropsiss_id",
+    **{platform.column_index: f"cropsiss.{platform.code}" for platform in cropsiss.PLATFORMS}
+}
+TAG_CHUNK_SIZE = 1000
+METADATA_CHAR_LIMIT = 30000
+
+
+def open_snapshot(snapshot_file: str | os.PathLike[str], sheet_shard: shard.Shard) -> snapshot.SheetSnapshot:
+    """Open the snapshot of a shard, which is kept in its own file next to the snapshot file."""
+    path = pathlib.Path(snapshot_file)
+    digest = hashlib.sha1(sheet_shard.key.encode("utf-8")).hexdigest()[:12]
+    return snapshot.SheetSnapshot(
+        path.with_name(f"{path.stem}-{digest}{path.suffix}"),
+        sheet_shard.key,
+        SOLD_COLUMN_INDEX + 1,
+        key_columns=METADATA_KEYS.keys()
+    )
+
+
+def row_location(index: int, sheet_id: int = 0) -> dict[str, t.Any]:
+    return {
+        "dimensionRange": {
+            "sheetId": sheet_id,
+            "dimension": "ROWS",
+            "startIndex": index + 1,
+            "endIndex": index + 2
+        }
+    }
+
+
+def tag_requests(index: int, row: list[str], sheet_id: int = 0) -> list[dict[str, t.Any]]:
+    """Make the requests to tag the row with developer metadata of its CropsissID and platform item IDs.
+
+    The existing tags of the row are replaced, and empty cells are left untagged.
+    """
+    requests: list[dict[str, t.Any]] = []
+    for column_index, key in METADATA_KEYS.items():
+        requests.append({
+            "deleteDeveloperMetadata": {
+                "dataFilter": {
+                    "developerMetadataLookup": {
+                        "metadataKey": key,
+                        "metadataLocation": row_location(index, sheet_id),
+                        "locationMatchingStrategy": "EXACT_LOCATION"
+                    }
+                }
+            }
+        })
+        if row[column_index]:
+            requests.append(create_tag_request(index, key, row[column_index], sheet_id))
+    return requests
+
+
+def create_tag_requests(index: int, row: list[str], sheet_id: int = 0) -> list[dict[str, t.Any]]:
+    """Make the requests to tag an untagged row, leaving empty cells untagged."""
+    return [
+        create_tag_request(index, key, row[column_index], sheet_id)
+        for column_index, key in METADATA_KEYS.items()
+        if row[column_index]
+    ]
+
+
+def create_tag_request(index: int, key: str, value: str, sheet_id: int = 0) -> dict[str, t.Any]:
+    return {
+        "createDeveloperMetadata": {
+            "developerMetadata": {
+                "metadataKey": key,
+                "metadataValue": value,
+                "location": row_location(index, sheet_id),
+                "visibility": "DOCUMENT"
+            }
+        }
+    }
+
+
+def untag_sheet_requests(sheet_id: int = 0) -> list[dict[str, t.Any]]:
+    """Make the requests to delete the tags of all of the rows of the sheet."""
+    return [
+        {
+            "deleteDeveloperMetadata": {
+                "dataFilter": {
+                    "developerMetadataLookup": {
+                        "metadataKey": key,
+                        "metadataLocation": {"sheetId": sheet_id},
+                        "locationMatchingStrategy": "INTERSECTING_LOCATION",
+                        "locationType": "ROW"
+                    }
+                }
+            }
+        }
+        for key in METADATA_KEYS.values()
+    ]
+
+
+def tag_size(row: list[str]) -> int:
+    """Count the characters of the developer metadata the row is tagged with, which are limited for a sheet."""
+    return sum(len(key) + len(row[column_index]) for column_index, key in METADATA_KEYS.items() if row[column_index])
+
+
+def select_rows_to_tag(item_table: table.ItemTable, limit: int) -> list[int]:
+    """Select the rows whose tags fit in the limit of characters, the unsold rows first in the order of the sheet.
+
+    The sold and archived rows are looked up rarely, so they are tagged only if the limit leaves room for them.
+    """
+    rows = list(item_table.rows())
+    selected: list[int] = []
+    for index in sorted(range(len(rows)), key=lambda index: rows[index][SOLD_COLUMN_INDEX] in ("TRUE", ARCHIVED)):
+        if (size := tag_size(rows[index])) <= limit:
+            selected.append(index)
+            limit -= size
+    return sorted(selected)
+
+
+def tag_rows(api: google.SpreadsheetAPI, sheet_shard: shard.Shard) -> tuple[int, int]:
+    """Replace the tags of the rows of a shard, tagging the rows selected by `select_rows_to_tag`.
+
+    The tagging stops at the first chunk of `TAG_CHUNK_SIZE` rows which fails, e.g. by the limit.
+
+    Returns
+    -------
+    tuple[int, int]
+        The numbers of the tagged rows and the untagged rows.
+    """
+    item_table = read_table(api, sheet_shard)
+    indexes = select_rows_to_tag(item_table, METADATA_CHAR_LIMIT)
+    api.batch_update(
+        spreadsheet_id=sheet_shard.spreadsheet_id,
+        requests={"requests": untag_sheet_requests(sheet_shard.sheet_id)}
+    )
+    for start in range(0, len(indexes), TAG_CHUNK_SIZE):
+        try:
+            api.batch_update(
+                spreadsheet_id=sheet_shard.spreadsheet_id,
+                requests={"requests": [
+                    request
+                    for index in indexes[start:start+TAG_CHUNK_SIZE]
+                    for request in create_tag_requests(index, item_table.row(index), sheet_shard.sheet_id)
+                ]}
+            )
+        except errors.HttpError as err:
+            logger.error(f"Tagging the rows of {sheet_shard.key} failed: {err}")
+            return start, len(item_table) - start
+    return len(indexes), len(item_table) - len(indexes)
+
+
+class RowLookup:
+    """Look up rows of a shard of the Google Spreadsheet through the local snapshot.
+
+    A row found in the snapshot is read again from the sheet to make sure it is up to date.
+    When the row is not found or has been changed, it is looked up on the server by the developer metadata
+    the row is tagged with, which follows the row even if it has been moved.
+    The whole snapshot is refreshed from the sheet, at most once per lookup instance,
+    only when the row is not tagged either. The rows read by the refresh are kept in an item table,
+    which answers the later lookups without any request.
+    """
+    _api: google.SpreadsheetAPI
+    _shard: shard.Shard
+    _snapshot: snapshot.SheetSnapshot
+    _table: table.ItemTable | None
+
+    def __init__(
+        self,
+        api: google.SpreadsheetAPI,
+        sheet_shard: shard.Shard,
+        sheet_snapshot: snapshot.SheetSnapshot
+    ) -> None:
+        self._api = api
+        self._shard = sheet_shard
+        self._snapshot = sheet_snapshot
+        self._table = None
+
+    @property
+    def item_table(self) -> table.ItemTable | None:
+        """The rows read by the refresh, or None if the snapshot has not been refreshed."""
+        return self._table
+
+    def knows(self, column_index: int, value: str) -> bool:
+        """Whether the value is in the column of the refreshed table or the snapshot, without any request."""
+        if self._table is not None:
+            return self._table.find(column_index, value) is not None
+        return self._snapshot.find_row(column_index, value) is not None
+
+    def find(self, column_index: int, value: str) -> tuple[int, list[str]] | None:
+        """Find the first row whose cell in the column is the value.
+
+        Returns
+        -------
+        tuple[int, list[str]] | None
+            The 0-based index from the row 2 and the up-to-date cells of the row,
+            or None if no row has the value.
+        """
+        if self._table is None:
+            if (index := self._snapshot.find_row(column_index, value)) is not None:
+                row = self.read_row(index)
+                if row[column_index] == value:
+                    return index, row
+            if (found := self.find_tagged(column_index, value)) is not None:
+                return found
+            self.refresh()
+        return self.find_in_table(column_index, value)
+
+    def find_in_table(self, column_index: int, value: str) -> tuple[int, list[str]] | None:
+        """Find the first row whose cell in the column is the value in the refreshed table."""
+        if self._table is None or (index := self._table.find(column_index, value)) is None:
+            return None
+        return index, self._table.row(index)
+
+    def find_tagged(self, column_index: int, value: str) -> tuple[int, list[str]] | None:
+        """Find the first row tagged with the value of the column, and update the snapshot with it.
+
+        Tags whose row no longer has the value are ignored.
+        """
+        if column_index not in METADATA_KEYS:
+            return None
+        matched = self._api.batch_get_values_by_data_filter(
+            spreadsheet_id=self._shard.spreadsheet_id,
+            data_filters=[{
+                "developerMetadataLookup": {
+                    "metadataKey": METADATA_KEYS[column_index],
+                    "metadataValue": value,
+                    "metadataLocation": {"sheetId": self._shard.sheet_id},
+                    "locationMatchingStrategy": "INTERSECTING_LOCATION",
+                    "locationType": "ROW"
+                }
+            }]
+        )
+        for a1_range, values in sorted(matched, key=lambda m: parse_row_number(m[0])):
+            index = parse_row_number(a1_range) - 2
+            if index < 0 or not values:
+                continue
+            self._snapshot.update_row(index, values[0])
+            row = self._snapshot.get_row(index) or []
+            if row[column_index] == value:
+                return index, row
+        return None
+
+    def read_row(self, index: int) -> list[str]:
+        """Read the row at the index from the sheet and update the snapshot with it."""
+        RANGE = self._shard.a1(f"A{index+2}:{SOLD_COLUMN}{index+2}")
+        values = self._api.batch_get_values(
+            spreadsheet_id=self._shard.spreadsheet_id,
+            ranges=[RANGE]
+        )[0]
+        self._snapshot.update_row(index, values[0] if values else [])
+        return self._snapshot.get_row(index) or []
+
+    def fetch(self) -> table.ItemTable:
+        """Read the whole sheet into an item table, streaming it in windows of rows.
+
+        All of `SNAPSHOT_RANGE` is downloaded whatever the snapshot holds, since the Sheets API can't tell
+        which rows have changed without reading them. The snapshot is not touched, so this may be called
+        on another thread.
+        """
+        rows = self._api.iter_values(
+            spreadsheet_id=self._shard.spreadsheet_id,
+            first_column="A",
+            last_column=SOLD_COLUMN,
+            first_row=2,
+            chunk_size=SNAPSHOT_CHUNK_SIZE,
+            prefetch=True,
+            sheet_title=self._shard.title
+        )
+        return table.ItemTable.from_rows(rows, SOLD_COLUMN_INDEX + 1)
+
+    def apply(self, item_table: table.ItemTable) -> None:
+        """Refresh the snapshot with an item table fetched from the sheet, and keep the table."""
+        self._table = item_table
+        changed = self._snapshot.refresh(item_table.rows())
+        logger.info(f"The snapshot of {self._shard.a1(SNAPSHOT_RANGE)} was refreshed: {changed} rows changed")
+
+    def refresh(self) -> None:
+        """Refresh the whole snapshot and the item table from the sheet."""
+        self.apply(self.fetch())
+
+    def forget(self) -> None:
+        """Drop the item table, e.g. after the rows have been changed, so that the lookups go back to the snapshot."""
+        self._table = None
+
+
+class ShardedLookup:
+    """Look up rows across the shards of the Google Spreadsheet.
+
+    A CropsissID is looked up only in the shard it is routed to.
+    Another value is looked up in the shards whose snapshot has it, then by the tags of each shard,
+    and at last in all of the shards refreshed in parallel.
+    """
+    router: shard.ShardRouter
+    snapshots: dict[shard.Shard, snapshot.SheetSnapshot]
+    _lookups: dict[shard.Shard, RowLookup]
+
+    def __init__(
+        self,
+        api: google.SpreadsheetAPI,
+        router: shard.ShardRouter,
+        snapshot_file: str | os.PathLike[str]
+    ) -> None:
+        """
+        Parameters
+        ----------
+        api : SpreadsheetAPI
+            The API to the spreadsheets.
+        router : ShardRouter
+            The router to the shards.
+        snapshot_file : str | os.PathLike[str]
+            The file the snapshots of the shards are kept next to, each in its own file.
+        """
+        self.router = router
+        self.snapshots = {}
+        try:
+            for sheet_shard in router.shards:
+                self.snapshots[sheet_shard] = open_snapshot(snapshot_file, sheet_shard)
+        except BaseException:
+            self.close()
+            raise
+        self._lookups = {
+            sheet_shard: RowLookup(api, sheet_shard, sheet_snapshot)
+            for sheet_shard, sheet_snapshot in self.snapshots.items()
+        }
+
+    def __enter__(self) -> "ShardedLookup":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: types.TracebackType | None
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for sheet_snapshot in self.snapshots.values():
+            sheet_snapshot.close()
+
+    def refresh(self, shards: t.Sequence[shard.Shard]) -> list[table.ItemTable]:
+        """Refresh the snapshots of the shards from the sheet in parallel.
+
+        Returns
+        -------
+        list[ItemTable]
+            The rows read from each of the shards.
+        """
+        item_tables = self.router.fan_out(lambda s: self._lookups[s].fetch(), shards)
+        for sheet_shard, item_table in zip(shards, item_tables):
+            self._lookups[sheet_shard].apply(item_table)
+        return item_tables
+
+    def forget(self, shards: t.Iterable[shard.Shard]) -> None:
+        """Drop the item tables of the shards whose rows have been changed."""
+        for sheet_shard in shards:
+            self._lookups[sheet_shard].forget()
+
+    def find(self, column_index: int, value: str) -> tuple[shard.Shard, int, list[str]] | None:
+        """Find the first row whose cell in the column is the value.
+
+        Returns
+        -------
+        tuple[Shard, int, list[str]] | None
+            The shard, the 0-based index from the row 2 and the up-to-date cells of the row,
+            or None if no row has the value.
+        """
+        if column_index == 0:
+            try:
+                sheet_shard, index = self.router.route(value)
+            except ValueError:
+                return None
+            row_lookup = self._lookups[sheet_shard]
+            # The routed row is read first, and the ID is looked up only when the row does not hold it.
+            if row_lookup.item_table is None and (row := row_lookup.read_row(index))[:1] == [value]:
+                return sheet_shard, index, row
+            found = row_lookup.find(column_index, value)
+            return None if found is None else (sheet_shard, *found)
+        for sheet_shard, lookup in self._lookups.items():
+            if lookup.knows(column_index, value) and (found := lookup.find(column_index, value)) is not None:
+                return sheet_shard, *found
+        stale = [sheet_shard for sheet_shard, lookup in self._lookups.items() if lookup.item_table is None]
+        for sheet_shard in stale:
+            if (found := self._lookups[sheet_shard].find_tagged(column_index, value)) is not None:
+                return sheet_shard, *found
+        self.refresh(stale)
+        for sheet_shard, lookup in self._lookups.items():
+            if (found := lookup.find_in_table(column_index, value)) is not None:
+                return sheet_shard, *found
+        return None
+
+
+def read_table(api: google.SpreadsheetAPI, sheet_shard: shard.Shard) -> table.ItemTable:
+    """Read the whole sheet of a shard into an item table, column by column."""
+    columns = api.batch_get_values(
+        spreadsheet_id=sheet_shard.spreadsheet_id,
+        ranges=[sheet_shard.a1(SNAPSHOT_RANGE)],
+        major_dimension="COLUMNS"
+    )[0]
+    return table.ItemTable(columns, SOLD_COLUMN_INDEX + 1)
+
+
+def parse_row_number(a1_range: str) -> int:
+    """Parse the first row number of a range in the A1 notation, e.g. 5 of `'ID管理'!A5:Z5`."""
+    match = re.match(r"[A-Z]*(\d+)", a1_range.rsplit("!", 1)[-1])
+    if match is None:
+        raise ValueError(f"No row number in {a1_range!r}")
+    return int(match.group(1))
@@ -1,7 +1,8 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 """Selling Platforms"""
 from .abstract import AbstractPlatform
+from .base import Timeouts
 from .yahoo_auction import YahooAuction
 from .mercari import Mercari
 
-__all__ = ["AbstractPlatform", "YahooAuction", "Mercari"]
+__all__ = ["AbstractPlatform", "Timeouts", "YahooAuction", "Mercari"]
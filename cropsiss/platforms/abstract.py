@@ -1,8 +1,11 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 import abc
+import typing as t
 
 from selenium import webdriver
 
+from cropsiss import exceptions
+
 
 class AbstractPlatform(abc.ABC):
     @property
@@ -25,6 +28,41 @@ class AbstractPlatform(abc.ABC):
     def column_index(self) -> int:
         """The column index on the Google Spreadsheet."""
 
+    @property
+    @abc.abstractmethod
+    def backends(self) -> tuple[str, ...]:
+        """The names of the backends the platform can cancel items with."""
+
+    @property
+    @abc.abstractmethod
+    def backend(self) -> str:
+        """The name of the backend to cancel items with, e.g. `webdriver` or `http`."""
+
+    @abc.abstractmethod
+    def with_backend(self, backend: str) -> "AbstractPlatform":
+        """Copy the platform with the backend to cancel items with.
+
+        Raises
+        ------
+        ValueError
+            If the platform does not support the backend.
+        """
+
+    @abc.abstractmethod
+    def with_timeouts(self, **seconds: float) -> "AbstractPlatform":
+        """Copy the platform with some of the seconds to wait for each step of a cancellation replaced.
+
+        Parameters
+        ----------
+        **seconds : float
+            The seconds by the names of the steps, e.g. `page_load`, `button` or `confirm`.
+
+        Raises
+        ------
+        TypeError
+            If a step is unknown.
+        """
+
     @property
     @abc.abstractmethod
     def sold_mail_query(self) -> str:
@@ -55,3 +93,27 @@ class AbstractPlatform(abc.ABC):
         cropsiss.exceptions.NotCancelError
             If cancellnig could not be done.
         """
+
+    @abc.abstractmethod
+    def cancel_in_tabs(
+        self,
+        item_ids: t.Iterable[str],
+        chrome_options: webdriver.ChromeOptions,
+        tabs: int = 4
+    ) -> dict[str, exceptions.NotCancelError | None]:
+        """Cancel selling items at once in the tabs of one browser.
+
+        Parameters
+        ----------
+        item_ids : Iterable[str]
+            IDs assigned by the platform.
+        chrome_options : selenium.webdriver.ChromeOptions
+            Options for Chrome webbrowser.
+        tabs : int
+            The number of the tabs to open at once.
+
+        Returns
+        -------
+        dict[str, cropsiss.exceptions.NotCancelError | None]
+            The error of each item, or None if it was canceled.
+        """
@@ -1,18 +1,91 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+import atexit
+import collections
 import contextlib
-from typing import Iterator
+import copy
+import dataclasses
+import logging
+import time
+from typing import Iterable, Iterator
+from urllib import parse
 
+import requests
 from selenium import webdriver
+from selenium.common import exceptions as selenium_exceptions
+from selenium.webdriver.common import by
+from selenium.webdriver.remote import webelement
+from selenium.webdriver.support import expected_conditions, wait
 import chromedriver_binary  # noqa
 
-from cropsiss.platforms import abstract
+from cropsiss import exceptions
+from cropsiss.platforms import abstract, cdp, http_session, pool
+
+
+logger = logging.getLogger(__name__)
+
+
+CHROME_ARGS = ["--no-sandbox", "--disable-gpu"]
+DRIVER_POOL = pool.DriverPool()
+atexit.register(DRIVER_POOL.close)
+HTTP_SESSIONS = http_session.SessionPool()
+atexit.register(HTTP_SESSIONS.close)
+CDP_BROWSERS = cdp.BrowserPool()
+atexit.register(CDP_BROWSERS.close)
+
+
+@dataclasses.dataclass(frozen=True)
+class Timeouts:
+    """Seconds to wait for each step of a cancellation."""
+    page_load: float = 30.0
+    """For the cancel page to load."""
+    button: float = 10.0
+    """For the cancel button to be clickable on the loaded page."""
+    confirm: float = 5.0
+    """For the page to confirm the cancellation after the button is clicked."""
+
+
+@dataclasses.dataclass()
+class TabCancellation:
+    """A cancellation running in a tab."""
+    item_id: str
+    url: str
+    deadline: float
+    """The monotonic time to give up finding the button at."""
+    clicked_at: float | None = None
+    """The monotonic time the button was clicked at."""
+    button: webelement.WebElement | None = None
+    """The clicked button."""
+    error: exceptions.NotCancelError | None = None
+
+
+def prepare_options(chrome_options: webdriver.ChromeOptions) -> webdriver.ChromeOptions:
+    """Copy the options with the arguments cropsiss runs Chrome with.
+
+    The options of the caller are left untouched, and the copies of the same options share the same key in the pools.
+    """
+    options = copy.deepcopy(chrome_options)
+    for arg in CHROME_ARGS:
+        if arg not in options.arguments:
+            options.add_argument(arg)
+    options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    return options
 
 
 class BasePlatform(abstract.AbstractPlatform):
     _id: int
     _code: str
     _name: str
-    _implicitly_wait_second: int = 30
+    _poll_second: float = 0.2
+    _http_timeout_second: float = 10
+    _network_idle_second: float = 0.5
+    _backend: str = "webdriver"
+    timeouts: Timeouts = Timeouts()
+    """The seconds to wait for each step of a cancellation on the platform."""
+    backends: tuple[str, ...] = ("webdriver", "cdp")
+    """The names of the backends the platform can cancel items with."""
+    driver_pool: pool.DriverPool = DRIVER_POOL
+    http_sessions: http_session.SessionPool = HTTP_SESSIONS
+    cdp_browsers: cdp.BrowserPool = CDP_BROWSERS
 
     @property
     def id(self) -> int:
@@ -30,6 +103,22 @@ class BasePlatform(abstract.AbstractPlatform):
     def column_index(self) -> int:
         return self.id + 1
 
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    def with_backend(self, backend: str) -> "BasePlatform":
+        if backend not in self.backends:
+            raise ValueError(f"{type(self).__name__} can't cancel items with {backend!r}")
+        platform = copy.copy(self)
+        platform._backend = backend
+        return platform
+
+    def with_timeouts(self, **seconds: float) -> "BasePlatform":
+        platform = copy.copy(self)
+        platform.timeouts = dataclasses.replace(self.timeouts, **seconds)
+        return platform
+
     @property
     def sold_mail_query(self) -> str:
         raise NotImplementedError()
@@ -41,23 +130,317 @@ class BasePlatform(abstract.AbstractPlatform):
     def get_selling_page_url(self, item_id: str) -> str:
         raise NotImplementedError()
 
+    def get_cancel_page_url(self, item_id: str) -> str:
+        """Get the URL of the page to cancel the item on."""
+        raise NotImplementedError()
+
+    @property
+    def cancel_button_xpath(self) -> str:
+        """The XPath of the button to cancel the item on the cancel page."""
+        raise NotImplementedError()
+
+    @property
+    def cancel_form_submit(self) -> str:
+        """The name of the submit button of the form to cancel the item on the cancel page."""
+        raise NotImplementedError()
+
+    @property
+    def confirmation_xpath(self) -> str | None:
+        """The XPath of the element which the page shows when the item is canceled, if the page has one."""
+        return None
+
+    @property
+    def confirmation_text(self) -> str | None:
+        """The text which the response to the cancel form has when the item is canceled, if the response has one."""
+        return None
+
     @contextlib.contextmanager
     def chrome(
         self,
         chrome_options: webdriver.ChromeOptions
     ) -> Iterator[webdriver.Chrome]:
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-logging"])
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.implicitly_wait(self._implicitly_wait_second)
-        try:
+        """Borrow a warm Chrome session from the driver pool."""
+        options = prepare_options(chrome_options)
+        # Only one browser can run on a user-data-dir, so the idle one driven over the protocol is quit.
+        self.cdp_browsers.evict(options)
+        with self.driver_pool.lend(options) as driver:
+            # Elements are waited for explicitly with the timeouts of the steps.
+            driver.implicitly_wait(0)
+            driver.set_page_load_timeout(self.timeouts.page_load)
             yield driver
-        finally:
-            driver.quit()
+
+    def wait_for_button(self, driver: webdriver.Chrome) -> webelement.WebElement:
+        """Wait for the cancel button to be clickable for up to `timeouts.button` seconds.
+
+        Raises
+        ------
+        selenium.common.exceptions.TimeoutException
+            If the button is not clickable in time.
+        """
+        button = wait.WebDriverWait(driver, self.timeouts.button, self._poll_second).until(
+            expected_conditions.element_to_be_clickable((by.By.XPATH, self.cancel_button_xpath))
+        )
+        assert isinstance(button, webelement.WebElement)
+        return button
+
+    def is_confirmed(self, driver: webdriver.Chrome, url: str, button: webelement.WebElement) -> bool:
+        """Whether the page has confirmed the cancellation.
+
+        The page has confirmed it when it has left the cancel page, the clicked button has been removed
+        or the confirmation element is on the page.
+        """
+        if driver.current_url != url or expected_conditions.staleness_of(button)(driver):
+            return True
+        if self.confirmation_xpath is None:
+            return False
+        return bool(driver.find_elements(by.By.XPATH, self.confirmation_xpath))
+
+    def wait_until_confirmed(self, driver: webdriver.Chrome, url: str, button: webelement.WebElement) -> bool:
+        """Wait for the page to confirm the cancellation for up to `timeouts.confirm` seconds.
+
+        An unconfirmed cancellation is not regarded as failed, since the click may have been submitted
+        without any change of the page.
+
+        Returns
+        -------
+        bool
+            Whether the page confirmed the cancellation in time.
+        """
+        try:
+            wait.WebDriverWait(driver, self.timeouts.confirm, self._poll_second).until(
+                lambda driver: self.is_confirmed(driver, url, button)
+            )
+            return True
+        except selenium_exceptions.TimeoutException:
+            logger.warning(f"{url} did not confirm the cancellation in {self.timeouts.confirm} seconds")
+            return False
+
+    @contextlib.contextmanager
+    def cdp_browser(self, chrome_options: webdriver.ChromeOptions) -> Iterator[cdp.Browser]:
+        """Borrow a warm Chrome driven over the DevTools Protocol from the pool."""
+        options = prepare_options(chrome_options)
+        self.driver_pool.evict(options)
+        with self.cdp_browsers.lend(options) as browser:
+            yield browser
+
+    def http_session(self, chrome_options: webdriver.ChromeOptions) -> requests.Session:
+        """Get the HTTP session with the cookies of the browser.
+
+        The cookies are exported from a Chrome session once for each options,
+        and the HTTP session is kept in the pool for the following cancellations.
+        """
+        def export() -> requests.Session:
+            with self.chrome(chrome_options) as driver:
+                return http_session.export_session(driver)
+        return self.http_sessions.get(pool.options_key(chrome_options), export)
 
     def cancel(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
+        """Cancel a selling item with the backend of the platform.
+
+        The HTTP backend falls back to the browser when the platform responds unexpectedly,
+        e.g. when the exported cookies are no longer logged in. The HTTP session is discarded then,
+        so that the cookies are exported again on the next cancellation.
+        """
+        if self.backend == "cdp":
+            self.cancel_over_cdp(item_id, chrome_options)
+            return
+        if self.backend == "http":
+            try:
+                self.cancel_over_http(item_id, chrome_options)
+                return
+            except exceptions.UnexpectedResponseError as err:
+                logger.warning(f"Falling back to the browser to cancel {item_id} on {self.name}: {err}")
+                self.http_sessions.discard(pool.options_key(chrome_options))
+        self.cancel_on_browser(item_id, chrome_options)
+
+    def cancel_on_browser(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
+        """Cancel a selling item by clicking the cancel button on Chrome."""
         raise NotImplementedError()
 
+    def cancel_over_cdp(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
+        """Cancel a selling item by clicking the cancel button on Chrome driven over the DevTools Protocol.
+
+        The button is clicked as soon as it is added to the page. The confirmation of the cancellation is checked
+        whenever no request of the page has been in flight for `_network_idle_second` seconds,
+        for up to `timeouts.confirm` seconds.
+        """
+        url = self.get_cancel_page_url(item_id)
+        try:
+            # Starting Chrome and opening the page fail as the cancellation, e.g. when Chrome is not found.
+            with self.cdp_browser(chrome_options) as browser, browser.page() as page:
+                page.navigate(url, self.timeouts.page_load)
+                if page.url != url:
+                    raise exceptions.NotCancelError(
+                        f"{url} was redirected to {page.url}. Make sure you logged in to {self.name} on the browser"
+                    )
+                if not page.wait_for_xpath(self.cancel_button_xpath, self.timeouts.button):
+                    raise exceptions.NotCancelError(
+                        f"Can't find the cancel button. Please Make sure XPATH: {self.cancel_button_xpath}"
+                    )
+                page.click(self.cancel_button_xpath)
+                deadline = time.monotonic() + self.timeouts.confirm
+                while not self._is_confirmed_on(page, url):
+                    if (remaining := deadline - time.monotonic()) <= 0:
+                        logger.warning(f"{url} did not confirm the cancellation in {self.timeouts.confirm} seconds")
+                        break
+                    page.wait_network_idle(self._network_idle_second, remaining)
+        # OSError includes TimeoutError and the failure to run the Chrome binary.
+        except (exceptions.CDPError, OSError) as err:
+            raise exceptions.NotCancelError(f"Can't cancel {item_id} on {url}: {err}") from err
+        timings = ", ".join(f"{step} {seconds:.3f}s" for step, seconds in page.timings.items())
+        logger.debug(f"{item_id} was canceled over the DevTools Protocol ({timings})")
+
+    def _is_confirmed_on(self, page: cdp.Page, url: str) -> bool:
+        try:
+            if page.url != url or not page.has_xpath(self.cancel_button_xpath):
+                return True
+            return self.confirmation_xpath is not None and page.has_xpath(self.confirmation_xpath)
+        except exceptions.CDPError:
+            # Scripts can't be evaluated while the page is navigating away from the cancel page.
+            return True
+
+    def cancel_over_http(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
+        """Cancel a selling item by submitting the cancel form over HTTP with the cookies of the browser.
+
+        The response to the form must have `confirmation_text` if the platform has one,
+        or must not have the cancel form any more otherwise, since an error is shown with a successful status.
+
+        Raises
+        ------
+        cropsiss.exceptions.UnexpectedResponseError
+            If the cancel page or the response to the form is not the expected one.
+        """
+        url = self.get_cancel_page_url(item_id)
+        session = self.http_session(chrome_options)
+        try:
+            response = session.get(url, timeout=self._http_timeout_second)
+            if response.status_code != 200 or response.url != url:
+                raise exceptions.UnexpectedResponseError(
+                    f"{url} responded {response.status_code} at {response.url}"
+                )
+            form = http_session.find_form(response.text, response.url, self.cancel_form_submit)
+            if form is None:
+                raise exceptions.UnexpectedResponseError(f"{url} has no form with {self.cancel_form_submit!r}")
+            logger.debug(f"Submitting the cancel form of {item_id} to {form.action}")
+            data = form.data(self.cancel_form_submit)
+            if form.method == "POST":
+                response = session.post(form.action, data=data, timeout=self._http_timeout_second)
+            else:
+                response = session.get(form.action, params=data, timeout=self._http_timeout_second)
+        except requests.RequestException as err:
+            raise exceptions.UnexpectedResponseError(
+                f"Requesting the cancellation of {item_id} failed: {err}"
+            ) from err
+        # A redirect to another host, e.g. a login page, means that the form was not accepted.
+        if response.status_code != 200 or parse.urlsplit(response.url).netloc != parse.urlsplit(form.action).netloc:
+            raise exceptions.UnexpectedResponseError(
+                f"The cancel form of {item_id} responded {response.status_code} at {response.url}"
+            )
+        if self.confirmation_text is not None:
+            confirmed = self.confirmation_text in response.text
+        else:
+            confirmed = http_session.find_form(response.text, response.url, self.cancel_form_submit) is None
+        if not confirmed:
+            raise exceptions.UnexpectedResponseError(
+                f"The cancel form of {item_id} was not confirmed at {response.url}"
+            )
+        logger.debug(f"The cancel form of {item_id} was accepted")
+
+    def cancel_in_tabs(
+        self,
+        item_ids: Iterable[str],
+        chrome_options: webdriver.ChromeOptions,
+        tabs: int = 4
+    ) -> dict[str, exceptions.NotCancelError | None]:
+        """Cancel selling items at once in the tabs of one browser.
+
+        Each tab navigates to its cancel page without blocking the others, and the tabs are polled in turn
+        for their cancel buttons, so that the page loads overlap. A clicked tab is kept open until the page
+        confirms the cancellation or for up to `timeouts.confirm` seconds, and the button is waited for
+        up to `timeouts.page_load` and `timeouts.button` seconds in total.
+        """
+        queue = collections.deque(dict.fromkeys(item_ids))
+        errors: dict[str, exceptions.NotCancelError | None] = {}
+        with self.chrome(chrome_options) as driver:
+            first = driver.current_window_handle
+            running: dict[str, TabCancellation] = {}
+            while queue or running:
+                while queue and len(running) < tabs:
+                    handle, tab = self._open_tab(driver, queue.popleft())
+                    if tab.error is None:
+                        running[handle] = tab
+                    else:
+                        errors[tab.item_id] = tab.error
+                for handle, tab in list(running.items()):
+                    if self._advance(driver, handle, tab):
+                        errors[tab.item_id] = tab.error
+                        del running[handle]
+                        try:
+                            driver.switch_to.window(handle)
+                            driver.close()
+                        except Exception as err:
+                            logger.debug(f"Closing the tab of {tab.item_id} failed: {err}")
+                        driver.switch_to.window(first)
+                if running:
+                    time.sleep(self._poll_second)
+        return errors
+
+    def _open_tab(self, driver: webdriver.Chrome, item_id: str) -> tuple[str, TabCancellation]:
+        url = self.get_cancel_page_url(item_id)
+        tab = TabCancellation(item_id, url, time.monotonic() + self.timeouts.page_load + self.timeouts.button)
+        handles = set(driver.window_handles)
+        try:
+            # Opening a tab by a script returns at once, unlike `driver.get` which waits for the page to load.
+            driver.execute_script("window.open(arguments[0], '_blank')", url)  # type: ignore[no-untyped-call]
+            handle, = set(driver.window_handles) - handles
+            logger.debug(f"Opening {url} in a new tab")
+            return handle, tab
+        except Exception as err:
+            tab.error = exceptions.NotCancelError(f"Can't open a tab for {url}: {err}")
+            return "", tab
+
+    def _advance(self, driver: webdriver.Chrome, handle: str, tab: TabCancellation) -> bool:
+        """Take the next step of the cancellation in the tab, and return whether it has finished."""
+        now = time.monotonic()
+        try:
+            driver.switch_to.window(handle)
+            if tab.clicked_at is not None and tab.button is not None:
+                if self.is_confirmed(driver, tab.url, tab.button):
+                    return True
+                if now - tab.clicked_at >= self.timeouts.confirm:
+                    logger.warning(f"{tab.url} did not confirm the cancellation in {self.timeouts.confirm} seconds")
+                    return True
+                return False
+            if driver.current_url not in (tab.url, "about:blank", ""):
+                tab.error = exceptions.NotCancelError(
+                    f"{tab.url} was redirected to {driver.current_url}. "
+                    f"Make sure you logged in to {self.name} on the browser"
+                )
+                return True
+            buttons = driver.find_elements(by.By.XPATH, self.cancel_button_xpath)
+            # Like `wait_for_button`, the button is clicked once it is clickable, and retried until the deadline
+            # while it is covered or replaced by the scripts of the page.
+            if buttons and (button := expected_conditions.element_to_be_clickable(buttons[0])(driver)):
+                button.click()
+                tab.clicked_at = now
+                tab.button = button
+                logger.debug(f"The cancel button of {tab.item_id} was clicked")
+                return False
+        except (
+            selenium_exceptions.ElementNotInteractableException,
+            selenium_exceptions.ElementClickInterceptedException,
+            selenium_exceptions.StaleElementReferenceException
+        ) as err:
+            logger.debug(f"The cancel button of {tab.item_id} is not clickable yet: {err}")
+        except Exception as err:
+            tab.error = exceptions.NotCancelError(f"Can't cancel {tab.item_id} on {tab.url}: {err}")
+            return True
+        if now >= tab.deadline:
+            tab.error = exceptions.NotCancelError(
+                f"Can't find the clickable cancel button. Please Make sure XPATH: {self.cancel_button_xpath}"
+            )
+            return True
+        return False
+
     def __repr__(self) -> str:
         return self.name
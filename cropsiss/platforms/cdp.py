@@ -0,0 +1,462 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Chrome driven directly over the DevTools Protocol, without chromedriver"""
+import collections
+import contextlib
+import itertools
+import json
+import logging
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import typing as t
+
+from selenium import webdriver
+import websocket
+
+from cropsiss import exceptions
+from cropsiss.platforms import pool
+
+
+logger = logging.getLogger(__name__)
+
+Message = dict[str, t.Any]
+
+CHROME_NAMES = ("google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome")
+USER_DATA_DIR_ARG = "--user-data-dir="
+DEVTOOLS_ACTIVE_PORT = "DevToolsActivePort"
+MAX_EVENTS = 10000
+
+# Resolves to whether the element of the XPath is on the page, as soon as it is added or at the timeout.
+WAIT_FOR_XPATH = """new Promise(resolve => {
+    const xpath = %s;
+    const find = () => document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+        .singleNodeValue;
+    if (find()) { resolve(true); return; }
+    const observer = new MutationObserver(() => {
+        if (find()) { observer.disconnect(); resolve(true); }
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true});
+    setTimeout(() => { observer.disconnect(); resolve(Boolean(find())); }, %d);
+})"""
+HAS_XPATH = "document.evaluate(%s, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null"
+# Scrolls the element of the XPath into the view and returns the center of it, or null if it is not on the page.
+CENTER_OF_XPATH = """(() => {
+    const element = document.evaluate(%s, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)
+        .singleNodeValue;
+    if (!element) { return null; }
+    element.scrollIntoView({block: "center"});
+    const rect = element.getBoundingClientRect();
+    return {x: rect.left + rect.width / 2, y: rect.top + rect.height / 2};
+})()"""
+
+
+def find_chrome(chrome_options: webdriver.ChromeOptions) -> str | None:
+    """Find the executable of Chrome, which is the binary location of the options if they have one."""
+    if chrome_options.binary_location:
+        return str(chrome_options.binary_location)
+    for name in CHROME_NAMES:
+        if path := shutil.which(name):
+            return path
+    return None
+
+
+def chrome_command(binary: str, chrome_options: webdriver.ChromeOptions, user_data_dir: str) -> list[str]:
+    """Make the command to start Chrome with the arguments of the options and its DevTools Protocol open.
+
+    The experimental options, which are understood only by chromedriver, are ignored.
+    """
+    arguments = [arg for arg in chrome_options.arguments if not arg.startswith(USER_DATA_DIR_ARG)]
+    return [
+        binary,
+        *arguments,
+        f"{USER_DATA_DIR_ARG}{user_data_dir}",
+        "--remote-debugging-port=0",
+        "--remote-allow-origins=*",
+        "--no-first-run",
+        "--no-default-browser-check",
+        "about:blank",
+    ]
+
+
+class Connection:
+    """WebSocket connection to Chrome, which sends commands and buffers the events received meanwhile."""
+    _socket: websocket.WebSocket
+    _ids: t.Iterator[int]
+    _events: collections.deque[Message]
+
+    def __init__(self, socket: websocket.WebSocket) -> None:
+        self._socket = socket
+        self._ids = itertools.count(1)
+        self._events = collections.deque(maxlen=MAX_EVENTS)
+
+    @classmethod
+    def connect(cls, url: str, timeout: float) -> "Connection":
+        try:
+            return cls(websocket.create_connection(url, timeout=timeout, suppress_origin=True))
+        except (websocket.WebSocketException, OSError) as err:
+            raise exceptions.CDPError(f"Can't connect to {url}: {err}") from err
+
+    def send(
+        self,
+        method: str,
+        params: dict[str, t.Any] | None = None,
+        session_id: str | None = None,
+        timeout: float = 30.0
+    ) -> Message:
+        """Send a command and wait for its result.
+
+        Raises
+        ------
+        cropsiss.exceptions.CDPError
+            If Chrome returns an error or the connection is lost.
+        TimeoutError
+            If the result does not arrive in time.
+        """
+        message_id = next(self._ids)
+        message: Message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id is not None:
+            message["sessionId"] = session_id
+        try:
+            self._socket.send(json.dumps(message))
+        except (websocket.WebSocketException, OSError) as err:
+            raise exceptions.CDPError(f"Can't send {method}: {err}") from err
+        deadline = time.monotonic() + timeout
+        while True:
+            received = self._receive(deadline)
+            if received.get("id") == message_id:
+                if "error" in received:
+                    raise exceptions.CDPError(f"{method} failed: {received['error'].get('message')}")
+                return dict(received.get("result", {}))
+            if "method" in received:
+                self._events.append(received)
+
+    def wait_event(self, predicate: t.Callable[[Message], bool], deadline: float) -> Message:
+        """Wait for the first event which satisfies the predicate, including the buffered ones.
+
+        Raises
+        ------
+        TimeoutError
+            If no such event arrives by the monotonic time.
+        """
+        for event in self._events:
+            if predicate(event):
+                self._events.remove(event)
+                return event
+        while True:
+            received = self._receive(deadline)
+            if "method" not in received:
+                continue
+            if predicate(received):
+                return received
+            self._events.append(received)
+
+    def discard_events(self, session_id: str | None = None) -> None:
+        """Discard the buffered events of the session, or all of them."""
+        kept = [event for event in self._events if session_id is not None and event.get("sessionId") != session_id]
+        self._events.clear()
+        self._events.extend(kept)
+
+    def close(self) -> None:
+        try:
+            self._socket.close()
+        except Exception as err:
+            logger.debug(f"Closing the DevTools connection failed: {err}")
+
+    def _receive(self, deadline: float) -> Message:
+        if (remaining := deadline - time.monotonic()) <= 0:
+            raise TimeoutError("Chrome did not respond in time")
+        try:
+            self._socket.settimeout(remaining)
+            return dict(json.loads(self._socket.recv()))
+        except websocket.WebSocketTimeoutException as err:
+            raise TimeoutError("Chrome did not respond in time") from err
+        except (websocket.WebSocketException, OSError) as err:
+            raise exceptions.CDPError(f"The DevTools connection was lost: {err}") from err
+
+
+class Page:
+    """A tab of Chrome, attached with its own session of the protocol.
+
+    The seconds each step took are recorded in `timings`, e.g. the ones until the load event of a navigation.
+    """
+    connection: Connection
+    target_id: str
+    session_id: str
+    timings: dict[str, float]
+
+    def __init__(self, connection: Connection, target_id: str, session_id: str) -> None:
+        self.connection = connection
+        self.target_id = target_id
+        self.session_id = session_id
+        self.timings = {}
+
+    def send(self, method: str, params: dict[str, t.Any] | None = None, timeout: float = 30.0) -> Message:
+        return self.connection.send(method, params, self.session_id, timeout)
+
+    def evaluate(self, expression: str, timeout: float = 30.0, await_promise: bool = False) -> t.Any:
+        """Evaluate a JavaScript expression on the page and get its value.
+
+        Raises
+        ------
+        cropsiss.exceptions.CDPError
+            If the expression throws.
+        """
+        result = self.send(
+            "Runtime.evaluate",
+            {"expression": expression, "returnByValue": True, "awaitPromise": await_promise},
+            timeout
+        )
+        if "exceptionDetails" in result:
+            raise exceptions.CDPError(f"Evaluating a script failed: {result['exceptionDetails'].get('text')}")
+        return result.get("result", {}).get("value")
+
+    @property
+    def url(self) -> str:
+        return str(self.evaluate("location.href"))
+
+    def navigate(self, url: str, timeout: float) -> None:
+        """Navigate to the URL and wait for the load event of the page."""
+        started = time.monotonic()
+        self.connection.discard_events(self.session_id)
+        result = self.send("Page.navigate", {"url": url}, timeout)
+        if result.get("errorText"):
+            raise exceptions.CDPError(f"Navigating to {url} failed: {result['errorText']}")
+        self.connection.wait_event(self._is("Page.loadEventFired"), started + timeout)
+        self.timings["navigate"] = time.monotonic() - started
+
+    def wait_for_xpath(self, xpath: str, timeout: float) -> bool:
+        """Wait for the element of the XPath to be on the page, and return whether it is.
+
+        The element is watched for by a MutationObserver on the page, so this returns as soon as it is added.
+        """
+        started = time.monotonic()
+        found = self.evaluate(WAIT_FOR_XPATH % (json.dumps(xpath), timeout * 1000), timeout + 5, await_promise=True)
+        self.timings["find"] = time.monotonic() - started
+        return bool(found)
+
+    def has_xpath(self, xpath: str) -> bool:
+        """Whether the element of the XPath is on the page."""
+        return bool(self.evaluate(HAS_XPATH % json.dumps(xpath)))
+
+    def click(self, xpath: str) -> None:
+        """Click the center of the element of the XPath with the mouse events of the input."""
+        started = time.monotonic()
+        center = self.evaluate(CENTER_OF_XPATH % json.dumps(xpath))
+        if center is None:
+            raise exceptions.CDPError(f"{xpath} is not on the page")
+        for event_type in ("mouseMoved", "mousePressed", "mouseReleased"):
+            self.send("Input.dispatchMouseEvent", {
+                "type": event_type, "x": center["x"], "y": center["y"], "button": "left", "clickCount": 1
+            })
+        self.timings["click"] = time.monotonic() - started
+
+    def wait_network_idle(self, idle: float, timeout: float) -> bool:
+        """Wait until no request of the page has been in flight for the idle seconds.
+
+        Returns
+        -------
+        bool
+            Whether the network became idle before the timeout.
+        """
+        started = time.monotonic()
+        deadline = started + timeout
+        self.connection.discard_events(self.session_id)
+        in_flight: set[str] = set()
+        quiet_since = started
+        while True:
+            now = time.monotonic()
+            if not in_flight and now - quiet_since >= idle:
+                self.timings["idle"] = now - started
+                return True
+            if now >= deadline:
+                logger.debug(f"{len(in_flight)} requests were still in flight at the timeout")
+                return False
+            try:
+                event = self.connection.wait_event(
+                    self._is("Network.requestWillBeSent", "Network.loadingFinished", "Network.loadingFailed"),
+                    deadline if in_flight else min(deadline, quiet_since + idle)
+                )
+            except TimeoutError:
+                continue
+            request_id = event["params"].get("requestId")
+            if event["method"] == "Network.requestWillBeSent":
+                in_flight.add(request_id)
+            elif request_id in in_flight:
+                in_flight.discard(request_id)
+                if not in_flight:
+                    quiet_since = time.monotonic()
+
+    def close(self) -> None:
+        try:
+            self.connection.send("Target.closeTarget", {"targetId": self.target_id}, timeout=5)
+        finally:
+            self.connection.discard_events(self.session_id)
+
+    def _is(self, *methods: str) -> t.Callable[[Message], bool]:
+        return lambda event: event.get("sessionId") == self.session_id and event["method"] in methods
+
+
+class Browser:
+    """Chrome started with its DevTools Protocol open, which is connected to without chromedriver.
+
+    Chrome is started on the user-data-dir of the options, or on a temporary one if they do not have it.
+    """
+    process: "subprocess.Popen[bytes]"
+    connection: Connection
+    user_data_dir: pathlib.Path
+    _temporary: tempfile.TemporaryDirectory[str] | None
+
+    def __init__(self, chrome_options: webdriver.ChromeOptions, timeout: float = 30.0) -> None:
+        """
+        Raises
+        ------
+        cropsiss.exceptions.CDPError
+            If Chrome is not found or can't be started, e.g. since another Chrome uses the user-data-dir.
+        """
+        if (binary := find_chrome(chrome_options)) is None:
+            raise exceptions.CDPError("Chrome is not found")
+        self._temporary = None
+        for arg in chrome_options.arguments:
+            if arg.startswith(USER_DATA_DIR_ARG):
+                self.user_data_dir = pathlib.Path(arg[len(USER_DATA_DIR_ARG):])
+                break
+        else:
+            self._temporary = tempfile.TemporaryDirectory(prefix="cropsiss-chrome-")
+            self.user_data_dir = pathlib.Path(self._temporary.name)
+        (self.user_data_dir / DEVTOOLS_ACTIVE_PORT).unlink(missing_ok=True)
+        self.process = subprocess.Popen(
+            chrome_command(binary, chrome_options, str(self.user_data_dir)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            self.connection = Connection.connect(self._wait_devtools_url(time.monotonic() + timeout), timeout)
+        except BaseException:
+            self._stop()
+            raise
+        logger.debug(f"A new Chrome was started over the DevTools Protocol (PID: {self.process.pid})")
+
+    def open_page(self) -> Page:
+        target_id = str(self.connection.send("Target.createTarget", {"url": "about:blank"})["targetId"])
+        session_id = str(
+            self.connection.send("Target.attachToTarget", {"targetId": target_id, "flatten": True})["sessionId"]
+        )
+        page = Page(self.connection, target_id, session_id)
+        page.send("Page.enable")
+        page.send("Network.enable")
+        return page
+
+    @contextlib.contextmanager
+    def page(self) -> t.Iterator[Page]:
+        """Open a new tab, which is closed at the end."""
+        page = self.open_page()
+        try:
+            yield page
+        finally:
+            try:
+                page.close()
+            except (exceptions.CDPError, TimeoutError) as err:
+                logger.debug(f"Closing a tab failed: {err}")
+
+    def probe(self) -> bool:
+        """Whether the browser responds."""
+        try:
+            self.connection.send("Browser.getVersion", timeout=5)
+            return True
+        except (exceptions.CDPError, TimeoutError) as err:
+            logger.debug(f"Probing a Chrome failed: {err}")
+            return False
+
+    def quit(self) -> None:
+        try:
+            self.connection.send("Browser.close", timeout=5)
+        except (exceptions.CDPError, TimeoutError) as err:
+            logger.debug(f"Closing a Chrome failed: {err}")
+        self.connection.close()
+        self._stop()
+
+    def _wait_devtools_url(self, deadline: float) -> str:
+        # Chrome writes the port and the path of the browser target to the file when its protocol is open.
+        path = self.user_data_dir / DEVTOOLS_ACTIVE_PORT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise exceptions.CDPError(
+                    f"Chrome exited with {self.process.returncode}. "
+                    f"Make sure no other Chrome uses {self.user_data_dir}"
+                )
+            with contextlib.suppress(OSError, ValueError):
+                port, browser_path = path.read_text().split()[:2]
+                return f"ws://127.0.0.1:{int(port)}{browser_path}"
+            time.sleep(0.05)
+        raise exceptions.CDPError("The DevTools Protocol of Chrome did not open in time")
+
+    def _stop(self) -> None:
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._temporary is not None:
+            self._temporary.cleanup()
+
+
+class BrowserPool:
+    """Pool of the browsers driven over the DevTools Protocol, which keeps one idle browser for each options.
+
+    An idle browser is probed before it is lent, and replaced if it does not respond.
+    """
+    _idle: dict[pool.Key, Browser]
+    _lock: threading.Lock
+    _closed: bool
+
+    def __init__(self) -> None:
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    @contextlib.contextmanager
+    def lend(self, chrome_options: webdriver.ChromeOptions) -> t.Iterator[Browser]:
+        """Lend the browser started with the options, starting a new one if no live idle one is in the pool."""
+        key = pool.options_key(chrome_options)
+        with self._lock:
+            browser = self._idle.pop(key, None)
+        if browser is not None and not browser.probe():
+            logger.warning("An idle Chrome did not respond and was replaced")
+            browser.quit()
+            browser = None
+        if browser is None:
+            browser = Browser(chrome_options)
+        try:
+            yield browser
+        finally:
+            with self._lock:
+                if not self._closed and key not in self._idle:
+                    self._idle[key] = browser
+                    browser = None
+            if browser is not None:
+                browser.quit()
+
+    def evict(self, chrome_options: webdriver.ChromeOptions) -> None:
+        """Quit the idle browser started with the options, e.g. to start chromedriver on its user-data-dir."""
+        with self._lock:
+            browser = self._idle.pop(pool.options_key(chrome_options), None)
+        if browser is not None:
+            browser.quit()
+
+    def close(self) -> None:
+        """Quit all of the idle browsers, and quit the lent ones when they are returned."""
+        with self._lock:
+            self._closed = True
+            browsers = list(self._idle.values())
+            self._idle.clear()
+        for browser in browsers:
+            browser.quit()
@@ -0,0 +1,144 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""HTTP sessions logged in with the cookies of Chrome"""
+import dataclasses
+from html import parser
+import logging
+import threading
+import typing as t
+from urllib import parse
+
+import requests
+from selenium import webdriver
+
+
+logger = logging.getLogger(__name__)
+
+Key = t.Hashable
+
+
+def export_session(driver: webdriver.Chrome) -> requests.Session:
+    """Make an HTTP session with all of the cookies and the user agent of the browser.
+
+    The cookies of all of the sites are exported through the DevTools Protocol,
+    since `driver.get_cookies` returns only the ones of the current page.
+    """
+    session = requests.Session()
+    cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})  # type: ignore[no-untyped-call]
+    for cookie in cookies["cookies"]:
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie["domain"],
+            path=cookie["path"],
+            secure=cookie.get("secure", False)
+        )
+    user_agent = driver.execute_script("return navigator.userAgent")  # type: ignore[no-untyped-call]
+    session.headers["User-Agent"] = str(user_agent)
+    logger.debug(f"{len(session.cookies)} cookies were exported from Chrome")
+    return session
+
+
+class SessionPool:
+    """Pool of HTTP sessions kept between cancellations.
+
+    A session is made once for each key, e.g. the Chrome options whose cookies it has,
+    and keeps its connections alive for the following requests.
+    """
+    _sessions: dict[Key, requests.Session]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, key: Key, factory: t.Callable[[], requests.Session]) -> requests.Session:
+        """Get the session of the key, making it with the factory if the pool does not have it."""
+        with self._lock:
+            if (session := self._sessions.get(key)) is not None:
+                return session
+        session = factory()
+        with self._lock:
+            # Another thread may have made one meanwhile.
+            if (other := self._sessions.setdefault(key, session)) is not session:
+                session.close()
+            return other
+
+    def discard(self, key: Key) -> None:
+        """Close the session of the key, so that a new one is made on the next use."""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def close(self) -> None:
+        """Close all of the sessions."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+@dataclasses.dataclass()
+class Form:
+    """An HTML form."""
+    action: str
+    """The absolute URL to submit the form to."""
+    method: str = "GET"
+    """The HTTP method to submit the form with."""
+    fields: list[tuple[str, str]] = dataclasses.field(default_factory=list)
+    """The names and the values of the fields but the submit buttons."""
+    submits: list[tuple[str, str]] = dataclasses.field(default_factory=list)
+    """The names and the values of the submit buttons."""
+
+    def data(self, submit: str) -> list[tuple[str, str]]:
+        """Get the data sent by clicking the submit button with the name."""
+        return [*self.fields, *[(name, value) for name, value in self.submits if name == submit]]
+
+
+class FormParser(parser.HTMLParser):
+    """Parser which collects the forms of an HTML document."""
+    base_url: str
+    forms: list[Form]
+    _form: Form | None
+
+    def __init__(self, base_url: str) -> None:
+        super().__init__()
+        self.base_url = base_url
+        self.forms = []
+        self._form = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        attributes = {name: value or "" for name, value in attrs}
+        if tag == "form":
+            self._form = Form(
+                parse.urljoin(self.base_url, attributes.get("action", "")),
+                attributes.get("method", "GET").upper()
+            )
+            self.forms.append(self._form)
+        elif tag in ("input", "button") and self._form is not None and (name := attributes.get("name")):
+            input_type = attributes.get("type", "submit" if tag == "button" else "text").lower()
+            value = attributes.get("value", "")
+            if input_type == "submit":
+                self._form.submits.append((name, value))
+            elif input_type not in ("checkbox", "radio") or "checked" in attributes:
+                self._form.fields.append((name, value))
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "form":
+            self._form = None
+
+
+def find_form(html: str, base_url: str, submit: str) -> Form | None:
+    """Find the first form with the submit button of the name in an HTML document."""
+    form_parser = FormParser(base_url)
+    form_parser.feed(html)
+    form_parser.close()
+    for form in form_parser.forms:
+        if any(name == submit for name, _ in form.submits):
+            return form
+    return None
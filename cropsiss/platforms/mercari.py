@@ -1,10 +1,7 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
-import time
 import logging
 
 from selenium import webdriver
-from selenium.webdriver.remote import webelement
-from selenium.webdriver.common import by
 
 from cropsiss import exceptions
 from cropsiss.platforms import base
@@ -31,7 +28,14 @@ class Mercari(base.BasePlatform):
     def get_selling_page_url(self, item_id: str) -> str:
         return f"https://jp.mercari.com/item/{item_id}"
 
-    def cancel(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
+    def get_cancel_page_url(self, item_id: str) -> str:
+        return self.EDIT_PAGE.format(id=item_id)
+
+    @property
+    def cancel_button_xpath(self) -> str:
+        return self.SUSPEND_BUTTON_XPATH
+
+    def cancel_on_browser(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
         url: str = self.EDIT_PAGE.format(id=item_id)
         with self.chrome(chrome_options) as driver:
             try:
@@ -41,8 +45,7 @@ class Mercari(base.BasePlatform):
             except Exception as err:  # pragma: no cover
                 raise exceptions.NotCancelError(f"Can't access the edit page. Please Make sure URL: {url}") from err
             try:
-                suspend_element = driver.find_element(by.By.XPATH, self.SUSPEND_BUTTON_XPATH)
-                assert isinstance(suspend_element, webelement.WebElement)
+                suspend_element = self.wait_for_button(driver)
                 logger.debug(f"{self.SUSPEND_BUTTON_XPATH} was found on the page")
             except Exception as err:  # pragma: no cover
                 raise exceptions.NotCancelError(
@@ -53,4 +56,5 @@ class Mercari(base.BasePlatform):
                 logger.debug("The suspend button was clicked")
             except Exception as err:  # pragma: no cover
                 raise exceptions.NotCancelError("Can't click the suspend button") from err
-            time.sleep(1)
+            if self.wait_until_confirmed(driver, url, suspend_element):
+                logger.debug("The page confirmed the cancellation")
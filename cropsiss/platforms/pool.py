@@ -0,0 +1,278 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Pool of warm Chrome sessions"""
+from concurrent import futures
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import typing as t
+
+from selenium import webdriver
+
+
+logger = logging.getLogger(__name__)
+
+Key = tuple[tuple[str, ...], str, str]
+
+
+def options_key(chrome_options: webdriver.ChromeOptions) -> Key:
+    """Get the key of the sessions started with the options, which includes the user-data-dir."""
+    return (
+        tuple(chrome_options.arguments),
+        json.dumps(chrome_options.experimental_options, sort_keys=True, default=str),
+        chrome_options.binary_location
+    )
+
+
+@dataclasses.dataclass()
+class Session:
+    """A Chrome session in the pool with its usage."""
+    driver: webdriver.Chrome
+    """The driver of the session."""
+    options: webdriver.ChromeOptions
+    """The options the session was started with."""
+    started_at: float = dataclasses.field(default_factory=time.monotonic)
+    """The monotonic time the session was started at."""
+    uses: int = 0
+    """The number of the times the session has been lent."""
+
+
+class DriverPool:
+    """Pool of Chrome sessions kept warm between uses.
+
+    Sessions are keyed by the options they were started with, so each user-data-dir has its own sessions.
+    A session is lent to one user at a time and reset when it is returned:
+    its extra windows are closed and the remaining one is moved to a blank page.
+    Cookies are kept, since they hold the login to the platforms.
+
+    Sessions are recycled to bound the memory growth of Chrome.
+    A returned session which has been lent `max_uses` times, has lived for `max_age` seconds
+    or whose processes use more than `max_rss` bytes of memory is quit,
+    and a new one is started in the background so that it is ready for the next user.
+    An idle session is probed before it is lent, and replaced if it does not respond.
+    A session which fails to be reset is also replaced.
+    """
+    max_idle: int
+    max_uses: int | None
+    max_age: float | None
+    max_rss: int | None
+    _idle: dict[Key, list[Session]]
+    _replacing: dict[Key, futures.Future[None]]
+    _executor: futures.ThreadPoolExecutor | None
+    _lock: threading.Lock
+    _closed: bool
+
+    def __init__(
+        self,
+        max_idle: int = 1,
+        max_uses: int | None = 50,
+        max_age: float | None = 1800.0,
+        max_rss: int | None = 1024 ** 3
+    ) -> None:
+        """
+        Parameters
+        ----------
+        max_idle : int
+            The number of the idle sessions to keep for each key.
+            A user-data-dir can be used by only one Chrome at a time, so one is enough for the sessions with it.
+        max_uses : int | None
+            The number of the times a session is lent before it is recycled, or None for no limit.
+        max_age : float | None
+            The seconds a session lives before it is recycled, or None for no limit.
+        max_rss : int | None
+            The bytes of the resident memory of the browser and its renderers to recycle a session at,
+            or None for no limit. The memory is measured only where `/proc` is available.
+        """
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.max_rss = max_rss
+        self._idle = {}
+        self._replacing = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(sessions) for sessions in self._idle.values())
+
+    @contextlib.contextmanager
+    def lend(self, chrome_options: webdriver.ChromeOptions) -> t.Iterator[webdriver.Chrome]:
+        """Lend a session started with the options, starting a new one if no live idle one is in the pool.
+
+        A replacement being started for the options is waited for,
+        since another Chrome could not be started on the same user-data-dir meanwhile.
+        """
+        key = options_key(chrome_options)
+        session = self._take(key)
+        if session is not None and not probe(session.driver):
+            logger.warning("An idle Chrome session did not respond and was replaced")
+            quit_quietly(session.driver)
+            session = None
+        if session is None:
+            session = Session(self._start(chrome_options), chrome_options)
+        session.uses += 1
+        try:
+            yield session.driver
+        finally:
+            self._give_back(key, session)
+
+    def close(self) -> None:
+        """Quit all of the idle sessions, and quit the lent ones when they are returned."""
+        with self._lock:
+            self._closed = True
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle.clear()
+        for session in sessions:
+            quit_quietly(session.driver)
+
+    def evict(self, chrome_options: webdriver.ChromeOptions) -> None:
+        """Quit the idle sessions started with the options, e.g. to start another browser on their user-data-dir."""
+        key = options_key(chrome_options)
+        with self._lock:
+            replacing = self._replacing.get(key)
+        if replacing is not None:
+            futures.wait([replacing])
+        with self._lock:
+            sessions = self._idle.pop(key, [])
+        for session in sessions:
+            quit_quietly(session.driver)
+
+    def expired(self, session: Session) -> str | None:
+        """Get the reason to recycle the session, or None if it may be lent again."""
+        if self.max_uses is not None and session.uses >= self.max_uses:
+            return f"it has been used {session.uses} times"
+        if self.max_age is not None and (age := time.monotonic() - session.started_at) >= self.max_age:
+            return f"it has lived for {age:.0f} seconds"
+        if self.max_rss is not None and (rss := driver_rss(session.driver)) is not None and rss > self.max_rss:
+            return f"it uses {rss // 1024 ** 2} MiB of memory"
+        return None
+
+    def _start(self, chrome_options: webdriver.ChromeOptions) -> webdriver.Chrome:
+        driver = webdriver.Chrome(options=chrome_options)
+        logger.debug("A new Chrome session was started")
+        return driver
+
+    def _take(self, key: Key) -> Session | None:
+        with self._lock:
+            replacing = self._replacing.get(key)
+        if replacing is not None:
+            futures.wait([replacing])
+        with self._lock:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else None
+
+    def _give_back(self, key: Key, session: Session) -> None:
+        try:
+            reset(session.driver)
+        except Exception as err:
+            logger.warning(f"A Chrome session was replaced since it could not be reset: {err}")
+            self._replace(key, session)
+            return
+        if (reason := self.expired(session)) is not None:
+            logger.info(f"A Chrome session was recycled since {reason}")
+            self._replace(key, session)
+            return
+        with self._lock:
+            if not self._closed and len(self._idle.setdefault(key, [])) < self.max_idle:
+                self._idle[key].append(session)
+                return
+        quit_quietly(session.driver)
+
+    def _replace(self, key: Key, session: Session) -> None:
+        """Quit the session and start a new one with the same options in the background."""
+        with self._lock:
+            if not self._closed and len(self._idle.setdefault(key, [])) < self.max_idle and key not in self._replacing:
+                if self._executor is None:
+                    self._executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="driver-pool")
+                self._replacing[key] = self._executor.submit(self._restart, key, session)
+                return
+        quit_quietly(session.driver)
+
+    def _restart(self, key: Key, session: Session) -> None:
+        quit_quietly(session.driver)
+        replacement: Session | None = None
+        try:
+            replacement = Session(self._start(session.options), session.options)
+        except Exception as err:
+            logger.warning(f"Starting a replacement of a Chrome session failed: {err}")
+        with self._lock:
+            del self._replacing[key]
+            if replacement is None:
+                return
+            if not self._closed and len(self._idle.setdefault(key, [])) < self.max_idle:
+                self._idle[key].append(replacement)
+                return
+        quit_quietly(replacement.driver)
+
+
+def reset(driver: webdriver.Chrome) -> None:
+    """Close the windows of the session but the first one, and move it to a blank page."""
+    first, *others = driver.window_handles
+    for handle in others:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(first)
+    driver.get("about:blank")
+
+
+def probe(driver: webdriver.Chrome) -> bool:
+    """Whether the session and its page respond."""
+    try:
+        driver.title  # Fails unless the browser and the page respond
+        return True
+    except Exception as err:
+        logger.debug(f"Probing a Chrome session failed: {err}")
+        return False
+
+
+def process_tree_rss(pid: int) -> int | None:
+    """Sum the resident memory of a process and its descendants in bytes, or None without `/proc`."""
+    proc = pathlib.Path("/proc")
+    if not (proc / str(pid)).is_dir():
+        return None
+    children: dict[int, list[int]] = {}
+    for stat in proc.glob("[0-9]*/stat"):
+        try:
+            ppid = int(stat.read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(stat.parent.name))
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            total += int((proc / str(current) / "statm").read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            pass
+        pids.extend(children.get(current, []))
+    return total
+
+
+def driver_rss(driver: webdriver.Chrome) -> int | None:
+    """Get the resident memory of the browser and its renderers started by the driver in bytes, if measurable.
+
+    The browser is a child of the chromedriver process, so the tree of the chromedriver is measured.
+    """
+    try:
+        pid = int(driver.service.process.pid)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return process_tree_rss(pid)
+
+
+def quit_quietly(driver: webdriver.Chrome) -> None:
+    try:
+        driver.quit()
+    except Exception as err:
+        logger.debug(f"Quitting a Chrome session failed: {err}")
@@ -1,10 +1,7 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
-import time
 import logging
 
 from selenium import webdriver
-from selenium.webdriver.remote import webelement
-from selenium.webdriver.common import by
 
 from cropsiss import exceptions
 from cropsiss.platforms import base
@@ -19,6 +16,10 @@ class YahooAuction(base.BasePlatform):
     _name: str = "ヤフオク!"
     CANCEL_PAGE: str = "https://page.auctions.yahoo.co.jp/jp/show/cancelauction?aID={id}"
     CANCEL_BUTTON_XPATH: str = "/html/body/center[1]/form/table/tbody/tr[3]/td/input"
+    CANCEL_FORM_SUBMIT: str = "confirm"
+    backends: tuple[str, ...] = ("webdriver", "cdp", "http")
+    # The cancel page is plain HTML, so the button is there as soon as the page is loaded.
+    timeouts: base.Timeouts = base.Timeouts(button=5.0)
 
     @property
     def sold_mail_query(self) -> str:
@@ -31,7 +32,18 @@ class YahooAuction(base.BasePlatform):
     def get_selling_page_url(self, item_id: str) -> str:
         return f"https://page.auctions.yahoo.co.jp/jp/auction/{item_id}"
 
-    def cancel(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
+    def get_cancel_page_url(self, item_id: str) -> str:
+        return self.CANCEL_PAGE.format(id=item_id)
+
+    @property
+    def cancel_button_xpath(self) -> str:
+        return self.CANCEL_BUTTON_XPATH
+
+    @property
+    def cancel_form_submit(self) -> str:
+        return self.CANCEL_FORM_SUBMIT
+
+    def cancel_on_browser(self, item_id: str, chrome_options: webdriver.ChromeOptions) -> None:
         url: str = self.CANCEL_PAGE.format(id=item_id)
         with self.chrome(chrome_options) as driver:
             try:
@@ -41,8 +53,7 @@ class YahooAuction(base.BasePlatform):
             except Exception as err:  # pragma: no cover
                 raise exceptions.NotCancelError(f"Can't access the cancel page. Please Make sure URL: {url}") from err
             try:
-                cancel_element = driver.find_element(by.By.XPATH, self.CANCEL_BUTTON_XPATH)
-                assert isinstance(cancel_element, webelement.WebElement)
+                cancel_element = self.wait_for_button(driver)
                 logger.debug(f"{self.CANCEL_BUTTON_XPATH} was found on the page")
             except Exception as err:  # pragma: no cover
                 raise exceptions.NotCancelError(
@@ -53,4 +64,5 @@ class YahooAuction(base.BasePlatform):
                 logger.debug("The cancel button was clicked")
             except Exception as err:  # pragma: no cover
                 raise exceptions.NotCancelError("Can't click the cancel button") from err
-            time.sleep(1)
+            if self.wait_until_confirmed(driver, url, cancel_element):
+                logger.debug("The page confirmed the cancellation")
@@ -0,0 +1,108 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Sharding of the items across tabs and spreadsheets"""
+from concurrent import futures
+import dataclasses
+import re
+import typing as t
+
+
+T = t.TypeVar("T")
+
+SHEET_TITLE = "ID管理"
+
+
+def column_letter(column_index: int) -> str:
+    """Convert a 0-based column index to the letters of the column, e.g. 0 to "A" and 26 to "AA"."""
+    letters = ""
+    number = column_index + 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(remainder + 65) + letters
+    return letters
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """A tab of a spreadsheet which holds a part of the items."""
+    spreadsheet_id: str
+    """The ID of the spreadsheet."""
+    sheet_id: int = 0
+    """The ID of the tab."""
+    title: str | None = None
+    """The title of the tab, or None for the first tab which ranges refer to without a title."""
+
+    @property
+    def key(self) -> str:
+        """The string which identifies the shard."""
+        return self.spreadsheet_id if self.title is None else f"{self.spreadsheet_id}#{self.sheet_id}"
+
+    def a1(self, range: str) -> str:
+        """Qualify a range in the A1 notation with the title of the tab."""
+        return range if self.title is None else f"'{self.title}'!{range}"
+
+
+def make_shards(spreadsheet_ids: t.Sequence[str], tabs: int = 1) -> list[Shard]:
+    """Make the shards of `tabs` tabs on each of the spreadsheets.
+
+    The first tab of a spreadsheet is the one with the sheet ID 0,
+    and the others are titled after it, e.g. `ID管理-2`.
+    """
+    return [
+        Shard(spreadsheet_id, tab, None if tab == 0 else f"{SHEET_TITLE}-{tab+1}")
+        for spreadsheet_id in spreadsheet_ids
+        for tab in range(tabs)
+    ]
+
+
+class ShardRouter:
+    """Route CropsissIDs to shards.
+
+    The number of an ID decides its shard by the remainder and its row by the quotient of the division
+    by the number of the shards, so that IDs allocated in sequence are spread evenly over the shards
+    and the row of an ID is known without any lookup. The shards must not be changed once IDs are allocated.
+    """
+    shards: tuple[Shard, ...]
+
+    def __init__(self, shards: t.Sequence[Shard]) -> None:
+        if not shards:
+            raise ValueError("No shard is given")
+        self.shards = tuple(shards)
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def route(self, cropsiss_id: str) -> tuple[Shard, int]:
+        """Get the shard and the 0-based row index from the row 2 of a CropsissID.
+
+        Raises
+        ------
+        ValueError
+            If the ID is not a CropsissID.
+        """
+        if (match := re.fullmatch(r"c(\d+)", cropsiss_id)) is None or int(match[1]) < 1:
+            raise ValueError(f"{cropsiss_id!r} is not a cropsissID")
+        row_index, shard_index = divmod(int(match[1]) - 1, len(self.shards))
+        return self.shards[shard_index], row_index
+
+    def number(self, shard: Shard, row_index: int) -> int:
+        """Get the number of the CropsissID at the row of the shard."""
+        return row_index * len(self.shards) + self.shards.index(shard) + 1
+
+    def fan_out(self, func: t.Callable[[Shard], T], shards: t.Sequence[Shard] | None = None) -> list[T]:
+        """Call the function with each shard in parallel and return the results in the order of the shards.
+
+        The function runs on its own thread, so it must not share thread-unsafe objects
+        such as an SQLite connection with the caller.
+
+        Parameters
+        ----------
+        func : Callable[[Shard], T]
+            The function to call.
+        shards : Sequence[Shard] | None
+            The shards to call the function with, or None for all of the shards.
+        """
+        shards = self.shards if shards is None else shards
+        if len(shards) <= 1:
+            return [func(sheet_shard) for sheet_shard in shards]
+        with futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            return list(executor.map(func, shards))
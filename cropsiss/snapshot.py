@@ -0,0 +1,263 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Local snapshot of the Google Spreadsheet"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import types
+import typing as t
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    row_index INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    cells TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS keys (
+    column_index INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    PRIMARY KEY (column_index, value, row_index)
+);
+CREATE INDEX IF NOT EXISTS keys_row_index ON keys (row_index);
+CREATE TABLE IF NOT EXISTS stamps (
+    row_index INTEGER PRIMARY KEY,
+    stamped_at REAL NOT NULL
+);
+"""
+
+
+def hash_row(row: list[str]) -> str:
+    """Hash the cells of a row."""
+    return hashlib.sha1(json.dumps(row, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class SheetSnapshot:
+    """Snapshot of the rows of a sheet, stored in a SQLite database.
+
+    Rows are identified by their 0-based index and always have `width` cells.
+    The non-empty cells in `key_columns` are indexed, so that rows are found by them without scanning.
+    """
+    _conn: sqlite3.Connection
+    width: int
+    key_columns: frozenset[int]
+
+    def __init__(
+        self,
+        filename: str | os.PathLike[str],
+        source: str,
+        width: int,
+        key_columns: t.Iterable[int] = ()
+    ) -> None:
+        """
+        Parameters
+        ----------
+        filename : str | os.PathLike[str]
+            The path to the database.
+        source : str
+            The identifier of the snapshotted sheet, e.g. the spreadsheet ID.
+            The snapshot is cleared if it was taken from another source.
+        width : int
+            The number of cells in a row.
+        key_columns : Iterable[int]
+            The indexes of the columns to index.
+        """
+        self.width = width
+        self.key_columns = frozenset(key_columns)
+        self._conn = sqlite3.connect(filename)
+        self._conn.executescript(SCHEMA)
+        if self._get_meta("source") != source:
+            with self._conn:
+                self._conn.execute("DELETE FROM rows")
+                self._conn.execute("DELETE FROM keys")
+                self._conn.execute("DELETE FROM meta")
+                self._conn.execute("DELETE FROM stamps")
+                self._set_meta("source", source)
+                self._set_meta("refreshed_at", "")
+        key_columns_json = json.dumps(sorted(self.key_columns))
+        if self._get_meta("key_columns") != key_columns_json:
+            with self._conn:
+                self._conn.execute("DELETE FROM keys")
+                for index, cells in self._conn.execute("SELECT row_index, cells FROM rows").fetchall():
+                    self._write_keys(index, json.loads(cells))
+                self._set_meta("key_columns", key_columns_json)
+
+    def __enter__(self) -> "SheetSnapshot":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: types.TracebackType | None
+    ) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return int(self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0])
+
+    @property
+    def refreshed_at(self) -> float | None:
+        """The UNIX time of the last refresh, or None if the snapshot has never been refreshed."""
+        value = self._get_meta("refreshed_at")
+        return float(value) if value else None
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def get_meta(self, key: str) -> str | None:
+        """Get a value stored along with the snapshot, or None if it has not been set.
+
+        The values are cleared together with the rows when the snapshot is taken from another source.
+        """
+        return self._get_meta(key)
+
+    def set_meta(self, key: str, value: str) -> None:
+        """Store a value along with the snapshot."""
+        with self._conn:
+            self._set_meta(key, value)
+
+    def refresh(self, rows: t.Iterable[t.Sequence[t.Any]]) -> int:
+        """Bring the snapshot up to date with the rows read from the sheet.
+
+        Only the rows whose hash differs from the stored one are written.
+        The hashes save the writes to the database, not the reads from the sheet, since all of the rows are
+        compared. The rows are consumed one by one, so they may be streamed from the sheet.
+
+        Parameters
+        ----------
+        rows : Iterable[Sequence[Any]]
+            All of the rows of the sheet.
+
+        Returns
+        -------
+        int
+            The number of the changed rows.
+        """
+        hashes = dict(self._conn.execute("SELECT row_index, hash FROM rows").fetchall())
+        changed = 0
+        count = 0
+        with self._conn:
+            for index, row in enumerate(rows):
+                cells = self._normalize(row)
+                row_hash = hash_row(cells)
+                if hashes.get(index) != row_hash:
+                    self._write_row(index, cells, row_hash)
+                    changed += 1
+                count = index + 1
+            removed = self._conn.execute("DELETE FROM rows WHERE row_index >= ?", (count,)).rowcount
+            self._conn.execute("DELETE FROM keys WHERE row_index >= ?", (count,))
+            self._conn.execute("DELETE FROM stamps WHERE row_index >= ?", (count,))
+            self._set_meta("refreshed_at", str(time.time()))
+        return changed + removed
+
+    def get_row(self, index: int) -> list[str] | None:
+        """Get the row at the index, or None if the snapshot does not have it."""
+        record = self._conn.execute("SELECT cells FROM rows WHERE row_index = ?", (index,)).fetchone()
+        return None if record is None else list(json.loads(record[0]))
+
+    def find_row(self, column_index: int, value: str) -> int | None:
+        """Find the first row whose cell in the column is the value.
+
+        The lookup is done through the index if the column is one of `key_columns`.
+
+        Returns
+        -------
+        int | None
+            The index of the row, or None if no row has the value.
+        """
+        if column_index in self.key_columns:
+            record = self._conn.execute(
+                "SELECT row_index FROM keys WHERE column_index = ? AND value = ? ORDER BY row_index LIMIT 1",
+                (column_index, value)
+            ).fetchone()
+            return None if record is None else int(record[0])
+        record = self._conn.execute(
+            "SELECT row_index FROM rows WHERE json_extract(cells, ?) = ? ORDER BY row_index LIMIT 1",
+            (f"$[{column_index}]", value)
+        ).fetchone()
+        return None if record is None else int(record[0])
+
+    def update_row(self, index: int, row: t.Sequence[t.Any]) -> None:
+        """Overwrite the row at the index."""
+        cells = self._normalize(row)
+        with self._conn:
+            self._write_row(index, cells, hash_row(cells))
+
+    def update_column(self, column_index: int, values: t.Sequence[t.Any], start: int = 0) -> None:
+        """Overwrite the cells in the column from the row at `start`.
+
+        Rows which the snapshot does not have yet are created with empty cells.
+        """
+        with self._conn:
+            for index, value in enumerate(values, start):
+                cells = self.get_row(index) or self._normalize([])
+                cells[column_index] = str(value)
+                self._write_row(index, cells, hash_row(cells))
+
+    def stamp_row(self, index: int, at: float | None = None) -> None:
+        """Record the time of an event of the row, e.g. when it was sold.
+
+        A row has at most one stamp, and stamping it again overwrites the stamp.
+
+        Parameters
+        ----------
+        index : int
+            The index of the row.
+        at : float | None
+            The UNIX time of the event, or None for now.
+        """
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stamps (row_index, stamped_at) VALUES (?, ?)",
+                (index, time.time() if at is None else at)
+            )
+
+    def get_stamp(self, index: int) -> float | None:
+        """Get the UNIX time the row was stamped at, or None if it has no stamp."""
+        record = self._conn.execute("SELECT stamped_at FROM stamps WHERE row_index = ?", (index,)).fetchone()
+        return None if record is None else float(record[0])
+
+    def stamped_until(self, at: float) -> list[int]:
+        """Get the indexes of the rows stamped at or before the UNIX time, in ascending order."""
+        return [
+            int(record[0]) for record in self._conn.execute(
+                "SELECT row_index FROM stamps WHERE stamped_at <= ? ORDER BY row_index", (at,)
+            ).fetchall()
+        ]
+
+    def unstamp_rows(self, indexes: t.Iterable[int]) -> None:
+        """Remove the stamps of the rows."""
+        with self._conn:
+            self._conn.executemany("DELETE FROM stamps WHERE row_index = ?", [(index,) for index in indexes])
+
+    def _normalize(self, row: t.Sequence[t.Any]) -> list[str]:
+        cells = [str(cell) for cell in row[:self.width]]
+        return cells + [""] * (self.width - len(cells))
+
+    def _write_row(self, index: int, cells: list[str], row_hash: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rows (row_index, hash, cells) VALUES (?, ?, ?)",
+            (index, row_hash, json.dumps(cells, ensure_ascii=False))
+        )
+        self._conn.execute("DELETE FROM keys WHERE row_index = ?", (index,))
+        self._write_keys(index, cells)
+
+    def _write_keys(self, index: int, cells: list[str]) -> None:
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO keys (column_index, value, row_index) VALUES (?, ?, ?)",
+            [(column_index, cells[column_index], index) for column_index in self.key_columns if cells[column_index]]
+        )
+
+    def _get_meta(self, key: str) -> str | None:
+        record = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if record is None else str(record[0])
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
@@ -0,0 +1,71 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Compact in-memory table of the items on the Google Spreadsheet"""
+import sys
+import typing as t
+
+
+class ItemTable:
+    """Columnar table of the rows of a sheet.
+
+    Each column is held as a tuple of interned strings, so that repeated cells such as empty ones
+    and the sold flags share one object, and a row is made only when it is accessed.
+    The columns are indexed on their first lookup.
+    """
+    __slots__ = ("width", "_columns", "_indexes")
+    width: int
+    _columns: tuple[tuple[str, ...], ...]
+    _indexes: dict[int, dict[str, int]]
+
+    def __init__(self, columns: t.Sequence[t.Sequence[t.Any]], width: int) -> None:
+        """
+        Parameters
+        ----------
+        columns : Sequence[Sequence[Any]]
+            The cells of each column, e.g. read with `major_dimension="COLUMNS"`.
+            Shorter columns are padded with empty cells.
+        width : int
+            The number of the columns.
+        """
+        length = max((len(column) for column in columns[:width]), default=0)
+        self.width = width
+        self._columns = tuple(
+            tuple(sys.intern(str(cell)) for cell in column) + ("",) * (length - len(column))
+            for column in (*columns[:width], *([] for _ in range(width - len(columns))))
+        )
+        self._indexes = {}
+
+    @classmethod
+    def from_rows(cls, rows: t.Iterable[t.Sequence[t.Any]], width: int) -> "ItemTable":
+        """Build a table from rows, consuming them one by one."""
+        columns: list[list[str]] = [[] for _ in range(width)]
+        for row in rows:
+            for column_index, column in enumerate(columns):
+                column.append(sys.intern(str(row[column_index])) if column_index < len(row) else "")
+        return cls(columns, width)
+
+    def __len__(self) -> int:
+        return len(self._columns[0]) if self._columns else 0
+
+    def row(self, index: int) -> list[str]:
+        """Get the cells of the row at the index."""
+        return [column[index] for column in self._columns]
+
+    def rows(self) -> t.Iterator[list[str]]:
+        """Iterate over the rows."""
+        return (self.row(index) for index in range(len(self)))
+
+    def find(self, column_index: int, value: str) -> int | None:
+        """Find the first row whose cell in the column is the value.
+
+        Returns
+        -------
+        int | None
+            The index of the row, or None if no row has the value.
+        """
+        if column_index not in self._indexes:
+            index: dict[str, int] = {}
+            for row_index, cell in enumerate(self._columns[column_index]):
+                if cell:
+                    index.setdefault(cell, row_index)
+            self._indexes[column_index] = index
+        return self._indexes[column_index].get(value)
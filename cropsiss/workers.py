@@ -0,0 +1,219 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Worker processes which cancel items with their own copies of the Chrome profile"""
+from concurrent import futures
+import copy
+import logging
+import multiprocessing
+from multiprocessing import queues
+import os
+import pathlib
+import shutil
+import types
+import typing as t
+
+from selenium import webdriver
+
+from cropsiss import platforms
+
+
+logger = logging.getLogger(__name__)
+
+USER_DATA_DIR_ARG = "--user-data-dir="
+PROFILE_IGNORE = shutil.ignore_patterns(
+    "Singleton*", "lockfile", "Cache", "Code Cache", "GPUCache", "*ShaderCache", "Crashpad"
+)
+
+_worker_options: webdriver.ChromeOptions | None = None
+
+
+def get_user_data_dir(chrome_options: webdriver.ChromeOptions) -> pathlib.Path | None:
+    """Get the user-data-dir of the options, or None if they do not have one."""
+    for arg in chrome_options.arguments:
+        if arg.startswith(USER_DATA_DIR_ARG):
+            return pathlib.Path(arg[len(USER_DATA_DIR_ARG):])
+    return None
+
+
+def with_user_data_dir(
+    chrome_options: webdriver.ChromeOptions,
+    user_data_dir: str | os.PathLike[str]
+) -> webdriver.ChromeOptions:
+    """Copy the options with the user-data-dir replaced."""
+    options = copy.deepcopy(chrome_options)
+    options.arguments[:] = [arg for arg in options.arguments if not arg.startswith(USER_DATA_DIR_ARG)]
+    options.add_argument(f"{USER_DATA_DIR_ARG}{user_data_dir}")
+    return options
+
+
+def clone_profile(master: str | os.PathLike[str], clone: str | os.PathLike[str]) -> None:
+    """Replace the clone with a fresh copy of the master Chrome profile.
+
+    The locks of the running Chrome and the caches are not copied.
+    """
+    shutil.rmtree(clone, ignore_errors=True)
+    if os.path.isdir(master):
+        shutil.copytree(master, clone, ignore=PROFILE_IGNORE, symlinks=True)
+    else:
+        os.makedirs(clone)
+    logger.debug(f"The Chrome profile {master} was cloned to {clone}")
+
+
+def _init_worker(chrome_options: webdriver.ChromeOptions, profiles: "queues.Queue[str | None]") -> None:
+    global _worker_options
+    profile = profiles.get()
+    _worker_options = chrome_options if profile is None else with_user_data_dir(chrome_options, profile)
+
+
+def _cancel(platform: platforms.AbstractPlatform, item_id: str) -> None:
+    assert _worker_options is not None, "The worker is not initialized"
+    platform.cancel(item_id, _worker_options)
+
+
+class CancelPool:
+    """Pool of worker processes which cancel items on the platforms.
+
+    Each worker runs Chrome on its own copy of the profile in the user-data-dir of the options,
+    since Chrome locks a profile to one process. The copies are refreshed from the profile
+    when the pool is created, so that they have the latest login to the platforms.
+    The workers keep their Chrome sessions warm between cancellations.
+    With the concurrency of 1, cancellations run on the calling thread with the options as they are.
+    With more than one tab instead, they are queued and run at once in the tabs of one browser when flushed.
+    Cancellations on the platforms with another backend than `webdriver` are not queued for the tabs.
+    """
+    chrome_options: webdriver.ChromeOptions
+    concurrency: int
+    profiles_dir: str | os.PathLike[str] | None
+    tabs: int
+    backends: dict[str, str]
+    timeouts: dict[str, dict[str, float]]
+    _executor: futures.ProcessPoolExecutor | None
+    _queued: list[tuple[platforms.AbstractPlatform, str, "futures.Future[None]"]]
+
+    def __init__(
+        self,
+        chrome_options: webdriver.ChromeOptions,
+        concurrency: int = 1,
+        profiles_dir: str | os.PathLike[str] | None = None,
+        tabs: int = 1,
+        backends: t.Mapping[str, str] | None = None,
+        timeouts: t.Mapping[str, t.Mapping[str, float]] | None = None
+    ) -> None:
+        """
+        Parameters
+        ----------
+        chrome_options : selenium.webdriver.ChromeOptions
+            Options for Chrome webbrowser.
+        concurrency : int
+            The number of the worker processes.
+        profiles_dir : str | os.PathLike[str] | None
+            The directory to put the copies of the profile in.
+            The profile is not copied if this is None or the options have no user-data-dir.
+        tabs : int
+            The number of the tabs to cancel items in at once, which is available only with the concurrency of 1.
+        backends : Mapping[str, str] | None
+            The backends to cancel items with by the codes of the platforms.
+            The platforms which are not in this cancel items with their own backends.
+        timeouts : Mapping[str, Mapping[str, float]] | None
+            The seconds to wait for the steps of a cancellation by their names, by the codes of the platforms.
+            The steps which are not in this are waited for with the timeouts of the platforms.
+        """
+        if concurrency > 1 and tabs > 1:
+            raise ValueError("Either the concurrency or the tabs must be 1")
+        self.chrome_options = chrome_options
+        self.concurrency = concurrency
+        self.profiles_dir = profiles_dir
+        self.tabs = tabs
+        self.backends = dict(backends or {})
+        self.timeouts = {code: dict(seconds) for code, seconds in (timeouts or {}).items()}
+        self._executor = None
+        self._queued = []
+
+    def _get_executor(self) -> futures.ProcessPoolExecutor:
+        if self._executor is not None:
+            return self._executor
+        context = multiprocessing.get_context("spawn")
+        profiles: "queues.Queue[str | None]" = context.Queue()
+        master = get_user_data_dir(self.chrome_options)
+        for index in range(self.concurrency):
+            if master is None or self.profiles_dir is None:
+                profiles.put(None)
+                continue
+            clone = pathlib.Path(self.profiles_dir) / f"worker-{index}"
+            clone_profile(master, clone)
+            profiles.put(str(clone))
+        self._executor = futures.ProcessPoolExecutor(
+            max_workers=self.concurrency,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.chrome_options, profiles)
+        )
+        return self._executor
+
+    def __enter__(self) -> "CancelPool":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: types.TracebackType | None
+    ) -> None:
+        self.close()
+
+    def submit(self, platform: platforms.AbstractPlatform, item_id: str) -> "futures.Future[None]":
+        """Cancel an item on a platform.
+
+        Returns
+        -------
+        concurrent.futures.Future[None]
+            The future of the cancellation, which raises `cropsiss.exceptions.NotCancelError` on failure.
+            It is done already with the concurrency of 1 and one tab.
+
+        Raises
+        ------
+        ValueError
+            If the platform does not support the backend given to the pool for it.
+        """
+        if platform.code in self.backends:
+            platform = platform.with_backend(self.backends[platform.code])
+        if self.timeouts.get(platform.code):
+            platform = platform.with_timeouts(**self.timeouts[platform.code])
+        if self.concurrency > 1:
+            # The platform is pickled to the worker together with its backend and timeouts.
+            return self._get_executor().submit(_cancel, platform, item_id)
+        future: futures.Future[None] = futures.Future()
+        if self.tabs > 1 and platform.backend == "webdriver":
+            self._queued.append((platform, item_id, future))
+            return future
+        try:
+            platform.cancel(item_id, self.chrome_options)
+            future.set_result(None)
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def flush(self) -> None:
+        """Run the queued cancellations in the tabs, one browser for each platform."""
+        queued, self._queued = self._queued, []
+        platform_codes = list(dict.fromkeys(platform.code for platform, _, _ in queued))
+        for platform_code in platform_codes:
+            cancellations = [cancellation for cancellation in queued if cancellation[0].code == platform_code]
+            platform = cancellations[0][0]
+            item_ids = [item_id for _, item_id, _ in cancellations]
+            try:
+                errors = platform.cancel_in_tabs(item_ids, self.chrome_options, self.tabs)
+            except Exception as err:
+                for _, _, future in cancellations:
+                    future.set_exception(err)
+                continue
+            for _, item_id, future in cancellations:
+                if (error := errors.get(item_id)) is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    def close(self) -> None:
+        """Run the queued cancellations, wait for the submitted ones and stop the workers."""
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -1,15 +1,18 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from concurrent import futures
 from unittest import TestCase, mock
 import pathlib
 import base64
+import tempfile
 import typing as t
 
+import click
 from click import testing
 from selenium import webdriver
 
 import cropsiss
-from cropsiss import exceptions, google
-from cropsiss.cli import cancel, root, sheet
+from cropsiss import exceptions, google, shard, workers
+from cropsiss.cli import browse, cancel, config, root, sheet
 
 
 RUNNER = testing.CliRunner()
@@ -56,6 +59,38 @@ class Test_cancel_mercari(TestCase):
             [mock.call(item_id, CHROME_OPTIONS) for item_id in item_ids]
         )
 
+    @mock.patch("cropsiss.workers.CancelPool")
+    def test_concurrency(self, pool_mock: mock.Mock, cancel_mock: mock.Mock) -> None:
+        pool_mock.return_value.__enter__.return_value.submit.return_value.result.return_value = None
+        result = RUNNER.invoke(
+            root.main,
+            [str(cancel.main.name), str(cancel.cancel_mercari.name), "--concurrency", "3", "m000000001"],
+            catch_exceptions=False
+        )
+        self.assertEqual(result.output, "m000000001: succeeded\n")
+        pool_mock.assert_called_once_with(CHROME_OPTIONS, 3, browse.CHROME_WORKER_DATA_DIR, 1, {}, {})
+
+    def test_concurrency_and_tabs(self, cancel_mock: mock.Mock) -> None:
+        result = RUNNER.invoke(
+            root.main,
+            [str(cancel.main.name), str(cancel.cancel_mercari.name), "-j", "2", "--tabs", "2", "m000000001"]
+        )
+        self.assertEqual(result.exit_code, 2)
+        cancel_mock.assert_not_called()
+
+    def test_tabs(self, cancel_mock: mock.Mock) -> None:
+        item_ids = [f"m{i:09}" for i in range(3)]
+        with mock.patch(
+            "cropsiss.platforms.mercari.Mercari.cancel_in_tabs",
+            return_value={item_ids[0]: None, item_ids[1]: exceptions.NotCancelError(), item_ids[2]: None}
+        ) as cancel_in_tabs_mock:
+            self._test(
+                ["--tabs", "2", *item_ids],
+                f"{item_ids[0]}: succeeded\n{item_ids[1]}: failed\n{item_ids[2]}: succeeded\n"
+            )
+        cancel_in_tabs_mock.assert_called_once_with(item_ids, CHROME_OPTIONS, 2)
+        cancel_mock.assert_not_called()
+
 
 @mock.patch("cropsiss.platforms.yahoo_auction.YahooAuction.cancel")
 class Test_cancel_yahuoku(TestCase):
@@ -88,6 +123,75 @@ class Test_cancel_yahuoku(TestCase):
             [mock.call(item_id, CHROME_OPTIONS) for item_id in item_ids]
         )
 
+    def test_backend(self, cancel_mock: mock.Mock) -> None:
+        with mock.patch("cropsiss.platforms.yahoo_auction.YahooAuction.with_backend", autospec=True,
+                        side_effect=lambda platform, backend: platform) as with_backend_mock:
+            self._test(["--backend", "http", "x000000001"], "x000000001: succeeded\n")
+        with_backend_mock.assert_called_once_with(mock.ANY, "http")
+        cancel_mock.assert_called_once_with("x000000001", CHROME_OPTIONS)
+
+    def test_unsupported_backend(self, cancel_mock: mock.Mock) -> None:
+        for backend in ["mercari=http", "unknown", "unknown=webdriver"]:
+            with self.subTest(backend=backend):
+                result = RUNNER.invoke(
+                    root.main,
+                    [str(cancel.main.name), str(cancel.cancel_yahuoku.name), "--backend", backend, "x000000001"]
+                )
+                self.assertEqual(result.exit_code, 2)
+        cancel_mock.assert_not_called()
+
+
+class Test_parse_backends(TestCase):
+
+    def test(self) -> None:
+        self.assertDictEqual(cancel.parse_backends(mock.Mock(), mock.Mock(), ()), {})
+        self.assertDictEqual(
+            cancel.parse_backends(mock.Mock(), mock.Mock(), ("http",)),
+            {"yahoo_auction": "http"}
+        )
+        self.assertDictEqual(
+            cancel.parse_backends(mock.Mock(), mock.Mock(), ("webdriver", "yahoo_auction=http")),
+            {"mercari": "webdriver", "yahoo_auction": "http"}
+        )
+        self.assertDictEqual(
+            cancel.parse_backends(mock.Mock(), mock.Mock(), ("cdp", "mercari=webdriver")),
+            {"mercari": "webdriver", "yahoo_auction": "cdp"}
+        )
+
+
+class Test_parse_timeouts(TestCase):
+
+    def test(self) -> None:
+        self.assertDictEqual(cancel.parse_timeouts(mock.Mock(), mock.Mock(), ()), {})
+        self.assertDictEqual(
+            cancel.parse_timeouts(
+                mock.Mock(), mock.Mock(), ("button=3", "yahoo_auction.button=1.5", "mercari.confirm=2")
+            ),
+            {"mercari": {"button": 3.0, "confirm": 2.0}, "yahoo_auction": {"button": 1.5}}
+        )
+
+    def test_invalid(self) -> None:
+        for value in ["unknown=1", "mercari.unknown=1", "other.button=1", "button=fast", "button"]:
+            with self.subTest(value=value):
+                with self.assertRaises(click.BadParameter):
+                    cancel.parse_timeouts(mock.Mock(), mock.Mock(), (value,))
+
+
+MAILDIR = pathlib.Path(__file__).parent / "mails"
+
+
+def get_gmail(filename: str, mail_id: str = "mail_id") -> dict[str, t.Any]:
+    with open(MAILDIR / filename) as f:
+        body = f.read()
+    return {
+        "id": mail_id,
+        "payload": {
+            "body": {
+                "data": base64.urlsafe_b64encode(body.encode("utf-8"))
+            }
+        }
+    }
+
 
 @mock.patch("cropsiss.google.mail.GmailAPI", spec_set=google.GmailAPI)
 class Test_get_donelabel_id(TestCase):
@@ -118,53 +222,35 @@ class Test_get_donelabel_id(TestCase):
         gmail_api_mock.create_label.assert_called_once_with(cancel.DONE_LABEL)
 
 
-@mock.patch("cropsiss.cli.cancel.get_donelabel_id", return_value="donelabel")
 @mock.patch("cropsiss.google.mail.GmailAPI", spec_set=google.GmailAPI)
 class Test_generate_sold_mail_ids(TestCase):
 
     def test_platform(
         self,
-        gmail_api_mock: mock.Mock,
-        get_donelabel_id_mock: mock.Mock
+        gmail_api_mock: mock.Mock
     ) -> None:
         for platform in cropsiss.PLATFORMS:
             gmail_api_mock.reset_mock()
-            get_donelabel_id_mock.reset_mock()
             mail_ids = [f"mail_id_{i}" for i in range(3)]
-            gmail_api_mock.search_mail.return_value = mail_ids
+            gmail_api_mock.iter_search_mail.return_value = iter(mail_ids)
             with self.subTest(platform=platform.name):
                 gen = cancel.generate_sold_mail_ids(gmail_api_mock, platform)
                 self.assertListEqual(list(gen), mail_ids)
-                self.assertListEqual(
-                    gmail_api_mock.add_labels.mock_calls,
-                    [mock.call(mail_id, [get_donelabel_id_mock.return_value]) for mail_id in mail_ids]
-                )
-                self.assertEqual(gmail_api_mock.add_labels.call_count, len(mail_ids))
                 query = platform.sold_mail_query + " AND -{label:" + cancel.DONE_LABEL + "}"
-                gmail_api_mock.search_mail.assert_called_once_with(query)
-                get_donelabel_id_mock.assert_called_once_with(gmail_api_mock)
+                gmail_api_mock.iter_search_mail.assert_called_once_with(query)
+                gmail_api_mock.add_labels.assert_not_called()
 
 
+@mock.patch("cropsiss.cli.cancel.get_donelabel_id", return_value="donelabel")
 @mock.patch("cropsiss.cli.cancel.generate_sold_mail_ids")
 @mock.patch("cropsiss.google.mail.GmailAPI", spec_set=google.GmailAPI)
 class Test_generate_sold_item_ids(TestCase):
-    maildir = pathlib.Path(__file__).parent / "mails"
-
-    def get_gmail(self, filename: str) -> dict[str, t.Any]:
-        with open(self.maildir / filename) as f:
-            body = f.read()
-        return {
-            "payload": {
-                "body": {
-                    "data": base64.urlsafe_b64encode(body.encode("utf-8"))
-                }
-            }
-        }
 
     def test_platform(
         self,
         gmail_api_mock: mock.Mock,
         generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock
     ) -> None:
         for platform in cropsiss.PLATFORMS:
             gmail_api_mock.reset_mock()
@@ -173,49 +259,407 @@ class Test_generate_sold_item_ids(TestCase):
                 f"{platform.code}_sold_mail_with_id.txt",
                 f"{platform.code}_sold_mail_without_id.txt"
             ]
-            gmails = [self.get_gmail(filename) for filename in filenames]
-            gmail_api_mock.get_mail.side_effect = gmails
-            mail_ids = [f"mail_id_{i}" for i in range(len(gmails))]
-            generate_sold_mail_ids_mock.return_value = mail_ids
+            mail_ids = [f"mail_id_{i}" for i in range(len(filenames))]
+            gmails = [get_gmail(filename, mail_id) for filename, mail_id in zip(filenames, mail_ids)]
+            gmail_api_mock.get_mails.return_value = gmails
+            generate_sold_mail_ids_mock.return_value = iter(mail_ids)
             with self.subTest(platform=platform.name):
                 gen = cancel.generate_sold_item_ids(gmail_api_mock, platform)
                 self.assertListEqual(list(gen), ["XXXXXXXXX"])
                 generate_sold_mail_ids_mock.assert_called_once_with(gmail_api_mock, platform)
+                gmail_api_mock.get_mails.assert_called_once_with(mail_ids, fields=google.mail.BODY_FIELDS)
+                gmail_api_mock.batch_add_labels.assert_called_once_with(
+                    mail_ids,
+                    [get_donelabel_id_mock.return_value]
+                )
+                gmail_api_mock.add_labels.assert_not_called()
 
+    def test_label_after_processing(
+        self,
+        gmail_api_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        gmail = get_gmail(f"{platform.code}_sold_mail_with_id.txt")
+        gmail_api_mock.get_mails.return_value = [gmail]
+        generate_sold_mail_ids_mock.return_value = iter(["mail_id"])
+        gen = cancel.generate_sold_item_ids(gmail_api_mock, platform)
+        self.assertEqual(next(gen), "XXXXXXXXX")
+        gmail_api_mock.batch_add_labels.assert_not_called()
+        self.assertListEqual(list(gen), [])
+        gmail_api_mock.batch_add_labels.assert_called_once_with(["mail_id"], [get_donelabel_id_mock.return_value])
+
+    def test_search_before_labeling(
+        self,
+        gmail_api_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        mail_ids = [f"mail_id_{i}" for i in range(google.mail.BATCH_SIZE + 1)]
+        searched: list[str] = []
+
+        def search() -> t.Iterator[str]:
+            for mail_id in mail_ids:
+                gmail_api_mock.batch_add_labels.assert_not_called()
+                searched.append(mail_id)
+                yield mail_id
+
+        generate_sold_mail_ids_mock.return_value = search()
+        gmail_api_mock.get_mails.side_effect = lambda chunk, fields: [
+            get_gmail(f"{platform.code}_sold_mail_without_id.txt", mail_id) for mail_id in chunk
+        ]
+        self.assertListEqual(list(cancel.generate_sold_item_ids(gmail_api_mock, platform)), [])
+        self.assertListEqual(searched, mail_ids)
+        self.assertEqual(gmail_api_mock.batch_add_labels.call_count, 2)
 
-@mock.patch("cropsiss.google.sheet.SpreadsheetAPI", spec_set=google.SpreadsheetAPI)
+    def test_not_found(
+        self,
+        gmail_api_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        gmail_api_mock.get_mails.return_value = [get_gmail(f"{platform.code}_sold_mail_with_id.txt", "found")]
+        generate_sold_mail_ids_mock.return_value = iter(["deleted", "found"])
+        self.assertListEqual(list(cancel.generate_sold_item_ids(gmail_api_mock, platform)), ["XXXXXXXXX"])
+        gmail_api_mock.batch_add_labels.assert_called_once_with(["found"], [get_donelabel_id_mock.return_value])
+
+    def test_before_labeling(
+        self,
+        gmail_api_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        gmail_api_mock.get_mails.return_value = [get_gmail(f"{platform.code}_sold_mail_with_id.txt")]
+        generate_sold_mail_ids_mock.return_value = iter(["mail_id"])
+        manager = mock.Mock()
+        manager.attach_mock(gmail_api_mock.batch_add_labels, "batch_add_labels")
+        gen = cancel.generate_sold_item_ids(gmail_api_mock, platform, before_labeling=manager.before_labeling)
+        self.assertEqual(next(gen), "XXXXXXXXX")
+        manager.before_labeling.assert_not_called()
+        self.assertListEqual(list(gen), [])
+        self.assertListEqual(manager.mock_calls, [
+            mock.call.before_labeling(),
+            mock.call.batch_add_labels(["mail_id"], [get_donelabel_id_mock.return_value])
+        ])
+
+
+@mock.patch("cropsiss.google.buffer.SpreadsheetWriteBuffer", spec_set=google.SpreadsheetWriteBuffer)
 class Test_update_sold_to_true(TestCase):
 
     def test_spreadsheet_id(
         self,
-        spreadsheet_api_mock: mock.Mock
+        buffer_mock: mock.Mock
     ) -> None:
         spreadsheet_ids = [f"spreadsheet_id{i}" for i in range(3)]
         index = 1
         for spreadsheet_id in spreadsheet_ids:
-            spreadsheet_api_mock.reset_mock()
-            with self.subTest(index=index):
-                cancel.update_sold_to_true(spreadsheet_api_mock, spreadsheet_id, index)
-                spreadsheet_api_mock.update_values.assert_called_once_with(
+            buffer_mock.reset_mock()
+            with self.subTest(spreadsheet_id=spreadsheet_id):
+                cancel.update_sold_to_true(buffer_mock, shard.Shard(spreadsheet_id), [index])
+                buffer_mock.update_values.assert_called_once_with(
                     spreadsheet_id=spreadsheet_id,
                     range=f"{sheet.SOLD_COLUMN}{index+2}",
                     values=[["TRUE"]],
                     input_option="USER_ENTERED"
                 )
 
-    def test_index(
+    def test_sheet_title(
+        self,
+        buffer_mock: mock.Mock
+    ) -> None:
+        sheet_shard = shard.Shard("spreadsheet_id", 1, "ID管理-2")
+        cancel.update_sold_to_true(buffer_mock, sheet_shard, [3])
+        buffer_mock.update_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            range=f"'ID管理-2'!{sheet.SOLD_COLUMN}5",
+            values=[["TRUE"]],
+            input_option="USER_ENTERED"
+        )
+
+    def test_indexes(
         self,
-        spreadsheet_api_mock: mock.Mock
+        buffer_mock: mock.Mock
     ) -> None:
         spreadsheet_id = "spreadsheet_id"
-        indexes = list(range(3))
-        for index in indexes:
-            spreadsheet_api_mock.reset_mock()
-            with self.subTest(index=index):
-                cancel.update_sold_to_true(spreadsheet_api_mock, spreadsheet_id, index)
-                spreadsheet_api_mock.update_values.assert_called_once_with(
-                    spreadsheet_id=spreadsheet_id,
-                    range=f"{sheet.SOLD_COLUMN}{index+2}",
-                    values=[["TRUE"]],
-                    input_option="USER_ENTERED"
+        indexes_list = [[], [0], [0, 1, 2]]
+        for indexes in indexes_list:
+            buffer_mock.reset_mock()
+            with self.subTest(indexes=indexes):
+                cancel.update_sold_to_true(buffer_mock, shard.Shard(spreadsheet_id), indexes)
+                self.assertListEqual(
+                    buffer_mock.update_values.mock_calls,
+                    [
+                        mock.call(
+                            spreadsheet_id=spreadsheet_id,
+                            range=f"{sheet.SOLD_COLUMN}{index+2}",
+                            values=[["TRUE"]],
+                            input_option="USER_ENTERED"
+                        )
+                        for index in indexes
+                    ]
+                )
+
+
+class Test_history_id(TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = mock.patch("cropsiss.cli.cancel.HISTORY_FILE", pathlib.Path(self.tmpdir.name) / "history_id")
+        self.patcher.start()
+
+    def tearDown(self) -> None:
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_not_saved(self) -> None:
+        self.assertEqual(cancel.load_history_id(), "")
+
+    def test_save(self) -> None:
+        for history_id in ["1", "12", "123"]:
+            with self.subTest(history_id=history_id):
+                cancel.save_history_id(history_id)
+                self.assertEqual(cancel.load_history_id(), history_id)
+
+
+@mock.patch("cropsiss.cli.cancel.load_history_id")
+@mock.patch("cropsiss.google.mail.GmailAPI", spec_set=google.GmailAPI)
+class Test_sync_history(TestCase):
+
+    def test_first_run(self, gmail_api_mock: mock.Mock, load_history_id_mock: mock.Mock) -> None:
+        load_history_id_mock.return_value = ""
+        gmail_api_mock.get_history_id.return_value = "10"
+        self.assertEqual(cancel.sync_history(gmail_api_mock), (None, "10"))
+        gmail_api_mock.list_history.assert_not_called()
+
+    def test_new_mails(self, gmail_api_mock: mock.Mock, load_history_id_mock: mock.Mock) -> None:
+        load_history_id_mock.return_value = "5"
+        gmail_api_mock.list_history.return_value = (["mailId"], "10")
+        self.assertEqual(cancel.sync_history(gmail_api_mock), ({"mailId"}, "10"))
+        # The mails skipping the inbox, e.g. archived by a filter, are included.
+        gmail_api_mock.list_history.assert_called_once_with("5")
+        gmail_api_mock.get_history_id.assert_not_called()
+
+    def test_no_new_mail(self, gmail_api_mock: mock.Mock, load_history_id_mock: mock.Mock) -> None:
+        load_history_id_mock.return_value = "5"
+        gmail_api_mock.list_history.return_value = ([], "6")
+        self.assertEqual(cancel.sync_history(gmail_api_mock), (set(), "6"))
+        gmail_api_mock.get_history_id.assert_not_called()
+
+    def test_expired(self, gmail_api_mock: mock.Mock, load_history_id_mock: mock.Mock) -> None:
+        load_history_id_mock.return_value = "5"
+        gmail_api_mock.list_history.side_effect = exceptions.HistoryExpiredError()
+        gmail_api_mock.get_history_id.return_value = "10"
+        self.assertEqual(cancel.sync_history(gmail_api_mock), (None, "10"))
+
+
+@mock.patch("cropsiss.cli.root.System", spec_set=root.System)
+class Test_cancel_on_other_platforms(TestCase):
+    row = ["c00001", "item", "m000000001", "y000000001", "FALSE"]
+
+    def test_success(self, system_mock: mock.Mock) -> None:
+        for sold_platform in cropsiss.PLATFORMS:
+            system_mock.reset_mock()
+            others = [p for p in cropsiss.PLATFORMS if p.id != sold_platform.id]
+            with self.subTest(platform=sold_platform.name):
+                with mock.patch.object(type(others[0]), "cancel") as cancel_mock:
+                    cancel.cancel_on_other_platforms(
+                        sold_platform, self.row, CHROME_OPTIONS, system_mock, "foo@example.com"
+                    )
+                cancel_mock.assert_called_once_with(self.row[others[0].column_index], CHROME_OPTIONS)
+                system_mock.notify_success.assert_called_once_with(
+                    mail_to="foo@example.com",
+                    platform=others[0],
+                    item_id=self.row[others[0].column_index],
+                    cropsiss_id=self.row[0]
                 )
+                system_mock.notify_fail.assert_not_called()
+
+    def test_fail(self, system_mock: mock.Mock) -> None:
+        sold_platform, other = cropsiss.PLATFORMS
+        with mock.patch.object(type(other), "cancel", side_effect=exceptions.NotCancelError()):
+            cancel.cancel_on_other_platforms(sold_platform, self.row, CHROME_OPTIONS, system_mock, "foo@example.com")
+        system_mock.notify_fail.assert_called_once_with(
+            mail_to="foo@example.com",
+            platform=other,
+            item_id=self.row[other.column_index],
+            cropsiss_id=self.row[0]
+        )
+        system_mock.notify_success.assert_not_called()
+
+    def test_error(self, system_mock: mock.Mock) -> None:
+        sold_platform, other = cropsiss.PLATFORMS
+        with mock.patch.object(type(other), "cancel", side_effect=RuntimeError("The worker died")):
+            notifications = cancel.cancel_on_other_platforms(
+                sold_platform, self.row, CHROME_OPTIONS, system_mock, "foo@example.com"
+            )
+        system_mock.notify_fail.assert_called_once_with(
+            mail_to="foo@example.com",
+            platform=other,
+            item_id=self.row[other.column_index],
+            cropsiss_id=self.row[0]
+        )
+        system_mock.notify_success.assert_not_called()
+        self.assertTrue(all(notification.done() for notification in notifications))
+
+    def test_notifications(self, system_mock: mock.Mock) -> None:
+        sold_platform, other = cropsiss.PLATFORMS
+        pool_mock = mock.Mock(spec_set=workers.CancelPool)
+        future: futures.Future[None] = futures.Future()
+        pool_mock.submit.return_value = future
+        notification, = cancel.cancel_on_other_platforms(
+            sold_platform, self.row, CHROME_OPTIONS, system_mock, "foo@example.com", pool_mock
+        )
+        self.assertFalse(notification.done())
+        system_mock.notify_success.side_effect = lambda **kwargs: self.assertFalse(notification.done())
+        future.set_result(None)
+        system_mock.notify_success.assert_called_once()
+        self.assertTrue(notification.done())
+
+    def test_no_item_id(self, system_mock: mock.Mock) -> None:
+        sold_platform, other = cropsiss.PLATFORMS
+        row = list(self.row)
+        row[other.column_index] = ""
+        with mock.patch.object(type(other), "cancel") as cancel_mock:
+            cancel.cancel_on_other_platforms(sold_platform, row, CHROME_OPTIONS, system_mock, "foo@example.com")
+        cancel_mock.assert_not_called()
+
+    def test_no_mail_to(self, system_mock: mock.Mock) -> None:
+        sold_platform, other = cropsiss.PLATFORMS
+        with mock.patch.object(type(other), "cancel"):
+            cancel.cancel_on_other_platforms(sold_platform, self.row, CHROME_OPTIONS, system_mock, "")
+        system_mock.notify_success.assert_not_called()
+
+
+@mock.patch("cropsiss.cli.root.System")
+@mock.patch("cropsiss.archive.archive_sold_rows", return_value=0)
+@mock.patch("cropsiss.workers.CancelPool")
+@mock.patch("cropsiss.lookup.ShardedLookup")
+@mock.patch("cropsiss.cli.cancel.get_donelabel_id", return_value="donelabel")
+@mock.patch("cropsiss.cli.cancel.generate_sold_mail_ids")
+@mock.patch("cropsiss.google.SpreadsheetWriteBuffer")
+@mock.patch("cropsiss.google.SpreadsheetAPI")
+@mock.patch("cropsiss.google.GmailAPI")
+@mock.patch("cropsiss.google.credentials.Credentials.from_file")
+@mock.patch("cropsiss.cli.config.Config.load", return_value=config.Config(spreadsheet_id="spreadsheet_id"))
+class Test_cancel_through_mail(TestCase):
+    row = ["c00001", "item", "XXXXXXXXX", "XXXXXXXXX", "FALSE"]
+
+    def test_flush_order(
+        self,
+        config_load_mock: mock.Mock,
+        from_file_mock: mock.Mock,
+        gmail_api_mock: mock.Mock,
+        sheet_api_mock: mock.Mock,
+        write_buffer_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock,
+        sharded_lookup_mock: mock.Mock,
+        cancel_pool_mock: mock.Mock,
+        archive_sold_rows_mock: mock.Mock,
+        system_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        gmail_api = gmail_api_mock.return_value
+        gmail_api.get_mails.return_value = [get_gmail(f"{platform.code}_sold_mail_with_id.txt")]
+        generate_sold_mail_ids_mock.side_effect = lambda api, p: iter(["mail_id"] if p == platform else [])
+        sheet_lookup = sharded_lookup_mock.return_value.__enter__.return_value
+        sheet_lookup.find.return_value = (shard.Shard("spreadsheet_id"), 0, self.row)
+        pool = cancel_pool_mock.return_value.__enter__.return_value
+        done: futures.Future[None] = futures.Future()
+        done.set_result(None)
+        pool.submit.return_value = done
+        manager = mock.Mock()
+        manager.attach_mock(pool.submit, "submit")
+        manager.attach_mock(pool.flush, "flush")
+        manager.attach_mock(gmail_api.batch_add_labels, "batch_add_labels")
+        manager.attach_mock(archive_sold_rows_mock, "archive_sold_rows")
+        result = RUNNER.invoke(
+            root.main,
+            ["cancel", "mail", "--tabs", "2", "--archive-after", "30"],
+            catch_exceptions=False
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertListEqual(
+            [name for name, _, _ in manager.mock_calls],
+            ["submit", "flush", "batch_add_labels", "flush", "archive_sold_rows"]
+        )
+
+    def test_label_after_notification(
+        self,
+        config_load_mock: mock.Mock,
+        from_file_mock: mock.Mock,
+        gmail_api_mock: mock.Mock,
+        sheet_api_mock: mock.Mock,
+        write_buffer_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock,
+        sharded_lookup_mock: mock.Mock,
+        cancel_pool_mock: mock.Mock,
+        archive_sold_rows_mock: mock.Mock,
+        system_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        gmail_api = gmail_api_mock.return_value
+        gmail_api.get_mails.return_value = [get_gmail(f"{platform.code}_sold_mail_with_id.txt")]
+        generate_sold_mail_ids_mock.side_effect = lambda api, p: iter(["mail_id"] if p == platform else [])
+        sheet_lookup = sharded_lookup_mock.return_value.__enter__.return_value
+        sheet_lookup.find.return_value = (shard.Shard("spreadsheet_id"), 0, self.row)
+        pool = cancel_pool_mock.return_value.__enter__.return_value
+        # The queued cancellation fails with an error other than NotCancelError when the pool is flushed.
+        queued: futures.Future[None] = futures.Future()
+        pool.submit.return_value = queued
+
+        def flush() -> None:
+            if not queued.done():
+                queued.set_exception(RuntimeError("The worker died"))
+
+        pool.flush.side_effect = flush
+        system = system_mock.return_value
+        manager = mock.Mock()
+        manager.attach_mock(system.notify_fail, "notify_fail")
+        manager.attach_mock(gmail_api.batch_add_labels, "batch_add_labels")
+        result = RUNNER.invoke(
+            root.main,
+            ["cancel", "mail", "--tabs", "2", "--mail-to", "foo@example.com"],
+            catch_exceptions=False
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertListEqual([name for name, _, _ in manager.mock_calls], ["notify_fail", "batch_add_labels"])
+        system.notify_success.assert_not_called()
+
+    def test_incremental(
+        self,
+        config_load_mock: mock.Mock,
+        from_file_mock: mock.Mock,
+        gmail_api_mock: mock.Mock,
+        sheet_api_mock: mock.Mock,
+        write_buffer_mock: mock.Mock,
+        generate_sold_mail_ids_mock: mock.Mock,
+        get_donelabel_id_mock: mock.Mock,
+        sharded_lookup_mock: mock.Mock,
+        cancel_pool_mock: mock.Mock,
+        archive_sold_rows_mock: mock.Mock,
+        system_mock: mock.Mock
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        gmail_api = gmail_api_mock.return_value
+        gmail_api.get_mails.return_value = [get_gmail(f"{platform.code}_sold_mail_with_id.txt", "lagged")]
+        generate_sold_mail_ids_mock.side_effect = lambda api, p: iter(["lagged"] if p == platform else [])
+        sharded_lookup_mock.return_value.__enter__.return_value.find.return_value = None
+        args = ["cancel", "mail", "--incremental"]
+        with mock.patch("cropsiss.cli.cancel.sync_history", return_value=({"new"}, "20")), \
+                mock.patch("cropsiss.cli.cancel.save_history_id") as save_history_id_mock:
+            self.assertEqual(RUNNER.invoke(root.main, args, catch_exceptions=False).exit_code, 0)
+        # The sold mail which the history had before the last run but the search did not is processed now.
+        gmail_api.batch_add_labels.assert_called_once_with(["lagged"], ["donelabel"])
+        save_history_id_mock.assert_called_once_with("20")
+        generate_sold_mail_ids_mock.reset_mock()
+        with mock.patch("cropsiss.cli.cancel.sync_history", return_value=(set(), "21")), \
+                mock.patch("cropsiss.cli.cancel.save_history_id") as save_history_id_mock:
+            self.assertEqual(RUNNER.invoke(root.main, args, catch_exceptions=False).exit_code, 0)
+        generate_sold_mail_ids_mock.assert_not_called()
+        save_history_id_mock.assert_called_once_with("21")
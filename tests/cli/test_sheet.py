@@ -1,16 +1,22 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 from unittest import TestCase, mock
+import json
 import typing as t
 
 from click import testing
+from googleapiclient import errors
+import httplib2
 
 import cropsiss
-from cropsiss import platforms
+from cropsiss import archive, ids, layout, lookup, platforms, shard
 from cropsiss.cli import sheet, root, config
+from tests import sheets
 
 
 RUNNER = testing.CliRunner()
 CONFIG = config.Config(spreadsheet_id="spreadsheet_id")
+SHARD = shard.Shard(CONFIG.spreadsheet_id)
+ROUTER = shard.ShardRouter([SHARD])
 CONFIG_PATCHER = mock.patch("cropsiss.cli.config.Config.load", return_value=CONFIG)
 CREDENTIALS_PATCHER = mock.patch("cropsiss.google.credentials.Credentials.from_file")
 
@@ -28,9 +34,52 @@ def tearDownModule() -> None:
     CREDENTIALS_PATCHER.stop()
 
 
+class SnapshotTestCase(sheets.SnapshotTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.snapshot_patcher = mock.patch("cropsiss.cli.sheet.SNAPSHOT_FILE", self.snapshot_file)
+        self.snapshot_patcher.start()
+        # The IDs were allocated on the configured shard.
+        self.layout_patcher = mock.patch(
+            "cropsiss.google.sheet.SpreadsheetAPI.search_developer_metadata",
+            return_value=[{"metadataValue": json.dumps([SHARD.key])}]
+        )
+        self.layout_patcher.start()
+
+    def tearDown(self) -> None:
+        self.layout_patcher.stop()
+        self.snapshot_patcher.stop()
+        super().tearDown()
+
+
 @mock.patch("cropsiss.google.sheet.SpreadsheetAPI.update_values")
 @mock.patch("cropsiss.google.sheet.SpreadsheetAPI.batch_update")
-class Test_init_sheet(TestCase):
+class Test_init_sheet(SnapshotTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.row_count_patcher = mock.patch(
+            "cropsiss.google.sheet.SpreadsheetAPI.get_row_count",
+            return_value=1000
+        )
+        self.row_count_patcher.start()
+        self.iter_values_patcher = mock.patch(
+            "cropsiss.google.sheet.SpreadsheetAPI.iter_values",
+            side_effect=sheets.fake_iter_values([])
+        )
+        self.iter_values_mock = self.iter_values_patcher.start()
+        self.get_formats_patcher = mock.patch(
+            "cropsiss.google.sheet.SpreadsheetAPI.get_formats",
+            return_value=[]
+        )
+        self.get_formats_mock = self.get_formats_patcher.start()
+
+    def tearDown(self) -> None:
+        self.get_formats_patcher.stop()
+        self.iter_values_patcher.stop()
+        self.row_count_patcher.stop()
+        super().tearDown()
 
     def _test(
         self,
@@ -41,18 +90,24 @@ class Test_init_sheet(TestCase):
         result = RUNNER.invoke(root.main, args, catch_exceptions=False)
         self.assertEqual(result.output, "Initialized the Google Spreadsheet\n")
         self.assertEqual(result.exit_code, 0)
-        batch_update_mock.assert_called_once_with(
+        self.assertEqual(batch_update_mock.call_args_list[0], mock.call(
             spreadsheet_id=CONFIG.spreadsheet_id,
             requests={
-                "requests": [sheet.CLEAR, *sheet.INIT_REQUESTS] if "--clear" in args else sheet.INIT_REQUESTS
+                "requests": [*sheet.CLEAR, *sheet.INIT_REQUESTS] if "--clear" in args else sheet.INIT_REQUESTS
             }
-        )
+        ))
+        # The cleared sheet forgets the shards which the IDs were allocated on.
+        self.assertEqual(batch_update_mock.call_count, 2 if "--clear" in args else 1)
         update_values_mock.assert_called_once_with(
             spreadsheet_id=CONFIG.spreadsheet_id,
             range="A2:A1000",
             values=[[f"c{i:05}" for i in range(1, 1000)]],
             major_dimension="COLUMNS"
         )
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            self.assertEqual(len(snapshot), 999)
+            for i in range(1, 1000):
+                self.assertEqual(snapshot.find_row(0, f"c{i:05}"), i - 1)
 
     def test_success(
         self,
@@ -70,6 +125,50 @@ class Test_init_sheet(TestCase):
         args = [str(sheet.main.name), str(sheet.init_sheet.name), "--clear"]
         self._test(args, batch_update_mock, update_values_mock)
 
+    def test_keep_snapshot(
+        self,
+        batch_update_mock: mock.Mock,
+        update_values_mock: mock.Mock,
+    ) -> None:
+        platform = cropsiss.PLATFORMS[0]
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            row = ["x", "", "", "", "FALSE"]
+            row[platform.column_index] = "m000000001"
+            snapshot.update_row(0, row)
+        args = [str(sheet.main.name), str(sheet.init_sheet.name)]
+        self._test(args, batch_update_mock, update_values_mock)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            self.assertEqual(snapshot.find_row(platform.column_index, "m000000001"), 0)
+            self.assertEqual(snapshot.find_row(0, "c00001"), 0)
+            self.assertIsNone(snapshot.find_row(0, "x"))
+
+    def test_initialized(
+        self,
+        batch_update_mock: mock.Mock,
+        update_values_mock: mock.Mock,
+    ) -> None:
+        args = [str(sheet.main.name), str(sheet.init_sheet.name)]
+        self._test(args, batch_update_mock, update_values_mock)
+        batch_update_mock.reset_mock()
+        update_values_mock.reset_mock()
+        self.iter_values_mock.reset_mock()
+        result = RUNNER.invoke(root.main, args, catch_exceptions=False)
+        self.assertEqual(result.exit_code, 0)
+        update_values_mock.assert_not_called()
+        self.iter_values_mock.assert_not_called()
+
+    def test_formatted(
+        self,
+        batch_update_mock: mock.Mock,
+        update_values_mock: mock.Mock,
+    ) -> None:
+        self.get_formats_mock.return_value = [sheets.initialized_state(sheet.INIT_REQUESTS)]
+        args = [str(sheet.main.name), str(sheet.init_sheet.name)]
+        result = RUNNER.invoke(root.main, args, catch_exceptions=False)
+        self.assertEqual(result.exit_code, 0)
+        self.get_formats_mock.assert_called_once_with(CONFIG.spreadsheet_id, [layout.INIT_RANGE])
+        batch_update_mock.assert_not_called()
+
 
 @mock.patch("webbrowser.open")
 class Test_open_sheet(TestCase):
@@ -82,12 +181,34 @@ class Test_open_sheet(TestCase):
 
 
 @mock.patch("cropsiss.google.sheet.SpreadsheetAPI.update_values")
-@mock.patch("cropsiss.google.sheet.SpreadsheetAPI.get_values")
-class Test_update_sheet(TestCase):
+@mock.patch("cropsiss.google.sheet.SpreadsheetAPI.batch_get_values")
+class Test_update_sheet(SnapshotTestCase):
+    rows = [[f"c{i:05}", "", "", "", "FALSE"] for i in range(1, 5)]
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.batch_update_patcher = mock.patch("cropsiss.google.sheet.SpreadsheetAPI.batch_update")
+        self.batch_update_mock = self.batch_update_patcher.start()
+        self.data_filter_patcher = mock.patch(
+            "cropsiss.google.sheet.SpreadsheetAPI.batch_get_values_by_data_filter",
+            return_value=[]
+        )
+        self.data_filter_patcher.start()
+        self.iter_values_patcher = mock.patch(
+            "cropsiss.google.sheet.SpreadsheetAPI.iter_values",
+            side_effect=sheets.fake_iter_values(self.rows)
+        )
+        self.iter_values_mock = self.iter_values_patcher.start()
+
+    def tearDown(self) -> None:
+        self.iter_values_patcher.stop()
+        self.data_filter_patcher.stop()
+        self.batch_update_patcher.stop()
+        super().tearDown()
 
     def _test_success(
         self,
-        get_values_mock: mock.Mock,
+        batch_get_values_mock: mock.Mock,
         update_values_mock: mock.Mock,
         cropsiss_id: str = "c00001",
         platform: platforms.AbstractPlatform = cropsiss.PLATFORMS[0],
@@ -107,40 +228,64 @@ class Test_update_sheet(TestCase):
             )
         self.assertEqual(result.output, f"Updated {cell} to {value}\n")
         self.assertEqual(result.exit_code, 0)
-        get_values_mock.assert_called_once_with(
-            spreadsheet_id=CONFIG.spreadsheet_id,
-            range="A2:A",
-            major_dimension="COLUMNS"
-        )
         update_values_mock.assert_called_once_with(
             spreadsheet_id=CONFIG.spreadsheet_id,
             range=cell,
             values=[[value]]
         )
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            row = snapshot.get_row(int(cropsiss_id.strip("c")) - 1)
+        assert row is not None
+        self.assertEqual(row[platform.column_index], value)
+        self.batch_update_mock.assert_called_once_with(
+            spreadsheet_id=CONFIG.spreadsheet_id,
+            requests={"requests": lookup.tag_requests(int(cropsiss_id.strip("c")) - 1, row)}
+        )
 
     def test_cropsiss_id_exists(
         self,
-        get_values_mock: mock.Mock,
+        batch_get_values_mock: mock.Mock,
         update_values_mock: mock.Mock
     ) -> None:
-        cropsiss_ids = [f"c{i:05}" for i in range(1, 5)]
-        get_values_mock.return_value = [cropsiss_ids]
-        for cropsiss_id in cropsiss_ids:
-            get_values_mock.reset_mock()
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(self.rows)
+        for row in self.rows:
+            cropsiss_id = row[0]
+            batch_get_values_mock.reset_mock()
             update_values_mock.reset_mock()
+            self.batch_update_mock.reset_mock()
             with self.subTest(cropsiss_id=cropsiss_id):
                 self._test_success(
-                    get_values_mock,
+                    batch_get_values_mock,
                     update_values_mock,
                     cropsiss_id=cropsiss_id
                 )
 
+    def test_snapshot(
+        self,
+        batch_get_values_mock: mock.Mock,
+        update_values_mock: mock.Mock
+    ) -> None:
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(self.rows)
+        # The row of a CropsissID is known by the router, so only the row is read.
+        for cropsiss_id, row_number in [("c00002", 3), ("c00003", 4)]:
+            batch_get_values_mock.reset_mock()
+            update_values_mock.reset_mock()
+            self.batch_update_mock.reset_mock()
+            self._test_success(batch_get_values_mock, update_values_mock, cropsiss_id=cropsiss_id)
+            self.iter_values_mock.assert_not_called()
+            batch_get_values_mock.assert_called_once_with(
+                spreadsheet_id=CONFIG.spreadsheet_id,
+                ranges=[f"A{row_number}:{sheet.SOLD_COLUMN}{row_number}"]
+            )
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            self.assertEqual(snapshot.find_row(0, "c00003"), 2)
+
     def test_cropsiss_id_does_not_exist(
         self,
-        get_values_mock: mock.Mock,
+        batch_get_values_mock: mock.Mock,
         update_values_mock: mock.Mock
     ) -> None:
-        get_values_mock.return_value = [[f"c{i:05}" for i in range(1, 5)]]
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(self.rows)
         cropsiss_id = "c10000"
         platform = cropsiss.PLATFORMS[0]
         value = "m0000000001"
@@ -160,36 +305,168 @@ class Test_update_sheet(TestCase):
         )
         self.assertEqual(result.exit_code, 1)
         update_values_mock.assert_not_called()
+        self.batch_update_mock.assert_not_called()
+
+    def test_archived(
+        self,
+        batch_get_values_mock: mock.Mock,
+        update_values_mock: mock.Mock
+    ) -> None:
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(
+            [*self.rows[:1], archive.archived_row("c00002"), *self.rows[2:]]
+        )
+        result = RUNNER.invoke(
+            root.main,
+            [str(sheet.main.name), str(sheet.update_sheet.name), "-c", "c00002", "-p", "mercari", "-v", "m0000000001"],
+            catch_exceptions=False
+        )
+        self.assertEqual(result.output, "cropsissID-c00002 has been archived. Please allocate a new one\n")
+        self.assertEqual(result.exit_code, 1)
+        update_values_mock.assert_not_called()
+        self.batch_update_mock.assert_not_called()
 
     def test_platform(
         self,
-        get_values_mock: mock.Mock,
+        batch_get_values_mock: mock.Mock,
         update_values_mock: mock.Mock
     ) -> None:
-        get_values_mock.return_value = [[f"c{i:05}" for i in range(1, 5)]]
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(self.rows)
         for platform in cropsiss.PLATFORMS:
-            get_values_mock.reset_mock()
+            batch_get_values_mock.reset_mock()
             update_values_mock.reset_mock()
+            self.batch_update_mock.reset_mock()
             with self.subTest(platform=platform.name):
                 self._test_success(
-                    get_values_mock,
+                    batch_get_values_mock,
                     update_values_mock,
                     platform=platform
                 )
 
     def test_value(
         self,
-        get_values_mock: mock.Mock,
+        batch_get_values_mock: mock.Mock,
         update_values_mock: mock.Mock
     ) -> None:
-        get_values_mock.return_value = [[f"c{i:05}" for i in range(1, 5)]]
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(self.rows)
         values = [f"m{i:09}" for i in range(3)]
         for value in values:
-            get_values_mock.reset_mock()
+            batch_get_values_mock.reset_mock()
             update_values_mock.reset_mock()
+            self.batch_update_mock.reset_mock()
             with self.subTest(value=value):
                 self._test_success(
-                    get_values_mock,
+                    batch_get_values_mock,
                     update_values_mock,
                     value=value
                 )
+
+    def test_tag_failed(
+        self,
+        batch_get_values_mock: mock.Mock,
+        update_values_mock: mock.Mock
+    ) -> None:
+        batch_get_values_mock.side_effect = sheets.fake_batch_get_values(self.rows)
+        self.batch_update_mock.side_effect = errors.HttpError(httplib2.Response({"status": 400}), b"")
+        self._test_success(batch_get_values_mock, update_values_mock)
+
+
+@mock.patch("cropsiss.google.sheet.SpreadsheetAPI.batch_update")
+class Test_tag_sheet(TestCase):
+    rows = [[f"c{i:05}", "", f"m{i:09}", "", "FALSE"] for i in range(1, 5)]
+
+    def _invoke(self, rows: list[list[str]]) -> str:
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI.batch_get_values") as batch_get_values_mock:
+            batch_get_values_mock.return_value = [[list(column) for column in zip(*rows)]]
+            result = RUNNER.invoke(
+                root.main,
+                [str(sheet.main.name), str(sheet.tag_sheet.name)],
+                catch_exceptions=False
+            )
+        self.assertEqual(result.exit_code, 0)
+        batch_get_values_mock.assert_called_once_with(
+            spreadsheet_id=CONFIG.spreadsheet_id,
+            ranges=[lookup.SNAPSHOT_RANGE],
+            major_dimension="COLUMNS"
+        )
+        return result.output
+
+    def test_success(self, batch_update_mock: mock.Mock) -> None:
+        with mock.patch("cropsiss.lookup.TAG_CHUNK_SIZE", 3):
+            self.assertEqual(self._invoke(self.rows), "Tagged 4 rows\n")
+        self.assertListEqual(
+            batch_update_mock.call_args_list,
+            [
+                mock.call(
+                    spreadsheet_id=CONFIG.spreadsheet_id,
+                    requests={"requests": lookup.untag_sheet_requests()}
+                ),
+                mock.call(
+                    spreadsheet_id=CONFIG.spreadsheet_id,
+                    requests={"requests": [r for i in range(3) for r in lookup.create_tag_requests(i, self.rows[i])]}
+                ),
+                mock.call(
+                    spreadsheet_id=CONFIG.spreadsheet_id,
+                    requests={"requests": lookup.create_tag_requests(3, self.rows[3])}
+                )
+            ]
+        )
+
+    def test_limit(self, batch_update_mock: mock.Mock) -> None:
+        rows = [*self.rows[:2], [*self.rows[2][:4], "TRUE"], self.rows[3]]
+        with mock.patch("cropsiss.lookup.METADATA_CHAR_LIMIT", 3 * lookup.tag_size(self.rows[0])):
+            output = self._invoke(rows)
+        self.assertEqual(output.splitlines()[0], "Tagged 3 rows")
+        self.assertIn("1 rows were left untagged", output)
+        # The sold row is left untagged in favor of the unsold ones.
+        self.assertListEqual(
+            batch_update_mock.call_args_list[1:],
+            [
+                mock.call(
+                    spreadsheet_id=CONFIG.spreadsheet_id,
+                    requests={"requests": [r for i in (0, 1, 3) for r in lookup.create_tag_requests(i, rows[i])]}
+                )
+            ]
+        )
+
+    def test_failed(self, batch_update_mock: mock.Mock) -> None:
+        batch_update_mock.side_effect = [None, None, errors.HttpError(httplib2.Response({"status": 400}), b"")]
+        with mock.patch("cropsiss.lookup.TAG_CHUNK_SIZE", 3):
+            output = self._invoke(self.rows)
+        self.assertEqual(output.splitlines()[0], "Tagged 3 rows")
+        self.assertIn("1 rows were left untagged", output)
+
+
+@mock.patch("cropsiss.google.sheet.SpreadsheetAPI.update_values")
+@mock.patch("cropsiss.google.sheet.SpreadsheetAPI.get_row_count", return_value=1000)
+class Test_add_ids(SnapshotTestCase):
+
+    def test_success(self, row_count_mock: mock.Mock, update_values_mock: mock.Mock) -> None:
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            snapshot.set_meta(ids.ID_COUNT_META, "10")
+        result = RUNNER.invoke(
+            root.main,
+            [str(sheet.main.name), str(sheet.add_ids.name), "-n", "3"],
+            catch_exceptions=False
+        )
+        self.assertEqual(result.output, "Added c00011 to c00013\n")
+        self.assertEqual(result.exit_code, 0)
+        update_values_mock.assert_called_once_with(
+            spreadsheet_id=CONFIG.spreadsheet_id,
+            range="A12:A14",
+            values=[["c00011", "c00012", "c00013"]],
+            major_dimension="COLUMNS"
+        )
+
+
+class Test_get_router(TestCase):
+
+    def test_default(self) -> None:
+        router = sheet.get_router(config.Config(spreadsheet_id="spreadsheet_id"))
+        self.assertEqual(router.shards, (shard.Shard("spreadsheet_id"),))
+
+    def test_shards(self) -> None:
+        cfg = config.Config(spreadsheet_id="s1", shard_tabs="2", shard_spreadsheet_ids="s2, ,s3")
+        self.assertEqual(
+            sheet.get_router(cfg).shards,
+            tuple(shard.make_shards(["s1", "s2", "s3"], 2))
+        )
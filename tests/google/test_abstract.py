@@ -0,0 +1,76 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import threading
+
+from cropsiss.google import abstract, credentials, mail, sheet
+
+
+class Test_build_service(TestCase):
+
+    def test_static_discovery(self) -> None:
+        api = mail.GmailAPI(credentials.Credentials(mock.Mock()))
+        with mock.patch("googleapiclient.discovery.build") as build_mock:
+            self.assertEqual(abstract.build_service(api), build_mock.return_value)
+        build_mock.assert_called_once_with(
+            serviceName=api.service_name,
+            version=api.version,
+            credentials=api.credentials._credentials,
+            cache_discovery=False,
+            static_discovery=True
+        )
+
+
+class Test_new_http(TestCase):
+
+    def test_new_client(self) -> None:
+        api = mail.GmailAPI(credentials.Credentials(mock.Mock()))
+        first, second = abstract.new_http(api), abstract.new_http(api)
+        self.assertIsNot(first, second)
+        self.assertIsNot(first.http, second.http)
+        self.assertIs(first.credentials, api.credentials._credentials)
+
+
+@mock.patch("cropsiss.google.abstract.build_service")
+class Test_get_service(TestCase):
+
+    def setUp(self) -> None:
+        self.local_patcher = mock.patch.object(abstract, "_local", threading.local())
+        self.local_patcher.start()
+
+    def tearDown(self) -> None:
+        self.local_patcher.stop()
+
+    def test_same_api(self, build_mock: mock.Mock) -> None:
+        api = mail.GmailAPI(mock.Mock(spec_set=credentials.Credentials))
+        for _ in range(3):
+            self.assertEqual(abstract.get_service(api), build_mock.return_value)
+        build_mock.assert_called_once_with(api)
+
+    def test_same_credentials(self, build_mock: mock.Mock) -> None:
+        creds = mock.Mock(spec_set=credentials.Credentials)
+        apis = [mail.GmailAPI(creds) for _ in range(3)]
+        for api in apis:
+            abstract.get_service(api)
+        build_mock.assert_called_once_with(apis[0])
+
+    def test_different_credentials(self, build_mock: mock.Mock) -> None:
+        apis = [mail.GmailAPI(mock.Mock(spec_set=credentials.Credentials)) for _ in range(3)]
+        for api in apis:
+            abstract.get_service(api)
+        self.assertListEqual(build_mock.mock_calls, [mock.call(api) for api in apis])
+
+    def test_different_threads(self, build_mock: mock.Mock) -> None:
+        api = mail.GmailAPI(mock.Mock(spec_set=credentials.Credentials))
+        abstract.get_service(api)
+        thread = threading.Thread(target=abstract.get_service, args=(api,))
+        thread.start()
+        thread.join()
+        abstract.get_service(api)
+        self.assertListEqual(build_mock.mock_calls, [mock.call(api), mock.call(api)])
+
+    def test_different_services(self, build_mock: mock.Mock) -> None:
+        creds = mock.Mock(spec_set=credentials.Credentials)
+        apis = [mail.GmailAPI(creds), sheet.SpreadsheetAPI(creds)]
+        for api in apis:
+            abstract.get_service(api)
+        self.assertListEqual(build_mock.mock_calls, [mock.call(api) for api in apis])
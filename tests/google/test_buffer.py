@@ -0,0 +1,178 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import json
+import pathlib
+import tempfile
+
+from cropsiss.google import buffer, sheet
+
+
+class SpreadsheetWriteBufferTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.journal_file = pathlib.Path(self.tmpdir.name) / "journal.jsonl"
+        self.api = mock.Mock(spec_set=sheet.SpreadsheetAPI)
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def read_journal(self) -> list[dict[str, object]]:
+        with open(self.journal_file) as f:
+            return [json.loads(line) for line in f]
+
+
+class TestSpreadsheetWriteBuffer_update_values(SpreadsheetWriteBufferTestCase):
+
+    def test_journal(self) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        buf.update_values("spreadsheet_id", "E2", [["TRUE"]], "USER_ENTERED")
+        buf.update_values("spreadsheet_id", "C3", [["m000"]])
+        self.assertListEqual(
+            self.read_journal(),
+            [
+                {
+                    "spreadsheet_id": "spreadsheet_id",
+                    "range": "E2",
+                    "values": [["TRUE"]],
+                    "input_option": "USER_ENTERED"
+                },
+                {
+                    "spreadsheet_id": "spreadsheet_id",
+                    "range": "C3",
+                    "values": [["m000"]],
+                    "input_option": "RAW"
+                },
+            ]
+        )
+        self.assertEqual(len(buf), 2)
+        self.api.batch_update_values.assert_not_called()
+
+    def test_merge(self) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        for value in ["a", "b", "c"]:
+            buf.update_values("spreadsheet_id", "E2", [[value]])
+        self.assertEqual(len(buf), 1)
+        buf.flush()
+        self.api.batch_update_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            data={"E2": [["c"]]},
+            input_option="RAW"
+        )
+
+    def test_max_size(self) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file, max_size=3)
+        for i in range(2, 5):
+            buf.update_values("spreadsheet_id", f"E{i}", [["TRUE"]])
+        self.api.batch_update_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            data={f"E{i}": [["TRUE"]] for i in range(2, 5)},
+            input_option="RAW"
+        )
+        self.assertEqual(len(buf), 0)
+        self.assertListEqual(self.read_journal(), [])
+
+    @mock.patch("time.monotonic")
+    def test_max_delay(self, monotonic_mock: mock.Mock) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file, max_delay=10.0)
+        monotonic_mock.return_value = 100.0
+        buf.update_values("spreadsheet_id", "E2", [["TRUE"]])
+        monotonic_mock.return_value = 109.0
+        buf.update_values("spreadsheet_id", "E3", [["TRUE"]])
+        self.api.batch_update_values.assert_not_called()
+        monotonic_mock.return_value = 110.0
+        buf.update_values("spreadsheet_id", "E4", [["TRUE"]])
+        self.api.batch_update_values.assert_called_once()
+
+    def test_flush_failure(self) -> None:
+        self.api.batch_update_values.side_effect = Exception("outage")
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file, max_size=1)
+        buf.update_values("spreadsheet_id", "E2", [["TRUE"]])
+        self.assertEqual(len(buf), 1)
+        self.assertEqual(len(self.read_journal()), 1)
+
+
+class TestSpreadsheetWriteBuffer_flush(SpreadsheetWriteBufferTestCase):
+
+    def test_group(self) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        buf.update_values("spreadsheet_id0", "E2", [["TRUE"]], "USER_ENTERED")
+        buf.update_values("spreadsheet_id1", "E2", [["TRUE"]], "USER_ENTERED")
+        buf.update_values("spreadsheet_id0", "C2", [["m000"]], "RAW")
+        buf.flush()
+        self.assertListEqual(
+            self.api.batch_update_values.mock_calls,
+            [
+                mock.call(spreadsheet_id="spreadsheet_id0", data={"E2": [["TRUE"]]}, input_option="USER_ENTERED"),
+                mock.call(spreadsheet_id="spreadsheet_id1", data={"E2": [["TRUE"]]}, input_option="USER_ENTERED"),
+                mock.call(spreadsheet_id="spreadsheet_id0", data={"C2": [["m000"]]}, input_option="RAW"),
+            ]
+        )
+        self.assertListEqual(self.read_journal(), [])
+
+    def test_empty(self) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        buf.flush()
+        self.api.batch_update_values.assert_not_called()
+
+    def test_failure(self) -> None:
+        self.api.batch_update_values.side_effect = Exception("outage")
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        buf.update_values("spreadsheet_id", "E2", [["TRUE"]])
+        with self.assertRaises(Exception):
+            buf.flush()
+        self.assertEqual(len(buf), 1)
+        self.assertEqual(len(self.read_journal()), 1)
+
+
+class TestSpreadsheetWriteBuffer_close(SpreadsheetWriteBufferTestCase):
+
+    def test_context_manager(self) -> None:
+        with buffer.SpreadsheetWriteBuffer(self.api, self.journal_file) as buf:
+            buf.update_values("spreadsheet_id", "E2", [["TRUE"]])
+            self.api.batch_update_values.assert_not_called()
+        self.api.batch_update_values.assert_called_once()
+        self.assertListEqual(self.read_journal(), [])
+
+    def test_exception(self) -> None:
+        with self.assertRaises(RuntimeError):
+            with buffer.SpreadsheetWriteBuffer(self.api, self.journal_file) as buf:
+                buf.update_values("spreadsheet_id", "E2", [["TRUE"]])
+                raise RuntimeError()
+        self.api.batch_update_values.assert_called_once()
+
+    def test_failure(self) -> None:
+        self.api.batch_update_values.side_effect = Exception("outage")
+        with buffer.SpreadsheetWriteBuffer(self.api, self.journal_file) as buf:
+            buf.update_values("spreadsheet_id", "E2", [["TRUE"]])
+        self.assertEqual(len(self.read_journal()), 1)
+
+
+class TestSpreadsheetWriteBuffer_replay(SpreadsheetWriteBufferTestCase):
+
+    def test_replay(self) -> None:
+        self.api.batch_update_values.side_effect = Exception("outage")
+        with buffer.SpreadsheetWriteBuffer(self.api, self.journal_file) as buf:
+            buf.update_values("spreadsheet_id", "E2", [["TRUE"]], "USER_ENTERED")
+            buf.update_values("spreadsheet_id", "E3", [["TRUE"]], "USER_ENTERED")
+        self.api.reset_mock(side_effect=True)
+        with buffer.SpreadsheetWriteBuffer(self.api, self.journal_file) as buf:
+            self.assertEqual(len(buf), 2)
+        self.api.batch_update_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            data={"E2": [["TRUE"]], "E3": [["TRUE"]]},
+            input_option="USER_ENTERED"
+        )
+        self.assertListEqual(self.read_journal(), [])
+
+    def test_broken_entry(self) -> None:
+        entry = {"spreadsheet_id": "spreadsheet_id", "range": "E2", "values": [["TRUE"]], "input_option": "RAW"}
+        with open(self.journal_file, "w") as f:
+            f.write(json.dumps(entry) + "\n" + json.dumps(entry)[:10])
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        self.assertEqual(len(buf), 1)
+
+    def test_no_journal(self) -> None:
+        buf = buffer.SpreadsheetWriteBuffer(self.api, self.journal_file)
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.replay(), 0)
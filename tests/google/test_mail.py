@@ -2,8 +2,14 @@
 from unittest import TestCase, mock
 from email.mime import text
 import base64
+import threading
+import typing as t
 
-from cropsiss.google import mail, credentials
+import httplib2
+from googleapiclient import errors
+
+from cropsiss import exceptions
+from cropsiss.google import abstract, mail, credentials
 
 
 CREDENTIALS_MOCK = mock.Mock(spec_set=credentials.Credentials)
@@ -18,7 +24,13 @@ class TestGmailAPI_properties(TestCase):
         self.assertEqual(self.api.service_name, "gmail")
 
     def test__service(self) -> None:
-        with mock.patch("cropsiss.google.abstract.build_service") as build_mock:
+        with mock.patch.object(abstract, "_local", threading.local()), \
+                mock.patch("cropsiss.google.abstract.build_service") as build_mock:
+            self.assertEqual(
+                self.api._service,
+                build_mock.return_value
+            )
+            build_mock.assert_called_once_with(self.api)
             self.assertEqual(
                 self.api._service,
                 build_mock.return_value
@@ -121,6 +133,71 @@ class TestGmailAPI_search_mail(TestCase):
                 self._test(max_results=max_results)
 
 
+class TestGmailAPI_iter_search_mail(TestCase):
+
+    def setUp(self) -> None:
+        self.api = mail.GmailAPI(CREDENTIALS_MOCK)
+
+    def _test(
+        self,
+        total: int,
+        page_size: int = 100,
+        limit: int | None = None
+    ) -> None:
+        mail_ids = [f"mailId{i}" for i in range(total)]
+
+        def list_(**kwargs: t.Any) -> mock.Mock:
+            start = int(kwargs.get("pageToken", 0))
+            stop = start + kwargs["maxResults"]
+            response: dict[str, t.Any] = {"messages": [{"id": mail_id} for mail_id in mail_ids[start:stop]]}
+            if stop < total:
+                response["nextPageToken"] = str(stop)
+            return mock.Mock(**{"execute.return_value": response})
+
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            list_mock = service_mock.users.return_value.messages.return_value.list
+            list_mock.side_effect = list_
+            expected = mail_ids if limit is None else mail_ids[:limit]
+            self.assertListEqual(
+                list(self.api.iter_search_mail("query", page_size, limit)),
+                expected
+            )
+        pages = max(1, -(-len(expected) // page_size))
+        self.assertEqual(list_mock.call_count, pages)
+        for call in list_mock.call_args_list:
+            self.assertEqual(call.kwargs["q"], "query")
+            self.assertEqual(call.kwargs["fields"], "messages/id,nextPageToken")
+            self.assertLessEqual(call.kwargs["maxResults"], page_size)
+        self.assertNotIn("pageToken", list_mock.call_args_list[0].kwargs)
+
+    def test_page_size(self) -> None:
+        for page_size in [1, 10, 100, 500]:
+            with self.subTest(page_size=page_size):
+                self._test(250, page_size=page_size)
+
+    def test_limit(self) -> None:
+        for limit in [1, 99, 100, 101, 250, 1000]:
+            with self.subTest(limit=limit):
+                self._test(250, limit=limit)
+
+    def test_empty(self) -> None:
+        self._test(0)
+
+    def test_lazy(self) -> None:
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            list_mock = service_mock.users.return_value.messages.return_value.list
+            list_mock.return_value.execute.return_value = {
+                "messages": [{"id": "mailId"}],
+                "nextPageToken": "token"
+            }
+            gen = self.api.iter_search_mail()
+            list_mock.assert_not_called()
+            self.assertEqual(next(gen), "mailId")
+            self.assertEqual(next(gen), "mailId")
+            self.assertEqual(list_mock.call_count, 2)
+            self.assertEqual(list_mock.call_args.kwargs["pageToken"], "token")
+
+
 class TestGmailAPI_get_mail(TestCase):
 
     def setUp(self) -> None:
@@ -150,6 +227,219 @@ class TestGmailAPI_get_mail(TestCase):
                 self._test(mail_id)
 
 
+class TestGmailAPI_get_mails(TestCase):
+
+    def setUp(self) -> None:
+        self.api = mail.GmailAPI(CREDENTIALS_MOCK)
+
+    def _test(self, mail_ids: list[str]) -> None:
+        gmails = {mail_id: {"id": mail_id, "threadId": "threadId", "payload": {}} for mail_id in mail_ids}
+        batches: list[mock.Mock] = []
+
+        def new_batch_http_request(callback: t.Any) -> mock.Mock:
+            requests: list[tuple[str, str]] = []
+            batch = mock.Mock()
+            batch.add.side_effect = lambda request, request_id: requests.append((request_id, request))
+
+            def execute() -> None:
+                # Respond in the reverse order to make sure the order is kept.
+                for request_id, mail_id in reversed(requests):
+                    callback(request_id, gmails[mail_id], None)
+            batch.execute.side_effect = execute
+            batches.append(batch)
+            return batch
+
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            service_mock.new_batch_http_request.side_effect = new_batch_http_request
+            service_mock \
+                .users.return_value \
+                .messages.return_value \
+                .get.side_effect = lambda id, **kwargs: id
+            self.assertListEqual(
+                list(self.api.get_mails(iter(mail_ids))),
+                [gmails[mail_id] for mail_id in mail_ids]
+            )
+        self.assertEqual(len(batches), -(-len(mail_ids) // mail.BATCH_SIZE))
+        for batch in batches:
+            self.assertLessEqual(batch.add.call_count, mail.BATCH_SIZE)
+            batch.execute.assert_called_once_with()
+
+    def test_mail_ids(self) -> None:
+        for n in [0, 1, mail.BATCH_SIZE, mail.BATCH_SIZE + 1, 5 * mail.BATCH_SIZE]:
+            mail_ids = [f"mailId{i}" for i in range(n)]
+            with self.subTest(n=n):
+                self._test(mail_ids)
+
+    def test_fields(self) -> None:
+        def new_batch_http_request(callback: t.Any) -> mock.Mock:
+            batch = mock.Mock()
+            batch.execute.side_effect = lambda: callback("0", {"payload": {}}, None)
+            return batch
+
+        for fields in [None, mail.BODY_FIELDS]:
+            with self.subTest(fields=fields):
+                with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+                    service_mock.new_batch_http_request.side_effect = new_batch_http_request
+                    self.assertListEqual(list(self.api.get_mails(["mailId"], fields=fields)), [{"payload": {}}])
+                kwargs = {"format": "full", "fields": fields} if fields else {}
+                service_mock \
+                    .users.return_value \
+                    .messages.return_value \
+                    .get.assert_called_once_with(userId="me", id="mailId", **kwargs)
+
+    def _http_error(self, status: int, content: bytes = b"") -> errors.HttpError:
+        return errors.HttpError(httplib2.Response({"status": status}), content)
+
+    def _execute(self, responses: list[dict[str, t.Any]]) -> tuple[list[t.Any], list[list[str]], mock.Mock]:
+        """Get the mails with each batch responding with the next of the responses by the mail IDs."""
+        batches: list[list[str]] = []
+
+        def new_batch_http_request(callback: t.Any) -> mock.Mock:
+            requests: list[tuple[str, str]] = []
+            batch = mock.Mock()
+            batch.add.side_effect = lambda request, request_id: requests.append((request_id, request))
+
+            def execute() -> None:
+                response = responses[len(batches)]
+                batches.append([mail_id for _, mail_id in requests])
+                for request_id, mail_id in requests:
+                    if isinstance(response[mail_id], Exception):
+                        callback(request_id, None, response[mail_id])
+                    else:
+                        callback(request_id, response[mail_id], None)
+            batch.execute.side_effect = execute
+            return batch
+
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock, \
+                mock.patch("time.sleep") as sleep_mock:
+            service_mock.new_batch_http_request.side_effect = new_batch_http_request
+            service_mock \
+                .users.return_value \
+                .messages.return_value \
+                .get.side_effect = lambda id, **kwargs: id
+            return list(self.api.get_mails(["mailId0", "mailId1", "mailId2"])), batches, sleep_mock
+
+    def test_error(self) -> None:
+        error = Exception("error")
+        with self.assertRaises(Exception) as cm:
+            self._execute([{"mailId0": {}, "mailId1": error, "mailId2": {}}])
+        self.assertIs(cm.exception, error)
+
+    def test_not_found(self) -> None:
+        not_found = self._http_error(404)
+        gmails, batches, _ = self._execute([{"mailId0": {"id": 0}, "mailId1": not_found, "mailId2": {"id": 2}}])
+        self.assertListEqual(gmails, [{"id": 0}, {"id": 2}])
+        self.assertEqual(len(batches), 1)
+
+    def test_retry(self) -> None:
+        for err in [
+            self._http_error(429),
+            self._http_error(403, b'{"reason": "rateLimitExceeded"}'),
+            self._http_error(503)
+        ]:
+            with self.subTest(status=err.resp.status):
+                gmails, batches, sleep_mock = self._execute([
+                    {"mailId0": {"id": 0}, "mailId1": err, "mailId2": err},
+                    {"mailId1": err, "mailId2": {"id": 2}},
+                    {"mailId1": {"id": 1}}
+                ])
+                self.assertListEqual(gmails, [{"id": 0}, {"id": 1}, {"id": 2}])
+                self.assertListEqual(batches, [["mailId0", "mailId1", "mailId2"], ["mailId1", "mailId2"], ["mailId1"]])
+                self.assertListEqual(sleep_mock.mock_calls, [mock.call(1), mock.call(2)])
+
+    def test_retry_exhausted(self) -> None:
+        err = self._http_error(429)
+        with self.assertRaises(errors.HttpError) as cm:
+            self._execute([{"mailId0": {}, "mailId1": err, "mailId2": {}}] + [{"mailId1": err}] * mail.BATCH_RETRIES)
+        self.assertIs(cm.exception, err)
+
+    def test_permanent_error(self) -> None:
+        for err in [self._http_error(400), self._http_error(403, b'{"reason": "insufficientPermissions"}')]:
+            with self.subTest(status=err.resp.status):
+                with self.assertRaises(errors.HttpError) as cm:
+                    self._execute([{"mailId0": {}, "mailId1": self._http_error(429), "mailId2": err}])
+                self.assertIs(cm.exception, err)
+
+
+class TestGmailAPI_get_history_id(TestCase):
+
+    def setUp(self) -> None:
+        self.api = mail.GmailAPI(CREDENTIALS_MOCK)
+
+    def test(self) -> None:
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            service_mock \
+                .users.return_value \
+                .getProfile.return_value \
+                .execute.return_value = {"historyId": 1234}
+            self.assertEqual(self.api.get_history_id(), "1234")
+        service_mock \
+            .users.return_value \
+            .getProfile.assert_called_once_with(
+                userId="me",
+                fields="historyId"
+            )
+
+
+class TestGmailAPI_list_history(TestCase):
+
+    def setUp(self) -> None:
+        self.api = mail.GmailAPI(CREDENTIALS_MOCK)
+
+    def test_pages(self) -> None:
+        responses = [
+            {
+                "history": [
+                    {"messagesAdded": [{"message": {"id": "mailId0"}}, {"message": {"id": "mailId1"}}]},
+                    {"id": "2"}
+                ],
+                "historyId": "10",
+                "nextPageToken": "token"
+            },
+            {
+                "history": [{"messagesAdded": [{"message": {"id": "mailId2"}}]}],
+                "historyId": "11"
+            }
+        ]
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            list_mock = service_mock.users.return_value.history.return_value.list
+            list_mock.return_value.execute.side_effect = responses
+            self.assertEqual(
+                self.api.list_history("1", label_id="INBOX"),
+                (["mailId0", "mailId1", "mailId2"], "11")
+            )
+        self.assertEqual(list_mock.call_count, 2)
+        kwargs = list_mock.call_args_list[0].kwargs
+        self.assertEqual(kwargs["startHistoryId"], "1")
+        self.assertEqual(kwargs["labelId"], "INBOX")
+        self.assertEqual(kwargs["historyTypes"], ["messageAdded"])
+        self.assertNotIn("pageToken", kwargs)
+        self.assertEqual(list_mock.call_args_list[1].kwargs["pageToken"], "token")
+
+    def test_no_history(self) -> None:
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            list_mock = service_mock.users.return_value.history.return_value.list
+            list_mock.return_value.execute.return_value = {"historyId": "1"}
+            self.assertEqual(self.api.list_history("1"), ([], "1"))
+        self.assertNotIn("labelId", list_mock.call_args.kwargs)
+
+    def test_expired(self) -> None:
+        error = errors.HttpError(httplib2.Response({"status": 404}), b"")
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            list_mock = service_mock.users.return_value.history.return_value.list
+            list_mock.return_value.execute.side_effect = error
+            with self.assertRaises(exceptions.HistoryExpiredError):
+                self.api.list_history("1")
+
+    def test_other_error(self) -> None:
+        error = errors.HttpError(httplib2.Response({"status": 500}), b"")
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            list_mock = service_mock.users.return_value.history.return_value.list
+            list_mock.return_value.execute.side_effect = error
+            with self.assertRaises(errors.HttpError):
+                self.api.list_history("1")
+
+
 class TestGmailAPI_get_labels(TestCase):
     api: mail.GmailAPI
 
@@ -270,3 +560,104 @@ class TestGmailAPI_remove_labels(TestCase):
         for label_ids in label_idses:
             with self.subTest(label_ids=label_ids):
                 self._test(label_ids=label_ids)
+
+
+class TestGmailAPI_batch_add_labels(TestCase):
+
+    def setUp(self) -> None:
+        self.api = mail.GmailAPI(CREDENTIALS_MOCK)
+
+    def _test(
+        self,
+        mail_ids: list[str] = [],
+        label_ids: list[str] = []
+    ) -> None:
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            self.api.batch_add_labels(iter(mail_ids), label_ids)
+        chunks = [
+            mail_ids[i:i+mail.BATCH_MODIFY_SIZE]
+            for i in range(0, len(mail_ids), mail.BATCH_MODIFY_SIZE)
+        ]
+        self.assertListEqual(
+            service_mock.users.return_value.messages.return_value.batchModify.call_args_list,
+            [mock.call(userId="me", body={"ids": chunk, "addLabelIds": label_ids}) for chunk in chunks]
+        )
+
+    def test_mail_ids(self) -> None:
+        for n in [0, 1, mail.BATCH_MODIFY_SIZE, 2 * mail.BATCH_MODIFY_SIZE + 1]:
+            with self.subTest(n=n):
+                self._test(mail_ids=[f"mailId{i}" for i in range(n)], label_ids=["Label_1"])
+
+    def test_label_ids(self) -> None:
+        label_idses = [[f"Label_{i+j}" for i in range(3)] for j in range(3)]
+        for label_ids in label_idses:
+            with self.subTest(label_ids=label_ids):
+                self._test(mail_ids=["mailId"], label_ids=label_ids)
+
+
+class TestGmailAPI_batch_remove_labels(TestCase):
+
+    def setUp(self) -> None:
+        self.api = mail.GmailAPI(CREDENTIALS_MOCK)
+
+    def test_mail_ids(self) -> None:
+        mail_ids = [f"mailId{i}" for i in range(mail.BATCH_MODIFY_SIZE + 1)]
+        label_ids = ["Label_1"]
+        with mock.patch("cropsiss.google.mail.GmailAPI._service") as service_mock:
+            self.api.batch_remove_labels(mail_ids, label_ids)
+        self.assertListEqual(
+            service_mock.users.return_value.messages.return_value.batchModify.call_args_list,
+            [
+                mock.call(userId="me", body={"ids": mail_ids[:mail.BATCH_MODIFY_SIZE], "removeLabelIds": label_ids}),
+                mock.call(userId="me", body={"ids": mail_ids[mail.BATCH_MODIFY_SIZE:], "removeLabelIds": label_ids}),
+            ]
+        )
+
+
+class Test_get_body_text(TestCase):
+
+    @staticmethod
+    def encode(text: str) -> str:
+        return base64.urlsafe_b64encode(text.encode("utf-8")).decode()
+
+    def test_single_part(self) -> None:
+        for body in ["本文", "This is a body"]:
+            gmail = {"payload": {"mimeType": "text/plain", "body": {"data": self.encode(body)}}}
+            with self.subTest(body=body):
+                self.assertEqual(mail.get_body_text(gmail), body)
+
+    def test_multipart(self) -> None:
+        gmail = {
+            "payload": {
+                "mimeType": "multipart/mixed",
+                "body": {"size": 0},
+                "parts": [
+                    {
+                        "mimeType": "multipart/alternative",
+                        "body": {"size": 0},
+                        "parts": [
+                            {"mimeType": "text/plain", "body": {"data": self.encode("plain")}},
+                            {"mimeType": "text/html", "body": {"data": self.encode("<p>html</p>")}},
+                        ]
+                    },
+                    {"mimeType": "application/pdf", "body": {"attachmentId": "attachmentId"}}
+                ]
+            }
+        }
+        self.assertEqual(mail.get_body_text(gmail), "plain")
+
+    def test_skip_non_text(self) -> None:
+        gmail = {
+            "payload": {
+                "mimeType": "multipart/mixed",
+                "parts": [
+                    {"mimeType": "image/png", "body": {"data": self.encode("image")}},
+                    {"mimeType": "text/html", "body": {"data": self.encode("<p>html</p>")}},
+                ]
+            }
+        }
+        self.assertEqual(mail.get_body_text(gmail), "<p>html</p>")
+
+    def test_no_text(self) -> None:
+        gmail = {"payload": {"mimeType": "multipart/mixed", "parts": [{"mimeType": "image/png", "body": {}}]}}
+        self.assertEqual(mail.get_body_text(gmail), "")
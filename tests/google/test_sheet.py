@@ -1,13 +1,15 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 from unittest import TestCase, mock
+import threading
 import typing as t
 
-from cropsiss.google import sheet, credentials
+from cropsiss.google import abstract, sheet, credentials
 
 
 CREDENTIALS_MOCK = mock.Mock(spec_set=credentials.Credentials)
 MajorDimension = t.Literal["ROWS", "COLUMNS"]
 InputOption = t.Literal["RAW", "USER_ENTERED"]
+ValueRenderOption = t.Literal["FORMATTED_VALUE", "UNFORMATTED_VALUE", "FORMULA"]
 
 
 class TestSpreasheetAPI_properties(TestCase):
@@ -19,7 +21,13 @@ class TestSpreasheetAPI_properties(TestCase):
         self.assertEqual(self.api.service_name, "sheets")
 
     def test__service(self) -> None:
-        with mock.patch("cropsiss.google.abstract.build_service") as build_mock:
+        with mock.patch.object(abstract, "_local", threading.local()), \
+                mock.patch("cropsiss.google.abstract.build_service") as build_mock:
+            self.assertEqual(
+                self.api._service,
+                build_mock.return_value
+            )
+            build_mock.assert_called_once_with(self.api)
             self.assertEqual(
                 self.api._service,
                 build_mock.return_value
@@ -83,6 +91,282 @@ class TestSpreadsheetAPI_get_values(TestCase):
                 self._test(major_dimension=major_dimension)
 
 
+class TestSpreadsheetAPI_batch_get_values(TestCase):
+
+    def setUp(self) -> None:
+        self.api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+
+    def _test(
+        self,
+        spreadsheet_id: str = "",
+        ranges: list[str] = [],
+        value_render_option: ValueRenderOption = "FORMATTED_VALUE",
+        major_dimension: MajorDimension = "ROWS",
+    ) -> None:
+        values_list = [[[_range, i]] for i, _range in enumerate(ranges)]
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .values.return_value \
+                .batchGet.return_value \
+                .execute.return_value = {
+                    "spreadsheetId": spreadsheet_id,
+                    "valueRanges": [{"range": _range, "values": values} for _range, values in zip(ranges, values_list)]
+                }
+            self.assertListEqual(
+                self.api.batch_get_values(spreadsheet_id, ranges, value_render_option, major_dimension),
+                values_list
+            )
+        service_mock \
+            .spreadsheets.return_value \
+            .values.return_value \
+            .batchGet.assert_called_once_with(
+                spreadsheetId=spreadsheet_id,
+                ranges=ranges,
+                valueRenderOption=value_render_option,
+                majorDimension=major_dimension
+            )
+
+    def test_spreadsheet_id(self) -> None:
+        spreadsheet_ids = [f"spreadsheetId{i}" for i in range(3)]
+        for spreadsheet_id in spreadsheet_ids:
+            with self.subTest(spreadsheet_id=spreadsheet_id):
+                self._test(spreadsheet_id=spreadsheet_id)
+
+    def test_ranges(self) -> None:
+        ranges_list = [[f"A{i}:C{i+3}" for i in range(1, n)] for n in range(1, 4)]
+        for ranges in ranges_list:
+            with self.subTest(ranges=ranges):
+                self._test(ranges=ranges)
+
+    def test_value_render_option(self) -> None:
+        value_render_options: list[ValueRenderOption] = ["FORMATTED_VALUE", "UNFORMATTED_VALUE", "FORMULA"]
+        for value_render_option in value_render_options:
+            with self.subTest(value_render_option=value_render_option):
+                self._test(ranges=["A1"], value_render_option=value_render_option)
+
+    def test_major_dimension(self) -> None:
+        major_dimensions: list[MajorDimension] = ["ROWS", "COLUMNS"]
+        for major_dimension in major_dimensions:
+            with self.subTest(major_dimension=major_dimension):
+                self._test(ranges=["A1"], major_dimension=major_dimension)
+
+    def test_empty_range(self) -> None:
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .values.return_value \
+                .batchGet.return_value \
+                .execute.return_value = {
+                    "valueRanges": [{"range": "A1:A2", "values": [["a"]]}, {"range": "B1:B2"}]
+                }
+            self.assertListEqual(self.api.batch_get_values("", ["A1:A2", "B1:B2"]), [[["a"]], []])
+
+
+class TestSpreadsheetAPI_get_sheets(TestCase):
+
+    def test_success(self) -> None:
+        api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+        sheets = [{"sheetId": 0, "title": "ID管理"}, {"sheetId": 1, "title": "ID管理-2"}]
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .get.return_value \
+                .execute.return_value = {"sheets": [{"properties": properties} for properties in sheets]}
+            self.assertListEqual(api.get_sheets("spreadsheetId"), sheets)
+        service_mock.spreadsheets.return_value.get.assert_called_once_with(
+            spreadsheetId="spreadsheetId",
+            fields="sheets/properties(sheetId,title)"
+        )
+
+
+class TestSpreadsheetAPI_search_developer_metadata(TestCase):
+
+    def test_success(self) -> None:
+        api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+        metadata = {"metadataId": 1, "metadataKey": "key", "metadataValue": "value"}
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            search_mock = service_mock.spreadsheets.return_value.developerMetadata.return_value.search
+            search_mock.return_value.execute.return_value = {
+                "matchedDeveloperMetadata": [{"developerMetadata": metadata}]
+            }
+            self.assertListEqual(api.search_developer_metadata("spreadsheetId", "key"), [metadata])
+            search_mock.return_value.execute.return_value = {}
+            self.assertListEqual(api.search_developer_metadata("spreadsheetId", "key"), [])
+        lookup = search_mock.call_args.kwargs["body"]["dataFilters"][0]["developerMetadataLookup"]
+        self.assertDictEqual(lookup, {"metadataKey": "key", "locationType": "SPREADSHEET"})
+
+
+class TestSpreadsheetAPI_get_formats(TestCase):
+
+    def test_success(self) -> None:
+        api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+        sheets = [{"properties": {"sheetId": 0, "title": "ID管理"}, "data": [{"rowData": []}]}]
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .get.return_value \
+                .execute.return_value = {"sheets": sheets}
+            self.assertListEqual(api.get_formats("spreadsheetId", ["A1:E2"]), sheets)
+        kwargs = service_mock.spreadsheets.return_value.get.call_args.kwargs
+        self.assertEqual(kwargs["spreadsheetId"], "spreadsheetId")
+        self.assertListEqual(kwargs["ranges"], ["A1:E2"])
+        self.assertIn("conditionalFormats", kwargs["fields"])
+
+
+class TestSpreadsheetAPI_iter_values(TestCase):
+
+    def setUp(self) -> None:
+        self.api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+
+    def _test(
+        self,
+        rows: list[list[str]],
+        row_count: int,
+        first_row: int = 1,
+        chunk_size: int = 1000,
+        prefetch: bool = False
+    ) -> tuple[list[list[t.Any]], list[str], mock.Mock]:
+        def values_get(spreadsheetId: str, range: str, valueRenderOption: str, majorDimension: str) -> mock.Mock:
+            start, end = (int(cell.lstrip("ABCDE")) for cell in range.split(":"))
+            window = rows[start-1:end]
+            while window and not window[-1]:
+                window.pop()
+            request = mock.Mock()
+            request.execute.return_value = {"range": range, "values": window} if window else {"range": range}
+            return request
+
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock, \
+                mock.patch("cropsiss.google.abstract.new_http") as new_http_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .get.return_value \
+                .execute.return_value = {"sheets": [{"properties": {"gridProperties": {"rowCount": row_count}}}]}
+            values_get_mock = service_mock.spreadsheets.return_value.values.return_value.get
+            values_get_mock.side_effect = values_get
+            result = list(self.api.iter_values("spreadsheetId", "A", "E", first_row, chunk_size, prefetch))
+        service_mock.spreadsheets.return_value.get.assert_called_once_with(
+            spreadsheetId="spreadsheetId",
+            ranges=[f"A{first_row}:E"],
+            fields="sheets/properties/gridProperties/rowCount"
+        )
+        ranges = [c.kwargs["range"] for c in values_get_mock.call_args_list]
+        return result, ranges, new_http_mock
+
+    def test_windows(self) -> None:
+        rows = [[f"c{i:05}"] for i in range(1, 11)]
+        result, ranges, new_http_mock = self._test(rows, row_count=12, chunk_size=4)
+        self.assertListEqual(result, rows)
+        self.assertListEqual(ranges, ["A1:E4", "A5:E8", "A9:E12"])
+        new_http_mock.assert_not_called()
+
+    def test_first_row(self) -> None:
+        rows = [["header"], *([f"c{i:05}"] for i in range(1, 6))]
+        result, ranges, _ = self._test(rows, row_count=6, first_row=2, chunk_size=3)
+        self.assertListEqual(result, rows[1:])
+        self.assertListEqual(ranges, ["A2:E4", "A5:E6"])
+
+    def test_empty_rows(self) -> None:
+        rows = [["a"], [], [], [], [], ["b"], [], []]
+        result, _, _ = self._test(rows, row_count=10, chunk_size=3)
+        self.assertListEqual(result, rows[:6])
+
+    def test_empty_sheet(self) -> None:
+        result, ranges, _ = self._test([], row_count=0)
+        self.assertListEqual(result, [])
+        self.assertListEqual(ranges, [])
+
+    def test_sheet_title(self) -> None:
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .get.return_value \
+                .execute.return_value = {"sheets": [{"properties": {"gridProperties": {"rowCount": 3}}}]}
+            values_get_mock = service_mock.spreadsheets.return_value.values.return_value.get
+            values_get_mock.return_value.execute.return_value = {"values": [["a"], ["b"]]}
+            rows = list(self.api.iter_values("spreadsheetId", "A", "E", 2, sheet_title="ID管理-2"))
+        self.assertListEqual(rows, [["a"], ["b"]])
+        service_mock.spreadsheets.return_value.get.assert_called_once_with(
+            spreadsheetId="spreadsheetId",
+            ranges=["'ID管理-2'!A2:E"],
+            fields="sheets/properties/gridProperties/rowCount"
+        )
+        self.assertEqual(values_get_mock.call_args.kwargs["range"], "'ID管理-2'!A2:E3")
+
+    def test_prefetch(self) -> None:
+        rows = [[f"c{i:05}"] for i in range(1, 11)]
+        result, ranges, new_http_mock = self._test(rows, row_count=10, chunk_size=3, prefetch=True)
+        self.assertListEqual(result, rows)
+        self.assertListEqual(ranges, ["A1:E3", "A4:E6", "A7:E9", "A10:E10"])
+        new_http_mock.assert_called_once_with(self.api)
+
+
+class TestSpreadsheetAPI_batch_get_values_by_data_filter(TestCase):
+
+    def setUp(self) -> None:
+        self.api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+
+    def _test(
+        self,
+        spreadsheet_id: str = "",
+        data_filters: list[dict[str, t.Any]] = [],
+        major_dimension: MajorDimension = "ROWS",
+        value_ranges: list[dict[str, t.Any]] = []
+    ) -> list[tuple[str, list[list[t.Any]]]]:
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            service_mock \
+                .spreadsheets.return_value \
+                .values.return_value \
+                .batchGetByDataFilter.return_value \
+                .execute.return_value = {
+                    "spreadsheetId": spreadsheet_id,
+                    "valueRanges": value_ranges
+                }
+            matched = self.api.batch_get_values_by_data_filter(spreadsheet_id, data_filters, major_dimension)
+        service_mock \
+            .spreadsheets.return_value \
+            .values.return_value \
+            .batchGetByDataFilter.assert_called_once_with(
+                spreadsheetId=spreadsheet_id,
+                body={
+                    "dataFilters": data_filters,
+                    "majorDimension": major_dimension
+                }
+            )
+        return matched
+
+    def test_spreadsheet_id(self) -> None:
+        spreadsheet_ids = [f"spreadsheetId{i}" for i in range(3)]
+        for spreadsheet_id in spreadsheet_ids:
+            with self.subTest(spreadsheet_id=spreadsheet_id):
+                self._test(spreadsheet_id=spreadsheet_id)
+
+    def test_data_filters(self) -> None:
+        data_filters_list: list[list[dict[str, t.Any]]] = [
+            [{"a1Range": "A1:E1"}],
+            [{"developerMetadataLookup": {"metadataKey": "key", "metadataValue": "value", "locationType": "ROW"}}]
+        ]
+        for data_filters in data_filters_list:
+            with self.subTest(data_filters=data_filters):
+                self._test(data_filters=data_filters)
+
+    def test_major_dimension(self) -> None:
+        major_dimensions: list[MajorDimension] = ["ROWS", "COLUMNS"]
+        for major_dimension in major_dimensions:
+            with self.subTest(major_dimension=major_dimension):
+                self._test(major_dimension=major_dimension)
+
+    def test_value_ranges(self) -> None:
+        value_ranges = [
+            {"valueRange": {"range": "Sheet1!A2:Z2", "values": [["a", "b"]]}, "dataFilters": []},
+            {"valueRange": {"range": "Sheet1!A5:Z5"}, "dataFilters": []}
+        ]
+        self.assertListEqual(
+            self._test(value_ranges=value_ranges),
+            [("Sheet1!A2:Z2", [["a", "b"]]), ("Sheet1!A5:Z5", [])]
+        )
+
+
 class TestSpreadsheetAPI_update_values(TestCase):
 
     def setUp(self) -> None:
@@ -155,6 +439,71 @@ class TestSpreadsheetAPI_update_values(TestCase):
                 self._test(input_option=input_option)
 
 
+class TestSpreadsheetAPI_batch_update_values(TestCase):
+
+    def setUp(self) -> None:
+        self.api = sheet.SpreadsheetAPI(CREDENTIALS_MOCK)
+
+    def _test(
+        self,
+        spreadsheet_id: str = "",
+        data: dict[str, list[list[str]]] = {},
+        major_dimension: MajorDimension = "ROWS",
+        input_option: InputOption = "RAW",
+    ) -> None:
+        with mock.patch("cropsiss.google.sheet.SpreadsheetAPI._service") as service_mock:
+            self.api.batch_update_values(
+                spreadsheet_id,
+                data,
+                major_dimension,
+                input_option
+            )
+        service_mock \
+            .spreadsheets.return_value \
+            .values.return_value \
+            .batchUpdate.assert_called_once_with(
+                spreadsheetId=spreadsheet_id,
+                body={
+                    "valueInputOption": input_option,
+                    "data": [
+                        {
+                            "range": range,
+                            "majorDimension": major_dimension,
+                            "values": values
+                        }
+                        for range, values in data.items()
+                    ]
+                }
+            )
+
+    def test_spreadsheet_id(self) -> None:
+        spreadsheet_ids = [f"spreadsheetId{i}" for i in range(3)]
+        for spreadsheet_id in spreadsheet_ids:
+            with self.subTest(spreadsheet_id=spreadsheet_id):
+                self._test(spreadsheet_id=spreadsheet_id)
+
+    def test_data(self) -> None:
+        data_list = [
+            {f"E{i}": [[f"value{i+j}"]] for i in range(j)}
+            for j in range(1, 4)
+        ]
+        for data in data_list:
+            with self.subTest(data=data):
+                self._test(data=data)
+
+    def test_major_dimension(self) -> None:
+        major_dimensions: list[MajorDimension] = ["ROWS", "COLUMNS"]
+        for major_dimension in major_dimensions:
+            with self.subTest(major_dimension=major_dimension):
+                self._test(data={"A1": [["a"]]}, major_dimension=major_dimension)
+
+    def test_input_option(self) -> None:
+        input_options: list[InputOption] = ["RAW", "USER_ENTERED"]
+        for input_option in input_options:
+            with self.subTest(input_option=input_option):
+                self._test(data={"A1": [["a"]]}, input_option=input_option)
+
+
 class TestSpreadsheetAPI_clear_values(TestCase):
 
     def setUp(self) -> None:
@@ -1,5 +1,6 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
 from http import server
+from urllib import parse
 
 
 class NoLogHTTPRequestHandler(server.SimpleHTTPRequestHandler):
@@ -10,5 +11,66 @@ class NoLogHTTPRequestHandler(server.SimpleHTTPRequestHandler):
         return
 
 
-def create_server(address: str = "", port: int = 8080) -> server.HTTPServer:
-    return server.HTTPServer((address, port), NoLogHTTPRequestHandler)
+class CancelFormRequestHandler(server.BaseHTTPRequestHandler):
+    """Stand-in of a cancel page which is a plain HTML form.
+
+    The form is accepted only with the cookie `session=ok`, and redirected to a login page on another host otherwise.
+    The form of the item `closed` is answered by the cancel page again with an error message.
+    """
+    FORM = (
+        '<html><body><form action="/config/cancel" method="post">'
+        '<input type="hidden" name="aID" value="{id}"><input type="hidden" name="crumb" value="">'
+        '<input type="submit" name="confirm" value="取り消す"></form></body></html>'
+    )
+    submitted: list[dict[str, list[str]]] = []
+
+    def do_GET(self) -> None:
+        url = parse.urlsplit(self.path)
+        if url.path == "/cancel":
+            self._respond(200, self.FORM.format(id=parse.parse_qs(url.query)["aID"][0]))
+        elif url.path == "/redirect":
+            self._redirect("/login")
+        elif url.path == "/login":
+            self._respond(200, "<html><body>login</body></html>")
+        else:
+            self._respond(404, "")
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        if "session=ok" not in self.headers.get("Cookie", ""):
+            self._redirect(f"http://127.0.0.1:{parse.urlsplit('//' + self.headers['Host']).port}/login")
+            return
+        data = parse.parse_qs(body, keep_blank_values=True)
+        if data["aID"] == ["closed"]:
+            self._respond(200, self.FORM.format(id="closed").replace("<form", "<p>error</p><form"))
+            return
+        self.submitted.append(data)
+        self._respond(200, "<html><body>canceled</body></html>")
+
+    def _respond(self, code: int, html: str) -> None:
+        body = html.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _redirect(self, location: str) -> None:
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_request(self, code=None, size=None) -> None:  # type: ignore
+        return
+
+    def log_error(self, format: str, *args) -> None:  # type: ignore
+        return
+
+
+def create_server(
+    address: str = "",
+    port: int = 8080,
+    handler: type[server.BaseHTTPRequestHandler] = NoLogHTTPRequestHandler
+) -> server.HTTPServer:
+    return server.HTTPServer((address, port), handler)
@@ -1,9 +1,14 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
-from unittest import TestCase
+from unittest import TestCase, mock
+import contextlib
+import typing as t
 
 from selenium import webdriver
+from selenium.common import exceptions as selenium_exceptions
+from selenium.webdriver.remote import webelement
 
-from cropsiss.platforms import base
+from cropsiss import exceptions
+from cropsiss.platforms import base, pool
 
 
 class TestBasePlatform_property(TestCase):
@@ -67,6 +72,254 @@ class TestBasePlatform_cancel(TestCase):
             platform.cancel("", options)
 
 
+class TestBasePlatform_with_backend(TestCase):
+    def test(self) -> None:
+        platform = base.BasePlatform()
+        self.assertEqual(platform.backend, "webdriver")
+        copied = platform.with_backend("webdriver")
+        self.assertIsNot(copied, platform)
+        self.assertEqual(copied.backend, "webdriver")
+        self.assertEqual(platform.with_backend("cdp").backend, "cdp")
+        with self.assertRaises(ValueError):
+            platform.with_backend("http")
+
+
+class TestBasePlatform_with_timeouts(TestCase):
+    def test(self) -> None:
+        platform = base.BasePlatform()
+        copied = platform.with_timeouts(button=1, confirm=2)
+        self.assertEqual(copied.timeouts, base.Timeouts(button=1, confirm=2))
+        self.assertEqual(platform.timeouts, base.Timeouts())
+        with self.assertRaises(TypeError):
+            platform.with_timeouts(unknown=1)
+
+
+@mock.patch("selenium.webdriver.Chrome")
+class TestBasePlatform_chrome(TestCase):
+
+    def test_pool(self, chrome_mock: mock.Mock) -> None:
+        driver_mock = chrome_mock.return_value
+        driver_mock.window_handles = ["first"]
+        platform = base.BasePlatform()
+        platform.driver_pool = pool.DriverPool()
+        options = webdriver.ChromeOptions()
+        options.add_argument("--user-data-dir=profile")
+        for _ in range(2):
+            with platform.chrome(options) as driver:
+                self.assertIs(driver, driver_mock)
+                driver_mock.implicitly_wait.assert_called_with(0)
+                driver_mock.set_page_load_timeout.assert_called_with(platform.timeouts.page_load)
+        chrome_mock.assert_called_once()
+        self.assertListEqual(options.arguments, ["--user-data-dir=profile"])
+        self.assertListEqual(
+            chrome_mock.call_args.kwargs["options"].arguments,
+            ["--user-data-dir=profile", *base.CHROME_ARGS]
+        )
+        platform.driver_pool.close()
+        driver_mock.quit.assert_called_once()
+
+
+class FakeDriver:
+    """Driver whose tabs show the cancel button after some polls."""
+
+    def __init__(
+        self,
+        polls: dict[str, int | None],
+        redirects: dict[str, str] | None = None,
+        navigate: bool = True,
+        blocked: dict[str, int | None] | None = None
+    ) -> None:
+        self.polls = polls
+        self.blocked = blocked or {}
+        self.redirects = redirects or {}
+        self.navigate = navigate
+        self.window_handles = ["blank"]
+        self.current_window_handle = "blank"
+        self.urls = {"blank": "about:blank"}
+        self.clicked: list[str] = []
+        self.max_tabs = 0
+        self.switch_to = mock.Mock()
+        self.switch_to.window.side_effect = self._switch
+
+    def _switch(self, handle: str) -> None:
+        assert handle in self.window_handles
+        self.current_window_handle = handle
+
+    def implicitly_wait(self, seconds: float) -> None:
+        pass
+
+    @property
+    def current_url(self) -> str:
+        return self.urls[self.current_window_handle]
+
+    def execute_script(self, script: str, url: str) -> None:
+        handle = f"tab{len(self.urls)}"
+        self.window_handles.append(handle)
+        self.urls[handle] = self.redirects.get(url, url)
+        self.max_tabs = max(self.max_tabs, len(self.window_handles) - 1)
+
+    def find_elements(self, by: str, xpath: str) -> list[mock.Mock]:
+        url = self.current_url
+        remaining = self.polls[url]
+        if remaining is None:
+            return []
+        if remaining > 0:
+            self.polls[url] = remaining - 1
+            return []
+        button = mock.Mock(spec=webelement.WebElement)
+        button.is_displayed.return_value = True
+        button.click.side_effect = lambda: self._click(url)
+        return [button]
+
+    def _click(self, url: str) -> None:
+        if url in self.blocked:
+            if (remaining := self.blocked[url]) is None or remaining > 0:
+                self.blocked[url] = None if remaining is None else remaining - 1
+                raise selenium_exceptions.ElementClickInterceptedException("covered")
+        self.clicked.append(url)
+        if self.navigate:
+            self.urls[self.current_window_handle] = f"{url}/canceled"
+
+    def close(self) -> None:
+        self.window_handles.remove(self.current_window_handle)
+
+
+class TabPlatform(base.BasePlatform):
+    _name = "platform"
+    _poll_second = 0
+    cancel_button_xpath = "//button"
+
+    def get_cancel_page_url(self, item_id: str) -> str:
+        return f"https://example.com/{item_id}"
+
+
+class TestBasePlatform_cancel_in_tabs(TestCase):
+
+    def _run(
+        self,
+        driver: FakeDriver,
+        item_ids: list[str],
+        tabs: int = 2,
+        wait: float = 5
+    ) -> dict[str, exceptions.NotCancelError | None]:
+        platform = TabPlatform()
+        platform.timeouts = base.Timeouts(page_load=0, button=wait, confirm=wait)
+        chrome = mock.Mock(return_value=contextlib.nullcontext(driver))
+        with mock.patch.object(platform, "chrome", chrome):
+            return platform.cancel_in_tabs(item_ids, webdriver.ChromeOptions(), tabs)
+
+    def test_success(self) -> None:
+        item_ids = [f"m{i:09}" for i in range(5)]
+        urls = [f"https://example.com/{item_id}" for item_id in item_ids]
+        driver = FakeDriver(polls={url: 2 for url in urls})
+        self.assertDictEqual(self._run(driver, item_ids), {item_id: None for item_id in item_ids})
+        self.assertCountEqual(driver.clicked, urls)
+        self.assertEqual(driver.max_tabs, 2)
+        self.assertListEqual(driver.window_handles, ["blank"])
+        self.assertEqual(driver.current_window_handle, "blank")
+
+    def test_not_found(self) -> None:
+        driver = FakeDriver(polls={"https://example.com/a": None, "https://example.com/b": 0})
+        errors = self._run(driver, ["a", "b"], wait=0)
+        self.assertIsInstance(errors["a"], exceptions.NotCancelError)
+        self.assertIsNone(errors["b"])
+        self.assertListEqual(driver.clicked, ["https://example.com/b"])
+
+    def test_not_clickable(self) -> None:
+        driver = FakeDriver(
+            polls={"https://example.com/a": 0, "https://example.com/b": 0},
+            blocked={"https://example.com/a": 2, "https://example.com/b": None}
+        )
+        errors = self._run(driver, ["a", "b"], wait=0.1)
+        self.assertIsNone(errors["a"])
+        self.assertIn("clickable", str(errors["b"]))
+        self.assertListEqual(driver.clicked, ["https://example.com/a"])
+
+    def test_redirected(self) -> None:
+        driver = FakeDriver(
+            polls={"https://example.com/login": 0},
+            redirects={"https://example.com/a": "https://example.com/login"}
+        )
+        errors: dict[str, t.Any] = self._run(driver, ["a"])
+        self.assertIn("logged in", str(errors["a"]))
+        self.assertListEqual(driver.clicked, [])
+
+    def test_unconfirmed(self) -> None:
+        driver = FakeDriver(polls={"https://example.com/a": 0}, navigate=False)
+        self.assertDictEqual(self._run(driver, ["a"], wait=0), {"a": None})
+        self.assertListEqual(driver.clicked, ["https://example.com/a"])
+        self.assertListEqual(driver.window_handles, ["blank"])
+
+
+class TestBasePlatform_cancel_over_cdp(TestCase):
+
+    def setUp(self) -> None:
+        self.platform = TabPlatform().with_backend("cdp")
+        self.page = mock.Mock(timings={"navigate": 0.5})
+        self.page.url = "https://example.com/a"
+        self.page.wait_for_xpath.return_value = True
+        self.page.has_xpath.side_effect = [True, False]
+        browser = mock.Mock()
+        browser.page.return_value = contextlib.nullcontext(self.page)
+        patcher = mock.patch.object(self.platform, "cdp_browser", return_value=contextlib.nullcontext(browser))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_success(self) -> None:
+        self.platform.cancel("a", webdriver.ChromeOptions())
+        self.page.navigate.assert_called_once_with("https://example.com/a", self.platform.timeouts.page_load)
+        self.page.wait_for_xpath.assert_called_once_with("//button", self.platform.timeouts.button)
+        self.page.click.assert_called_once_with("//button")
+        self.page.wait_network_idle.assert_called_once_with(self.platform._network_idle_second, mock.ANY)
+
+    def test_unconfirmed(self) -> None:
+        self.page.has_xpath.side_effect = None
+        self.page.has_xpath.return_value = True
+        self.platform.timeouts = base.Timeouts(confirm=0)
+        self.platform.cancel("a", webdriver.ChromeOptions())
+        self.page.click.assert_called_once_with("//button")
+        self.page.wait_network_idle.assert_not_called()
+
+    def test_navigating(self) -> None:
+        self.page.has_xpath.side_effect = exceptions.CDPError("Execution context was destroyed")
+        self.platform.cancel("a", webdriver.ChromeOptions())
+        self.page.wait_network_idle.assert_not_called()
+
+    def test_redirected(self) -> None:
+        self.page.url = "https://example.com/login"
+        with self.assertRaisesRegex(exceptions.NotCancelError, "logged in"):
+            self.platform.cancel("a", webdriver.ChromeOptions())
+        self.page.click.assert_not_called()
+
+    def test_not_found(self) -> None:
+        self.page.wait_for_xpath.return_value = False
+        with self.assertRaisesRegex(exceptions.NotCancelError, "XPATH"):
+            self.platform.cancel("a", webdriver.ChromeOptions())
+        self.page.click.assert_not_called()
+
+    def test_protocol_error(self) -> None:
+        for error in [exceptions.CDPError("lost"), TimeoutError()]:
+            with self.subTest(error=error):
+                self.page.navigate.side_effect = error
+                with self.assertRaises(exceptions.NotCancelError):
+                    self.platform.cancel("a", webdriver.ChromeOptions())
+
+    def test_browser_error(self) -> None:
+        for error in [exceptions.CDPError("Chrome is not found"), PermissionError()]:
+            with self.subTest(error=error):
+                with mock.patch.object(self.platform, "cdp_browser", side_effect=error):
+                    with self.assertRaises(exceptions.NotCancelError):
+                        self.platform.cancel("a", webdriver.ChromeOptions())
+                self.page.navigate.assert_not_called()
+
+    def test_page_error(self) -> None:
+        browser = mock.Mock()
+        browser.page.side_effect = exceptions.CDPError("Can't open a page")
+        with mock.patch.object(self.platform, "cdp_browser", return_value=contextlib.nullcontext(browser)):
+            with self.assertRaises(exceptions.NotCancelError):
+                self.platform.cancel("a", webdriver.ChromeOptions())
+
+
 class TestBasePlatform___repr__(TestCase):
     def test(self) -> None:
         names = [f"platform{i}" for i in range(3)]
@@ -0,0 +1,232 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import json
+import typing as t
+
+from selenium import webdriver
+import websocket
+
+from cropsiss import exceptions
+from cropsiss.platforms import cdp
+
+
+Responder = t.Callable[[dict[str, t.Any]], list[dict[str, t.Any]]]
+
+
+class FakeSocket:
+    """WebSocket which answers the commands with the messages of the responder."""
+
+    def __init__(self, responder: Responder | None = None) -> None:
+        self.responder = responder or (lambda message: [{"id": message["id"], "result": {}}])
+        self.sent: list[dict[str, t.Any]] = []
+        self.inbox: list[dict[str, t.Any]] = []
+
+    def send(self, data: str) -> None:
+        message = json.loads(data)
+        self.sent.append(message)
+        self.inbox.extend(self.responder(message))
+
+    def recv(self) -> str:
+        if not self.inbox:
+            raise websocket.WebSocketTimeoutException()
+        return json.dumps(self.inbox.pop(0))
+
+    def settimeout(self, timeout: float) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def event(method: str, session_id: str = "session", **params: t.Any) -> dict[str, t.Any]:
+    return {"method": method, "params": params, "sessionId": session_id}
+
+
+class Test_chrome_command(TestCase):
+
+    def test(self) -> None:
+        options = webdriver.ChromeOptions()
+        options.add_argument("--headless")
+        options.add_argument("--user-data-dir=/tmp/profile")
+        command = cdp.chrome_command("chrome", options, "/tmp/profile")
+        self.assertListEqual(command[:3], ["chrome", "--headless", "--user-data-dir=/tmp/profile"])
+        self.assertIn("--remote-debugging-port=0", command)
+        self.assertEqual(command[-1], "about:blank")
+
+    def test_find_chrome(self) -> None:
+        options = webdriver.ChromeOptions()
+        options.binary_location = "/opt/chrome"
+        self.assertEqual(cdp.find_chrome(options), "/opt/chrome")
+        with mock.patch("shutil.which", return_value=None):
+            self.assertIsNone(cdp.find_chrome(webdriver.ChromeOptions()))
+
+
+class TestConnection(TestCase):
+
+    def test_send(self) -> None:
+        socket = FakeSocket(lambda message: [
+            event("Page.loadEventFired"),
+            {"id": message["id"], "result": {"value": 1}},
+        ])
+        connection = cdp.Connection(socket)  # type: ignore[arg-type]
+        self.assertDictEqual(connection.send("Runtime.evaluate", {"expression": "1"}, "session"), {"value": 1})
+        self.assertDictEqual(
+            socket.sent[0],
+            {"id": 1, "method": "Runtime.evaluate", "params": {"expression": "1"}, "sessionId": "session"}
+        )
+        self.assertEqual(
+            connection.wait_event(lambda e: e["method"] == "Page.loadEventFired", 0)["method"],
+            "Page.loadEventFired"
+        )
+
+    def test_error(self) -> None:
+        socket = FakeSocket(lambda message: [{"id": message["id"], "error": {"message": "No target"}}])
+        with self.assertRaisesRegex(exceptions.CDPError, "No target"):
+            cdp.Connection(socket).send("Target.closeTarget")  # type: ignore[arg-type]
+
+    def test_timeout(self) -> None:
+        connection = cdp.Connection(FakeSocket(lambda message: []))  # type: ignore[arg-type]
+        with self.assertRaises(TimeoutError):
+            connection.send("Browser.getVersion")
+        with self.assertRaises(TimeoutError):
+            connection.wait_event(lambda e: True, float("inf"))
+
+    def test_discard_events(self) -> None:
+        socket = FakeSocket(lambda message: [
+            event("Network.requestWillBeSent", "a"),
+            event("Network.requestWillBeSent", "b"),
+            {"id": message["id"], "result": {}},
+        ])
+        connection = cdp.Connection(socket)  # type: ignore[arg-type]
+        connection.send("Page.enable")
+        connection.discard_events("a")
+        self.assertEqual(connection.wait_event(lambda e: True, float("inf"))["sessionId"], "b")
+        connection.send("Page.enable")
+        connection.discard_events()
+        with self.assertRaises(TimeoutError):
+            connection.wait_event(lambda e: True, float("inf"))
+
+
+class TestPage(TestCase):
+
+    def _page(self, responder: Responder) -> tuple[cdp.Page, FakeSocket]:
+        socket = FakeSocket(responder)
+        return cdp.Page(cdp.Connection(socket), "target", "session"), socket  # type: ignore[arg-type]
+
+    def test_navigate(self) -> None:
+        page, socket = self._page(lambda message: [
+            {"id": message["id"], "result": {"frameId": "frame"}},
+            event("Page.loadEventFired", "other"),
+            event("Page.loadEventFired"),
+        ])
+        page.navigate("https://example.com/", 1)
+        self.assertEqual(socket.sent[0]["params"], {"url": "https://example.com/"})
+        self.assertIn("navigate", page.timings)
+
+    def test_navigate_error(self) -> None:
+        page, _ = self._page(lambda message: [{"id": message["id"], "result": {"errorText": "net::ERR"}}])
+        with self.assertRaisesRegex(exceptions.CDPError, "net::ERR"):
+            page.navigate("https://example.com/", 1)
+
+    def test_wait_for_xpath(self) -> None:
+        for value in [True, False]:
+            with self.subTest(value=value):
+                page, socket = self._page(lambda message: [
+                    {"id": message["id"], "result": {"result": {"type": "boolean", "value": value}}}
+                ])
+                self.assertIs(page.wait_for_xpath("//button", 2), value)
+                self.assertTrue(socket.sent[0]["params"]["awaitPromise"])
+                self.assertIn('"//button"', socket.sent[0]["params"]["expression"])
+                self.assertIn("2000", socket.sent[0]["params"]["expression"])
+
+    def test_has_xpath(self) -> None:
+        page, socket = self._page(lambda message: [{"id": message["id"], "result": {"result": {"value": True}}}])
+        self.assertTrue(page.has_xpath("//button"))
+        self.assertIn('"//button"', socket.sent[0]["params"]["expression"])
+
+    def test_evaluate_exception(self) -> None:
+        page, _ = self._page(lambda message: [
+            {"id": message["id"], "result": {"result": {}, "exceptionDetails": {"text": "Uncaught"}}}
+        ])
+        with self.assertRaisesRegex(exceptions.CDPError, "Uncaught"):
+            page.evaluate("throw 1")
+
+    def test_click(self) -> None:
+        def respond(message: dict[str, t.Any]) -> list[dict[str, t.Any]]:
+            if message["method"] == "Runtime.evaluate":
+                return [{"id": message["id"], "result": {"result": {"value": {"x": 10, "y": 20}}}}]
+            return [{"id": message["id"], "result": {}}]
+        page, socket = self._page(respond)
+        page.click("//button")
+        mouse_events = [message["params"] for message in socket.sent[1:]]
+        self.assertListEqual(
+            [params["type"] for params in mouse_events],
+            ["mouseMoved", "mousePressed", "mouseReleased"]
+        )
+        self.assertTrue(all((params["x"], params["y"]) == (10, 20) for params in mouse_events))
+
+    def test_click_missing(self) -> None:
+        page, _ = self._page(lambda message: [{"id": message["id"], "result": {"result": {"value": None}}}])
+        with self.assertRaises(exceptions.CDPError):
+            page.click("//button")
+
+    def test_wait_network_idle(self) -> None:
+        page, socket = self._page(lambda message: [])
+        socket.inbox.extend([
+            event("Network.requestWillBeSent", requestId="1"),
+            event("Network.requestWillBeSent", "other", requestId="2"),
+            event("Network.requestWillBeSent", requestId="3"),
+            event("Network.loadingFinished", requestId="1"),
+            event("Network.loadingFailed", requestId="3"),
+        ])
+        self.assertTrue(page.wait_network_idle(0.01, 1))
+        self.assertListEqual(socket.inbox, [])
+
+    def test_wait_network_idle_timeout(self) -> None:
+        page, socket = self._page(lambda message: [])
+        socket.inbox.append(event("Network.requestWillBeSent", requestId="1"))
+        self.assertFalse(page.wait_network_idle(0.01, 0.05))
+
+
+class TestBrowserPool(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch("cropsiss.platforms.cdp.Browser")
+        self.browser_mock = patcher.start()
+        self.browsers = [mock.Mock() for _ in range(3)]
+        self.browser_mock.side_effect = self.browsers
+        self.addCleanup(patcher.stop)
+        self.pool = cdp.BrowserPool()
+
+    def test_reuse(self) -> None:
+        with self.pool.lend(webdriver.ChromeOptions()) as first:
+            pass
+        with self.pool.lend(webdriver.ChromeOptions()) as second:
+            self.assertIs(second, first)
+        self.browser_mock.assert_called_once()
+        self.assertEqual(len(self.pool), 1)
+
+    def test_probe(self) -> None:
+        first, _, _ = self.browsers
+        first.probe.return_value = False
+        with self.pool.lend(webdriver.ChromeOptions()):
+            pass
+        with self.pool.lend(webdriver.ChromeOptions()) as second:
+            self.assertIsNot(second, first)
+        first.quit.assert_called_once()
+
+    def test_evict_and_close(self) -> None:
+        first, second, third = self.browsers
+        options = webdriver.ChromeOptions()
+        with self.pool.lend(options):
+            pass
+        self.pool.evict(options)
+        first.quit.assert_called_once()
+        self.assertEqual(len(self.pool), 0)
+        with self.pool.lend(options):
+            pass
+        self.pool.close()
+        second.quit.assert_called_once()
+        with self.pool.lend(options):
+            pass
+        third.quit.assert_called_once()
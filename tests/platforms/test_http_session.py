@@ -0,0 +1,75 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import pathlib
+
+import requests
+
+from cropsiss.platforms import http_session
+
+
+CANCEL_PAGE = pathlib.Path(__file__).parent / "yahoo_auction_cancel_page.html"
+
+
+class Test_export_session(TestCase):
+
+    def test(self) -> None:
+        driver = mock.Mock()
+        driver.execute_cdp_cmd.return_value = {"cookies": [
+            {"name": "A", "value": "1", "domain": ".yahoo.co.jp", "path": "/", "secure": True},
+            {"name": "B", "value": "2", "domain": "jp.mercari.com", "path": "/"},
+        ]}
+        driver.execute_script.return_value = "Mozilla/5.0"
+        session = http_session.export_session(driver)
+        driver.execute_cdp_cmd.assert_called_once_with("Network.getAllCookies", {})
+        self.assertEqual(session.cookies.get("A", domain=".yahoo.co.jp"), "1")
+        self.assertEqual(session.cookies.get("B", domain="jp.mercari.com"), "2")
+        self.assertEqual(session.headers["User-Agent"], "Mozilla/5.0")
+
+
+class TestSessionPool(TestCase):
+
+    def test_get(self) -> None:
+        sessions = http_session.SessionPool()
+        factory = mock.Mock(side_effect=lambda: requests.Session())
+        first = sessions.get("a", factory)
+        self.assertIs(sessions.get("a", factory), first)
+        self.assertIsNot(sessions.get("b", factory), first)
+        self.assertEqual(factory.call_count, 2)
+        self.assertEqual(len(sessions), 2)
+        sessions.close()
+        self.assertEqual(len(sessions), 0)
+
+    def test_discard(self) -> None:
+        sessions = http_session.SessionPool()
+        first = sessions.get("a", requests.Session)
+        sessions.discard("a")
+        sessions.discard("missing")
+        self.assertIsNot(sessions.get("a", requests.Session), first)
+        sessions.close()
+
+
+class Test_find_form(TestCase):
+
+    def test_cancel_page(self) -> None:
+        form = http_session.find_form(CANCEL_PAGE.read_text(), "https://page.auctions.yahoo.co.jp/jp/show/", "confirm")
+        assert form is not None
+        self.assertEqual(form.action, "https://page.auctions.yahoo.co.jp/jp/config/cancelauction")
+        self.assertEqual(form.method, "POST")
+        self.assertListEqual(
+            form.data("confirm"),
+            [("aID", "d0000000000"), ("crumb", ""), ("cancel_fee", "none"), ("confirm", "取り消す")]
+        )
+
+    def test_relative(self) -> None:
+        html = (
+            '<form action="search"><input name="q" value="x"><input type="submit" name="go" value="Go"></form>'
+            '<form action="../edit"><input type="checkbox" name="a" value="1">'
+            '<input type="checkbox" name="b" value="2" checked><button name="save" value="s">Save</button>'
+            '<input type="submit" name="delete" value="d"></form>'
+        )
+        form = http_session.find_form(html, "https://example.com/items/1", "save")
+        assert form is not None
+        self.assertEqual(form.action, "https://example.com/edit")
+        self.assertEqual(form.method, "GET")
+        self.assertListEqual(form.data("save"), [("b", "2"), ("save", "s")])
+        self.assertIsNone(http_session.find_form(html, "https://example.com/", "missing"))
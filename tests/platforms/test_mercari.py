@@ -1,11 +1,11 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
-from unittest import TestCase
+from unittest import TestCase, mock
 import threading
 
 from selenium import webdriver
 
 from cropsiss import exceptions
-from cropsiss.platforms import mercari
+from cropsiss.platforms import base, mercari
 from tests.platforms import http
 
 
@@ -63,7 +63,7 @@ class TestMercari_cancel(TestCase):
         options.add_argument("--headless")
         self.chrome_options = options
         self.platform = mercari.Mercari()
-        self.platform._implicitly_wait_second = 1
+        self.platform.timeouts = base.Timeouts(page_load=10, button=1, confirm=1)
         self.url_base: str = f"http://localhost:{self.port}"
 
     def test_url_exists(self) -> None:
@@ -74,3 +74,12 @@ class TestMercari_cancel(TestCase):
         self.platform.EDIT_PAGE = self.url_base + "/unexist_here"
         with self.assertRaises(exceptions.NotCancelError):
             self.platform.cancel("m00000000000", self.chrome_options)
+
+
+class TestMercari_cancel_over_cdp(TestCase):
+
+    @mock.patch("cropsiss.platforms.cdp.find_chrome", return_value=None)
+    def test_chrome_not_found(self, find_chrome_mock: mock.Mock) -> None:
+        with self.assertRaisesRegex(exceptions.NotCancelError, "Chrome is not found"):
+            mercari.Mercari().with_backend("cdp").cancel("m00000000000", webdriver.ChromeOptions())
+        find_chrome_mock.assert_called_once()
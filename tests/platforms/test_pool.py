@@ -0,0 +1,169 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import os
+import time
+
+from selenium import webdriver
+
+from cropsiss.platforms import pool
+
+
+def make_options(*args: str) -> webdriver.ChromeOptions:
+    options = webdriver.ChromeOptions()
+    for arg in args:
+        options.add_argument(arg)
+    return options
+
+
+@mock.patch("selenium.webdriver.Chrome")
+class TestDriverPool_lend(TestCase):
+
+    def setUp(self) -> None:
+        self.pool = pool.DriverPool(max_uses=None, max_age=None, max_rss=None)
+
+    def test_reuse(self, chrome_mock: mock.Mock) -> None:
+        first = chrome_mock.return_value
+        first.window_handles = ["first"]
+        with self.pool.lend(make_options("--user-data-dir=a")) as driver:
+            self.assertIs(driver, first)
+        with self.pool.lend(make_options("--user-data-dir=a")) as driver:
+            self.assertIs(driver, first)
+        chrome_mock.assert_called_once()
+        first.get.assert_called_with("about:blank")
+        first.quit.assert_not_called()
+        self.assertEqual(len(self.pool), 1)
+
+    def test_user_data_dirs(self, chrome_mock: mock.Mock) -> None:
+        chrome_mock.side_effect = lambda options: mock.Mock(window_handles=["first"])
+        with self.pool.lend(make_options("--user-data-dir=a")) as a:
+            pass
+        with self.pool.lend(make_options("--user-data-dir=b")) as b:
+            self.assertIsNot(a, b)
+        self.assertEqual(chrome_mock.call_count, 2)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_concurrent(self, chrome_mock: mock.Mock) -> None:
+        drivers = [mock.Mock(window_handles=["first"]) for _ in range(2)]
+        chrome_mock.side_effect = drivers
+        with self.pool.lend(make_options()) as a, self.pool.lend(make_options()) as b:
+            self.assertIsNot(a, b)
+        self.assertEqual(len(self.pool), 1)
+        self.assertEqual(sum(driver.quit.call_count for driver in drivers), 1)
+
+    def test_reset_windows(self, chrome_mock: mock.Mock) -> None:
+        driver = chrome_mock.return_value
+        driver.window_handles = ["first", "second"]
+        with self.pool.lend(make_options()):
+            pass
+        driver.switch_to.window.assert_has_calls([mock.call("second"), mock.call("first")])
+        driver.close.assert_called_once()
+
+    def test_broken(self, chrome_mock: mock.Mock) -> None:
+        broken, replacement = mock.Mock(window_handles=["first"]), mock.Mock(window_handles=["first"])
+        broken.get.side_effect = Exception("session deleted")
+        chrome_mock.side_effect = [broken, replacement]
+        with self.pool.lend(make_options()):
+            pass
+        with self.pool.lend(make_options()) as driver:
+            self.assertIs(driver, replacement)
+        broken.quit.assert_called_once()
+
+    def test_close(self, chrome_mock: mock.Mock) -> None:
+        driver = chrome_mock.return_value
+        driver.window_handles = ["first"]
+        with self.pool.lend(make_options()):
+            pass
+        self.pool.close()
+        driver.quit.assert_called_once()
+        with self.pool.lend(make_options()):
+            pass
+        self.assertEqual(driver.quit.call_count, 2)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_evict(self, chrome_mock: mock.Mock) -> None:
+        a, b = chrome_mock.side_effect = [mock.Mock(window_handles=["first"]) for _ in range(2)]
+        with self.pool.lend(make_options("--user-data-dir=a")):
+            pass
+        with self.pool.lend(make_options("--user-data-dir=b")):
+            pass
+        self.pool.evict(make_options("--user-data-dir=a"))
+        a.quit.assert_called_once()
+        b.quit.assert_not_called()
+        self.assertEqual(len(self.pool), 1)
+
+
+@mock.patch("selenium.webdriver.Chrome")
+class TestDriverPool_recycle(TestCase):
+
+    def _drivers(self, chrome_mock: mock.Mock, number: int = 2) -> list[mock.Mock]:
+        drivers = [mock.Mock(window_handles=["first"]) for _ in range(number)]
+        chrome_mock.side_effect = drivers
+        return drivers
+
+    def test_max_uses(self, chrome_mock: mock.Mock) -> None:
+        drivers = self._drivers(chrome_mock)
+        driver_pool = pool.DriverPool(max_uses=2, max_age=None, max_rss=None)
+        for expected in [drivers[0], drivers[0], drivers[1]]:
+            with driver_pool.lend(make_options()) as driver:
+                self.assertIs(driver, expected)
+        drivers[0].quit.assert_called_once()
+        driver_pool.close()
+        drivers[1].quit.assert_called_once()
+
+    def test_max_age(self, chrome_mock: mock.Mock) -> None:
+        drivers = self._drivers(chrome_mock)
+        driver_pool = pool.DriverPool(max_uses=None, max_age=60, max_rss=None)
+        with driver_pool.lend(make_options()):
+            pass
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 60):
+            with driver_pool.lend(make_options()) as driver:
+                self.assertIs(driver, drivers[0])
+        with driver_pool.lend(make_options()) as driver:
+            self.assertIs(driver, drivers[1])
+        driver_pool.close()
+
+    def test_max_rss(self, chrome_mock: mock.Mock) -> None:
+        drivers = self._drivers(chrome_mock)
+        driver_pool = pool.DriverPool(max_uses=None, max_age=None, max_rss=100)
+        with mock.patch("cropsiss.platforms.pool.driver_rss", side_effect=[100, 101, 0]):
+            for expected in [drivers[0], drivers[0], drivers[1]]:
+                with driver_pool.lend(make_options()) as driver:
+                    self.assertIs(driver, expected)
+        driver_pool.close()
+
+    def test_probe(self, chrome_mock: mock.Mock) -> None:
+        drivers = self._drivers(chrome_mock)
+        driver_pool = pool.DriverPool(max_uses=None, max_age=None, max_rss=None)
+        with driver_pool.lend(make_options()):
+            pass
+        type(drivers[0]).title = mock.PropertyMock(side_effect=Exception("no such window"))
+        with driver_pool.lend(make_options()) as driver:
+            self.assertIs(driver, drivers[1])
+        drivers[0].quit.assert_called_once()
+        driver_pool.close()
+
+    def test_closed(self, chrome_mock: mock.Mock) -> None:
+        drivers = self._drivers(chrome_mock)
+        driver_pool = pool.DriverPool(max_uses=1, max_age=None, max_rss=None)
+        with driver_pool.lend(make_options()):
+            driver_pool.close()
+        drivers[0].quit.assert_called_once()
+        self.assertEqual(chrome_mock.call_count, 1)
+
+
+class Test_process_tree_rss(TestCase):
+
+    def test_self(self) -> None:
+        rss = pool.process_tree_rss(os.getpid())
+        if rss is None:
+            self.skipTest("/proc is not available")
+        self.assertGreater(rss, 0)
+
+    def test_no_process(self) -> None:
+        self.assertIsNone(pool.process_tree_rss(2 ** 30))
+
+
+class Test_driver_rss(TestCase):
+
+    def test_no_service(self) -> None:
+        self.assertIsNone(pool.driver_rss(mock.Mock(spec=[])))
@@ -1,11 +1,13 @@
 # Copyright (c) 2022 Shuhei Nitta. All rights reserved.
-from unittest import TestCase
+from unittest import TestCase, mock
+from http import server as http_server
 import threading
 
+import requests
 from selenium import webdriver
 
 from cropsiss import exceptions
-from cropsiss.platforms import yahoo_auction
+from cropsiss.platforms import base, http_session, pool, yahoo_auction
 from tests.platforms import http
 
 
@@ -69,7 +71,7 @@ class TestYahooAuction_cancel(TestCase):
         options.add_argument("--headless")
         self.chrome_options = options
         self.platform = yahoo_auction.YahooAuction()
-        self.platform._implicitly_wait_second = 1
+        self.platform.timeouts = base.Timeouts(page_load=10, button=1, confirm=1)
         self.url_base = f"http://localhost:{self.port}"
 
     def test_url_exists(self) -> None:
@@ -80,3 +82,89 @@ class TestYahooAuction_cancel(TestCase):
         self.platform.CANCEL_PAGE = self.url_base + "/unexist_here"
         with self.assertRaises(exceptions.NotCancelError):
             self.platform.cancel("d0000000000", self.chrome_options)
+
+
+class TestYahooAuction_cancel_over_http(TestCase):
+    server: http_server.HTTPServer
+    httpthread: threading.Thread
+    port: int = 8081
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.server = http.create_server(port=cls.port, handler=http.CancelFormRequestHandler)
+        cls.httpthread = threading.Thread(target=cls.server.serve_forever)
+        cls.httpthread.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.server.server_close()
+        cls.server.shutdown()
+        cls.httpthread.join()
+
+    def setUp(self) -> None:
+        http.CancelFormRequestHandler.submitted.clear()
+        self.chrome_options = webdriver.ChromeOptions()
+        self.platform = yahoo_auction.YahooAuction().with_backend("http")
+        self.platform.CANCEL_PAGE = f"http://localhost:{self.port}/cancel?aID={{id}}"  # type: ignore[attr-defined]
+        self.session = requests.Session()
+        self.session.cookies.set("session", "ok")
+        patcher = mock.patch.object(self.platform, "http_session", return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.session.close)
+
+    def test_success(self) -> None:
+        self.platform.cancel_over_http("d000000001", self.chrome_options)
+        self.assertListEqual(
+            http.CancelFormRequestHandler.submitted,
+            [{"aID": ["d000000001"], "crumb": [""], "confirm": ["取り消す"]}]
+        )
+
+    def test_error_page(self) -> None:
+        with self.assertRaises(exceptions.UnexpectedResponseError):
+            self.platform.cancel_over_http("closed", self.chrome_options)
+        self.assertListEqual(http.CancelFormRequestHandler.submitted, [])
+
+    def test_confirmation_text(self) -> None:
+        with mock.patch.object(
+            yahoo_auction.YahooAuction, "confirmation_text", new_callable=mock.PropertyMock, return_value="canceled"
+        ):
+            self.platform.cancel_over_http("d000000001", self.chrome_options)
+        with mock.patch.object(
+            yahoo_auction.YahooAuction, "confirmation_text", new_callable=mock.PropertyMock, return_value="取り消しました"
+        ):
+            with self.assertRaises(exceptions.UnexpectedResponseError):
+                self.platform.cancel_over_http("d000000002", self.chrome_options)
+
+    def test_redirected(self) -> None:
+        self.platform.CANCEL_PAGE = f"http://localhost:{self.port}/redirect?aID={{id}}"  # type: ignore[attr-defined]
+        with self.assertRaises(exceptions.UnexpectedResponseError):
+            self.platform.cancel_over_http("d000000001", self.chrome_options)
+        self.assertListEqual(http.CancelFormRequestHandler.submitted, [])
+
+    def test_not_logged_in(self) -> None:
+        self.session.cookies.clear()
+        with self.assertRaises(exceptions.UnexpectedResponseError):
+            self.platform.cancel_over_http("d000000001", self.chrome_options)
+        self.assertListEqual(http.CancelFormRequestHandler.submitted, [])
+
+    def test_no_server(self) -> None:
+        self.platform.CANCEL_PAGE = "http://localhost:1/cancel?aID={id}"  # type: ignore[attr-defined]
+        with self.assertRaises(exceptions.UnexpectedResponseError):
+            self.platform.cancel_over_http("d000000001", self.chrome_options)
+
+    def test_fallback(self) -> None:
+        self.session.cookies.clear()
+        self.platform.http_sessions = http_session.SessionPool()
+        self.platform.http_sessions.get(pool.options_key(self.chrome_options), lambda: self.session)
+        with mock.patch.object(yahoo_auction.YahooAuction, "cancel_on_browser") as browser_mock:
+            self.platform.cancel("d000000001", self.chrome_options)
+        browser_mock.assert_called_once_with("d000000001", self.chrome_options)
+        self.assertEqual(len(self.platform.http_sessions), 0)
+
+    def test_webdriver(self) -> None:
+        platform = self.platform.with_backend("webdriver")
+        with mock.patch.object(yahoo_auction.YahooAuction, "cancel_on_browser") as browser_mock:
+            platform.cancel("d000000001", self.chrome_options)
+        browser_mock.assert_called_once_with("d000000001", self.chrome_options)
+        self.assertListEqual(http.CancelFormRequestHandler.submitted, [])
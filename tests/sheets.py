@@ -0,0 +1,92 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+"""Fakes of the Google Spreadsheet shared by the tests of the sheet modules"""
+from unittest import TestCase, mock
+import json
+import pathlib
+import tempfile
+import typing as t
+
+from cropsiss import google, lookup, shard
+
+
+class SnapshotTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.snapshot_file = pathlib.Path(self.tmpdir.name) / "snapshot.sqlite3"
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+
+class ShardedTestCase(SnapshotTestCase):
+    shards = shard.make_shards(["spreadsheet_id"], 2)
+    rows = {
+        shards[0]: [["c00001", "", "m000000001", "", "FALSE"], ["c00003", "", "m000000003", "", "FALSE"]],
+        shards[1]: [["c00002", "", "m000000002", "", "FALSE"], ["c00004", "", "m000000004", "", "FALSE"]]
+    }
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.router = shard.ShardRouter(self.shards)
+        self.api_mock = mock.Mock(spec_set=google.SpreadsheetAPI)
+        self.api_mock.batch_get_values_by_data_filter.return_value = []
+        self.api_mock.get_row_count.return_value = 1000
+        self.api_mock.search_developer_metadata.return_value = [
+            {"metadataValue": json.dumps([sheet_shard.key for sheet_shard in self.shards])}
+        ]
+
+        def iter_values(sheet_title: str | None, **kwargs: t.Any) -> t.Iterator[list[str]]:
+            sheet_shard, = [s for s in self.shards if s.title == sheet_title]
+            return (list(row) for row in self.rows[sheet_shard])
+
+        def batch_get_values(spreadsheet_id: str, ranges: list[str]) -> list[list[list[str]]]:
+            sheet_shard, = [s for s in self.shards if s.a1("") == ranges[0][:len(s.a1(""))] and (
+                s.title is not None or "!" not in ranges[0]
+            )]
+            return [[self.rows[sheet_shard][lookup.parse_row_number(ranges[0]) - 2]]]
+
+        self.api_mock.iter_values.side_effect = iter_values
+        self.api_mock.batch_get_values.side_effect = batch_get_values
+
+
+def fake_batch_get_values(rows: list[list[str]]) -> t.Callable[..., list[list[list[str]]]]:
+    def batch_get_values(spreadsheet_id: str, ranges: list[str]) -> list[list[list[str]]]:
+        results = []
+        for _range in ranges:
+            index = int(_range.split(":")[0][1:]) - 2
+            results.append([list(rows[index])] if index < len(rows) else [])
+        return results
+    return batch_get_values
+
+
+def fake_iter_values(rows: list[list[str]]) -> t.Callable[..., t.Iterator[list[str]]]:
+    def iter_values(**kwargs: t.Any) -> t.Iterator[list[str]]:
+        return (list(row) for row in rows)
+    return iter_values
+
+
+def initialized_state(requests: list[dict[str, t.Any]]) -> dict[str, t.Any]:
+    """Make the state of a tab read by `get_formats` after the requests, omitting zeros like the API."""
+    def omit_zeros(value: t.Any) -> t.Any:
+        if isinstance(value, dict):
+            return {k: omit_zeros(v) for k, v in value.items() if v not in (0, False) or k == "boolValue"}
+        return [omit_zeros(v) for v in value] if isinstance(value, list) else value
+
+    state: dict[str, t.Any] = {"properties": {"title": "Sheet1"}, "conditionalFormats": []}
+    columns: list[dict[str, t.Any]] = [{} for _ in range(lookup.SOLD_COLUMN_INDEX + 1)]
+    rows: list[list[dict[str, t.Any]]] = [[{} for _ in columns] for _ in range(2)]
+    for request in requests:
+        kind, body = next(iter(request.items()))
+        if kind == "updateSheetProperties":
+            state["properties"].update(body["properties"])
+        elif kind == "updateDimensionProperties":
+            columns[body["range"]["startIndex"]].update(body["properties"])
+        elif kind == "repeatCell":
+            for row_index in range(body["range"].get("startRowIndex", 0), body["range"].get("endRowIndex", 2)):
+                for field in body["fields"].split(","):
+                    rows[row_index][body["range"]["startColumnIndex"]][field] = body["cell"][field]
+        elif kind == "addConditionalFormatRule":
+            state["conditionalFormats"].append({**body["rule"], "ranges": [body["rule"]["ranges"]]})
+    state["data"] = [{"rowData": [{"values": row} for row in rows], "columnMetadata": columns}]
+    return dict(omit_zeros(state))
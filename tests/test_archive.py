@@ -0,0 +1,99 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase
+
+from cropsiss import archive, lookup, shard
+from tests import sheets
+
+
+class Test_archive_requests(TestCase):
+
+    def test(self) -> None:
+        sheet_shard = shard.Shard("spreadsheet_id", 1, "ID管理-2")
+        row = ["c00002", "item", "m000000002", "", "TRUE"]
+        requests = archive.archive_requests(sheet_shard, {3: row}, "2022-01-01 00:00:00")
+        self.assertDictEqual(requests[0], {
+            "appendCells": {
+                "sheetId": archive.ARCHIVE_SHEET_ID,
+                "rows": [archive.row_data([*row, "2022-01-01 00:00:00"])],
+                "fields": "userEnteredValue"
+            }
+        })
+        self.assertDictEqual(requests[1]["updateCells"]["range"], {
+            "sheetId": 1,
+            "startRowIndex": 4,
+            "endRowIndex": 5,
+            "startColumnIndex": 1,
+            "endColumnIndex": lookup.SOLD_COLUMN_INDEX + 1
+        })
+        self.assertListEqual(
+            requests[1]["updateCells"]["rows"],
+            [{"values": [{}, {}, {}, {"userEnteredValue": {"stringValue": lookup.ARCHIVED}}]}]
+        )
+        self.assertListEqual(requests[2:], lookup.tag_requests(3, ["c00002", "", "", "", ""], 1))
+
+
+class Test_is_archived(TestCase):
+
+    def test(self) -> None:
+        self.assertTrue(archive.is_archived(archive.archived_row("c00002")))
+        self.assertFalse(archive.is_archived(["c00002", "", "", "", "TRUE"]))
+        self.assertFalse(archive.is_archived(["c00002"]))
+
+
+class Test_archive_sold_rows(sheets.ShardedTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.rows = {
+            self.shards[0]: [["c00001", "", "m000000001", "", "TRUE"], ["c00003", "", "m000000003", "", "FALSE"]],
+            self.shards[1]: [["c00002", "", "m000000002", "", "TRUE"], ["c00004", "", "m000000004", "", "TRUE"]]
+        }
+        self.api_mock.get_sheets.return_value = [{"sheetId": 0, "title": "ID管理"}]
+
+    def test_due(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            sheet_lookup.snapshots[self.shards[1]].stamp_row(0, 0.0)
+            sheet_lookup.snapshots[self.shards[1]].stamp_row(1)
+            self.assertEqual(archive.archive_sold_rows(self.api_mock, sheet_lookup, 1), 1)
+            self.assertListEqual(
+                sheet_lookup.snapshots[self.shards[1]].get_row(0) or [], archive.archived_row("c00002")
+            )
+            self.assertIsNone(sheet_lookup.snapshots[self.shards[1]].get_stamp(0))
+            self.assertIsNotNone(sheet_lookup.snapshots[self.shards[1]].get_stamp(1))
+        self.assertListEqual(
+            [c.kwargs["sheet_title"] for c in self.api_mock.iter_values.call_args_list],
+            [self.shards[1].title]
+        )
+        self.api_mock.batch_update.assert_called_once()
+        requests = self.api_mock.batch_update.call_args.kwargs["requests"]["requests"]
+        self.assertListEqual(requests[:2], archive.add_archive_sheet_requests())
+        self.assertEqual(requests[2]["appendCells"]["rows"][0], archive.row_data([
+            *self.rows[self.shards[1]][0], requests[2]["appendCells"]["rows"][0]["values"][-1]["userEnteredValue"][
+                "stringValue"
+            ]
+        ]))
+
+    def test_nothing_due(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            sheet_lookup.snapshots[self.shards[1]].stamp_row(0)
+            self.assertEqual(archive.archive_sold_rows(self.api_mock, sheet_lookup, 1), 0)
+        self.api_mock.iter_values.assert_not_called()
+        self.api_mock.batch_update.assert_not_called()
+
+    def test_unsold(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            sheet_lookup.snapshots[self.shards[0]].stamp_row(1, 0.0)
+            self.assertEqual(archive.archive_sold_rows(self.api_mock, sheet_lookup, 1), 0)
+            self.assertIsNone(sheet_lookup.snapshots[self.shards[0]].get_stamp(1))
+        self.api_mock.batch_update.assert_not_called()
+
+    def test_scan(self) -> None:
+        self.api_mock.get_sheets.return_value = [{"sheetId": archive.ARCHIVE_SHEET_ID, "title": archive.ARCHIVE_TITLE}]
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            self.assertEqual(archive.archive_sold_rows(self.api_mock, sheet_lookup, 0, scan=True), 3)
+            self.assertIsNone(sheet_lookup.snapshots[self.shards[1]].find_row(2, "m000000004"))
+            self.assertEqual(sheet_lookup.find(2, "m000000003"), (self.shards[0], 1, self.rows[self.shards[0]][1]))
+        self.api_mock.get_sheets.assert_called_once_with("spreadsheet_id")
+        requests = self.api_mock.batch_update.call_args.kwargs["requests"]["requests"]
+        self.assertNotIn("addSheet", requests[0])
+        self.assertEqual(sum("appendCells" in request for request in requests), 2)
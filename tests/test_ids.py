@@ -0,0 +1,190 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import json
+
+from cropsiss import exceptions, google, ids, lookup, shard
+from tests import sheets
+
+
+SHARD = shard.Shard("spreadsheet_id")
+ROUTER = shard.ShardRouter([SHARD])
+
+
+class Test_IdAllocator(sheets.SnapshotTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.api_mock = mock.Mock(spec_set=google.SpreadsheetAPI)
+        self.api_mock.get_row_count.return_value = 1000
+        self.api_mock.iter_values.side_effect = sheets.fake_iter_values([])
+        self.api_mock.search_developer_metadata.return_value = [{"metadataValue": json.dumps([SHARD.key])}]
+
+    def test_recover_count(self) -> None:
+        self.api_mock.iter_values.side_effect = sheets.fake_iter_values([["c00001"], ["c00002"], [], ["c00004"], []])
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            self.assertEqual(ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot}).count, 4)
+            self.assertEqual(ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot}).count, 4)
+        self.api_mock.iter_values.assert_called_once()
+
+    def test_allocate(self) -> None:
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            allocator = ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot})
+            self.assertListEqual(allocator.allocate(2), ["c00001", "c00002"])
+            self.assertListEqual(allocator.allocate(3), ["c00003", "c00004", "c00005"])
+            self.assertEqual(allocator.count, 5)
+            self.assertEqual(snapshot.find_row(0, "c00005"), 4)
+        self.assertListEqual(
+            self.api_mock.update_values.call_args_list,
+            [
+                mock.call(
+                    spreadsheet_id="spreadsheet_id",
+                    range="A2:A3",
+                    values=[["c00001", "c00002"]],
+                    major_dimension="COLUMNS"
+                ),
+                mock.call(
+                    spreadsheet_id="spreadsheet_id",
+                    range="A4:A6",
+                    values=[["c00003", "c00004", "c00005"]],
+                    major_dimension="COLUMNS"
+                )
+            ]
+        )
+        self.api_mock.batch_update.assert_not_called()
+        self.api_mock.iter_values.assert_called_once()
+
+    def test_chunks(self) -> None:
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot, mock.patch("cropsiss.ids.ID_CHUNK_SIZE", 2):
+            allocator = ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot})
+            allocator.reset()
+            allocator.allocate(5)
+        self.assertListEqual(
+            [c.kwargs["range"] for c in self.api_mock.update_values.call_args_list],
+            ["A2:A3", "A4:A5", "A6:A6"]
+        )
+
+    def test_grow(self) -> None:
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            allocator = ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot})
+            snapshot.set_meta(ids.ID_COUNT_META, "998")
+            self.assertListEqual(allocator.allocate(3), ["c00999", "c01000", "c01001"])
+        self.api_mock.batch_update.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            requests={"requests": ids.grow_requests(1000, 2)}
+        )
+        self.api_mock.update_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            range="A1000:A1002",
+            values=[["c00999", "c01000", "c01001"]],
+            major_dimension="COLUMNS"
+        )
+        self.api_mock.iter_values.assert_not_called()
+
+    def test_retry(self) -> None:
+        self.api_mock.update_values.side_effect = [None, Exception(), None, None]
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot, mock.patch("cropsiss.ids.ID_CHUNK_SIZE", 2):
+            allocator = ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot})
+            allocator.reset()
+            with self.assertRaises(Exception):
+                allocator.allocate(4)
+            self.assertEqual(allocator.count, 0)
+            self.assertListEqual(allocator.allocate(4), ["c00001", "c00002", "c00003", "c00004"])
+            self.assertEqual(allocator.count, 4)
+        self.assertListEqual(
+            [c.kwargs["range"] for c in self.api_mock.update_values.call_args_list],
+            ["A2:A3", "A4:A5", "A2:A3", "A4:A5"]
+        )
+
+    def test_store_layout(self) -> None:
+        self.api_mock.search_developer_metadata.return_value = []
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            allocator = ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot})
+            allocator.reset()
+            allocator.allocate(1)
+        self.api_mock.search_developer_metadata.assert_called_with("spreadsheet_id", ids.LAYOUT_METADATA_KEY)
+        requests = [c.kwargs["requests"]["requests"][0] for c in self.api_mock.batch_update.call_args_list]
+        self.assertEqual(
+            requests[0]["deleteDeveloperMetadata"]["dataFilter"]["developerMetadataLookup"]["metadataKey"],
+            ids.LAYOUT_METADATA_KEY
+        )
+        self.assertDictEqual(requests[1]["createDeveloperMetadata"]["developerMetadata"], {
+            "metadataKey": ids.LAYOUT_METADATA_KEY,
+            "metadataValue": json.dumps([SHARD.key]),
+            "location": {"spreadsheet": True},
+            "visibility": "DOCUMENT"
+        })
+
+    def test_layout_changed(self) -> None:
+        router = shard.ShardRouter(shard.make_shards(["spreadsheet_id"], 2))
+        for metadata in [[{"metadataValue": json.dumps([SHARD.key])}], []]:
+            with self.subTest(metadata=metadata):
+                # Without the stored shards, the IDs were allocated on the first tab only.
+                self.api_mock.search_developer_metadata.return_value = metadata
+                with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+                    snapshot.set_meta(ids.ID_COUNT_META, "1000")
+                    allocator = ids.IdAllocator(self.api_mock, router, {s: snapshot for s in router.shards})
+                    with self.assertRaises(exceptions.ShardLayoutChangedError):
+                        allocator.allocate(1)
+                    self.assertEqual(allocator.count, 1000)
+                self.api_mock.update_values.assert_not_called()
+                self.api_mock.batch_update.assert_not_called()
+
+    def test_legacy_layout(self) -> None:
+        self.api_mock.search_developer_metadata.return_value = []
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            snapshot.set_meta(ids.ID_COUNT_META, "1000")
+            self.assertListEqual(ids.IdAllocator(self.api_mock, ROUTER, {SHARD: snapshot}).allocate(1), ["c01001"])
+        requests = self.api_mock.batch_update.call_args_list[0].kwargs["requests"]["requests"]
+        metadata = requests[0]["createDeveloperMetadata"]["developerMetadata"]
+        self.assertEqual(metadata["metadataValue"], json.dumps([SHARD.key]))
+
+
+class Test_grow_requests(TestCase):
+
+    def test_success(self) -> None:
+        requests = ids.grow_requests(1000, 10)
+        self.assertEqual(requests[0], {"appendDimension": {"sheetId": 0, "dimension": "ROWS", "length": 10}})
+        for request in requests[1:]:
+            _range = request.get("copyPaste", {}).get("destination") or request["repeatCell"]["range"]
+            self.assertEqual((_range["startRowIndex"], _range["endRowIndex"]), (1000, 1010))
+
+
+class Test_IdAllocator_sharded(sheets.ShardedTestCase):
+
+    def test_allocate(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            allocator = ids.IdAllocator(self.api_mock, self.router, sheet_lookup.snapshots)
+            self.assertEqual(allocator.count, 4)
+            self.assertListEqual(allocator.allocate(3), ["c00005", "c00006", "c00007"])
+            self.assertEqual(allocator.count, 7)
+            self.assertEqual(sheet_lookup.snapshots[self.shards[0]].find_row(0, "c00007"), 3)
+            self.assertEqual(sheet_lookup.snapshots[self.shards[1]].find_row(0, "c00006"), 2)
+        self.assertCountEqual(
+            self.api_mock.update_values.call_args_list,
+            [
+                mock.call(
+                    spreadsheet_id="spreadsheet_id",
+                    range="A4:A5",
+                    values=[["c00005", "c00007"]],
+                    major_dimension="COLUMNS"
+                ),
+                mock.call(
+                    spreadsheet_id="spreadsheet_id",
+                    range=self.shards[1].a1("A4:A4"),
+                    values=[["c00006"]],
+                    major_dimension="COLUMNS"
+                )
+            ]
+        )
+
+    def test_grow(self) -> None:
+        self.api_mock.get_row_count.return_value = 3
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            ids.IdAllocator(self.api_mock, self.router, sheet_lookup.snapshots).allocate(3)
+        self.assertCountEqual(
+            self.api_mock.batch_update.call_args_list,
+            [
+                mock.call(spreadsheet_id="spreadsheet_id", requests={"requests": ids.grow_requests(3, 2, 0)}),
+                mock.call(spreadsheet_id="spreadsheet_id", requests={"requests": ids.grow_requests(3, 1, 1)})
+            ]
+        )
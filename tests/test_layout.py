@@ -0,0 +1,83 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import json
+
+from cropsiss import exceptions, google, layout, lookup, shard
+from cropsiss.cli import sheet
+from tests import sheets
+
+
+SHARD = shard.Shard("spreadsheet_id")
+ROUTER = shard.ShardRouter([SHARD])
+
+
+class Test_diff_requests(TestCase):
+
+    def test_initialized(self) -> None:
+        state = sheets.initialized_state(sheet.INIT_REQUESTS)
+        self.assertListEqual(layout.diff_requests(sheet.INIT_REQUESTS, state), [])
+
+    def test_blank(self) -> None:
+        self.assertListEqual(layout.diff_requests(sheet.INIT_REQUESTS, {}), sheet.INIT_REQUESTS)
+
+    def test_width(self) -> None:
+        state = sheets.initialized_state(sheet.INIT_REQUESTS)
+        state["data"][0]["columnMetadata"][0]["pixelSize"] = 50
+        self.assertListEqual(layout.diff_requests(sheet.INIT_REQUESTS, state), [sheet.FORMAT_CROPSISS_COLUMN[0]])
+
+    def test_overlap(self) -> None:
+        state = sheets.initialized_state(sheet.INIT_REQUESTS)
+        del state["data"][0]["rowData"][1]["values"][0]["userEnteredFormat"]
+        self.assertListEqual(layout.diff_requests(sheet.INIT_REQUESTS, state), sheet.FORMAT_CROPSISS_COLUMN[1:])
+
+    def test_sold_items(self) -> None:
+        state = sheets.initialized_state(sheet.INIT_REQUESTS)
+        state["data"][0]["rowData"][1]["values"][lookup.SOLD_COLUMN_INDEX]["userEnteredValue"] = {"boolValue": True}
+        self.assertListEqual(layout.diff_requests(sheet.INIT_REQUESTS, state), [])
+
+    def test_rounding(self) -> None:
+        state = sheets.initialized_state(sheet.INIT_REQUESTS)
+        state["data"][0]["rowData"][1]["values"][1]["userEnteredFormat"]["backgroundColor"]["red"] = 0.85098
+        self.assertListEqual(layout.diff_requests(sheet.INIT_REQUESTS, state), [])
+
+
+class Test_for_sheet(TestCase):
+
+    def test_success(self) -> None:
+        requests = layout.for_sheet([*sheet.CLEAR, *sheet.INIT_REQUESTS], 3)
+        self.assertNotIn('"sheetId": 0', json.dumps(requests))
+        self.assertEqual(requests[0]["updateCells"]["range"]["sheetId"], 3)
+        self.assertNotIn('"sheetId": 3', json.dumps(sheet.CLEAR))
+        self.assertEqual(layout.for_sheet(sheet.CLEAR, 0), sheet.CLEAR)
+
+
+class Test_add_shard_sheets(TestCase):
+
+    def test_success(self) -> None:
+        api_mock = mock.Mock(spec_set=google.SpreadsheetAPI)
+        api_mock.get_sheets.return_value = [{"sheetId": 0, "title": "ID管理"}, {"sheetId": 1, "title": "ID管理-2"}]
+        layout.add_shard_sheets(api_mock, shard.ShardRouter(shard.make_shards(["spreadsheet_id"], 3)))
+        api_mock.get_sheets.assert_called_once_with("spreadsheet_id")
+        api_mock.batch_update.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            requests={"requests": [{"addSheet": {"properties": {"sheetId": 2, "title": "ID管理-3"}}}]}
+        )
+
+    def test_conflict(self) -> None:
+        router = shard.ShardRouter(shard.make_shards(["spreadsheet_id"], 2))
+        for tabs in [
+            [{"sheetId": 0, "title": "ID管理"}, {"sheetId": 1, "title": "売上"}],
+            [{"sheetId": 0, "title": "ID管理"}, {"sheetId": 5, "title": "ID管理-2"}]
+        ]:
+            with self.subTest(tabs=tabs):
+                api_mock = mock.Mock(spec_set=google.SpreadsheetAPI)
+                api_mock.get_sheets.return_value = tabs
+                with self.assertRaises(exceptions.ShardSheetConflictError):
+                    layout.add_shard_sheets(api_mock, router)
+                api_mock.batch_update.assert_not_called()
+
+    def test_single_tab(self) -> None:
+        api_mock = mock.Mock(spec_set=google.SpreadsheetAPI)
+        layout.add_shard_sheets(api_mock, ROUTER)
+        api_mock.get_sheets.assert_not_called()
+        api_mock.batch_update.assert_not_called()
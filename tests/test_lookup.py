@@ -0,0 +1,218 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+
+from cropsiss import google, lookup, shard, table
+from tests import sheets
+
+
+SHARD = shard.Shard("spreadsheet_id")
+
+
+@mock.patch("cropsiss.google.sheet.SpreadsheetAPI", spec_set=google.SpreadsheetAPI)
+class Test_RowLookup(sheets.SnapshotTestCase):
+    rows = [[f"c{i:05}", f"item{i}", f"m{i:09}", f"y{i:09}", "FALSE"] for i in range(1, 5)]
+
+    def test_first_lookup(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = []
+        sheet_api_mock.batch_get_values.side_effect = sheets.fake_batch_get_values(self.rows)
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(self.rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertEqual(sheet_lookup.find(2, "m000000002"), (1, self.rows[1]))
+            sheet_api_mock.iter_values.assert_called_once()
+            sheet_api_mock.batch_get_values.assert_not_called()
+
+    def test_hit(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = []
+        sheet_api_mock.batch_get_values.side_effect = sheets.fake_batch_get_values(self.rows)
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(self.rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            snapshot.refresh(self.rows)
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            for index, row in enumerate(self.rows):
+                sheet_api_mock.reset_mock()
+                with self.subTest(index=index):
+                    self.assertEqual(sheet_lookup.find(3, row[3]), (index, row))
+                    sheet_api_mock.batch_get_values.assert_called_once_with(
+                        spreadsheet_id="spreadsheet_id",
+                        ranges=[f"A{index+2}:{lookup.SOLD_COLUMN}{index+2}"]
+                    )
+
+    def test_moved(self, sheet_api_mock: mock.Mock) -> None:
+        rows = list(reversed(self.rows))
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = []
+        sheet_api_mock.batch_get_values.side_effect = sheets.fake_batch_get_values(rows)
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            snapshot.refresh(self.rows)
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertEqual(sheet_lookup.find(2, "m000000001"), (3, self.rows[0]))
+            self.assertEqual(snapshot.get_row(0), rows[0])
+
+    def test_miss(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = []
+        sheet_api_mock.batch_get_values.side_effect = sheets.fake_batch_get_values(self.rows)
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(self.rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertIsNone(sheet_lookup.find(2, "m999999999"))
+            self.assertIsNone(sheet_lookup.find(2, "m999999998"))
+            # The snapshot is refreshed only once
+            sheet_api_mock.iter_values.assert_called_once()
+
+    def test_tagged(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = [("'ID管理'!A4:Z4", [self.rows[2]])]
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertEqual(sheet_lookup.find(2, "m000000003"), (2, self.rows[2]))
+            self.assertEqual(snapshot.get_row(2), self.rows[2])
+        sheet_api_mock.batch_get_values_by_data_filter.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            data_filters=[{
+                "developerMetadataLookup": {
+                    "metadataKey": lookup.METADATA_KEYS[2],
+                    "metadataValue": "m000000003",
+                    "metadataLocation": {"sheetId": 0},
+                    "locationMatchingStrategy": "INTERSECTING_LOCATION",
+                    "locationType": "ROW"
+                }
+            }]
+        )
+        sheet_api_mock.batch_get_values.assert_not_called()
+
+    def test_stale_tag(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = [("'ID管理'!A4:Z4", [self.rows[2]])]
+        sheet_api_mock.batch_get_values.side_effect = sheets.fake_batch_get_values(self.rows)
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(self.rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertEqual(sheet_lookup.find(2, "m000000004"), (3, self.rows[3]))
+        sheet_api_mock.iter_values.assert_called_once()
+
+    def test_untagged_column(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values.side_effect = sheets.fake_batch_get_values(self.rows)
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(self.rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertEqual(sheet_lookup.find(1, "item2"), (1, self.rows[1]))
+        sheet_api_mock.batch_get_values_by_data_filter.assert_not_called()
+
+
+class Test_parse_row_number(TestCase):
+
+    def test_success(self) -> None:
+        cases = [("A2", 2), ("A5:Z5", 5), ("'ID管理'!A10:Z10", 10), ("'a!b'!B3:C4", 3), ("Sheet1!7:7", 7)]
+        for a1_range, expected in cases:
+            with self.subTest(a1_range=a1_range):
+                self.assertEqual(lookup.parse_row_number(a1_range), expected)
+
+    def test_no_row_number(self) -> None:
+        with self.assertRaises(ValueError):
+            lookup.parse_row_number("Sheet1!A:A")
+
+
+class Test_tag_requests(TestCase):
+
+    def test_success(self) -> None:
+        requests = lookup.tag_requests(3, ["c00004", "item", "m000000004", "", "FALSE"])
+        deleted = [request["deleteDeveloperMetadata"]["dataFilter"]["developerMetadataLookup"]["metadataKey"]
+                   for request in requests if "deleteDeveloperMetadata" in request]
+        created = [request["createDeveloperMetadata"]["developerMetadata"]
+                   for request in requests if "createDeveloperMetadata" in request]
+        self.assertListEqual(deleted, list(lookup.METADATA_KEYS.values()))
+        self.assertListEqual(
+            [(metadata["metadataKey"], metadata["metadataValue"]) for metadata in created],
+            [(lookup.METADATA_KEYS[0], "c00004"), (lookup.METADATA_KEYS[2], "m000000004")]
+        )
+        for metadata in created:
+            self.assertEqual(metadata["location"], lookup.row_location(3))
+        self.assertEqual(lookup.row_location(3)["dimensionRange"]["startIndex"], 4)
+
+
+class Test_select_rows_to_tag(TestCase):
+
+    def test_success(self) -> None:
+        rows = [
+            ["c00001", "", "m1", "", "TRUE"],
+            ["c00002", "", "", "", lookup.ARCHIVED],
+            ["c00003", "", "m3", "", "FALSE"]
+        ]
+        item_table = table.ItemTable.from_rows(rows, lookup.SOLD_COLUMN_INDEX + 1)
+        self.assertListEqual(lookup.select_rows_to_tag(item_table, lookup.tag_size(rows[2])), [2])
+
+
+@mock.patch("cropsiss.google.sheet.SpreadsheetAPI", spec_set=google.SpreadsheetAPI)
+class Test_RowLookup_table(sheets.SnapshotTestCase):
+    rows = [[f"c{i:05}", f"item{i}", f"m{i:09}", f"y{i:09}", "FALSE"] for i in range(1, 5)]
+
+    def test_after_refresh(self, sheet_api_mock: mock.Mock) -> None:
+        sheet_api_mock.batch_get_values_by_data_filter.return_value = []
+        sheet_api_mock.iter_values.side_effect = sheets.fake_iter_values(self.rows)
+        with lookup.open_snapshot(self.snapshot_file, SHARD) as snapshot:
+            sheet_lookup = lookup.RowLookup(sheet_api_mock, SHARD, snapshot)
+            self.assertIsNone(sheet_lookup.item_table)
+            self.assertEqual(sheet_lookup.find(0, "c00001"), (0, self.rows[0]))
+            self.assertIsNotNone(sheet_lookup.item_table)
+            sheet_api_mock.reset_mock()
+            for index, row in enumerate(self.rows):
+                with self.subTest(index=index):
+                    self.assertEqual(sheet_lookup.find(3, row[3]), (index, row))
+            self.assertIsNone(sheet_lookup.find(3, "y999999999"))
+            self.assertEqual(len(snapshot), len(self.rows))
+        self.assertListEqual(sheet_api_mock.mock_calls, [])
+
+
+class Test_read_table(TestCase):
+
+    def test_success(self) -> None:
+        api_mock = mock.Mock(spec_set=google.SpreadsheetAPI)
+        api_mock.batch_get_values.return_value = [[["c00001", "c00002"], [], ["m000000001"]]]
+        item_table = lookup.read_table(api_mock, SHARD)
+        self.assertEqual(len(item_table), 2)
+        self.assertEqual(item_table.row(0), ["c00001", "", "m000000001", "", ""])
+        self.assertEqual(item_table.row(1), ["c00002", "", "", "", ""])
+
+
+class Test_ShardedLookup(sheets.ShardedTestCase):
+
+    def test_cropsiss_id(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            self.assertEqual(sheet_lookup.find(0, "c00004"), (self.shards[1], 1, self.rows[self.shards[1]][1]))
+            self.assertIsNone(sheet_lookup.find(0, "invalid"))
+        self.api_mock.batch_get_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            ranges=[self.shards[1].a1(f"A3:{lookup.SOLD_COLUMN}3")]
+        )
+        self.api_mock.batch_get_values_by_data_filter.assert_not_called()
+        self.api_mock.iter_values.assert_not_called()
+
+    def test_cropsiss_id_moved(self) -> None:
+        self.rows = {**self.rows, self.shards[1]: self.rows[self.shards[1]][::-1]}
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            self.assertEqual(sheet_lookup.find(0, "c00002"), (self.shards[1], 1, self.rows[self.shards[1]][1]))
+        self.assertListEqual(
+            [c.kwargs["sheet_title"] for c in self.api_mock.iter_values.call_args_list],
+            [self.shards[1].title]
+        )
+
+    def test_fan_out(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            self.assertEqual(sheet_lookup.find(2, "m000000002"), (self.shards[1], 0, self.rows[self.shards[1]][0]))
+            self.assertEqual(self.api_mock.batch_get_values_by_data_filter.call_count, 2)
+            self.assertEqual(self.api_mock.iter_values.call_count, 2)
+            self.assertEqual(sheet_lookup.snapshots[self.shards[0]].find_row(2, "m000000003"), 1)
+            self.assertIsNone(sheet_lookup.find(2, "m999999999"))
+            self.assertEqual(self.api_mock.iter_values.call_count, 2)
+
+    def test_snapshot_hit(self) -> None:
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            for sheet_shard, rows in self.rows.items():
+                sheet_lookup.snapshots[sheet_shard].refresh(rows)
+        with lookup.ShardedLookup(self.api_mock, self.router, self.snapshot_file) as sheet_lookup:
+            self.assertEqual(sheet_lookup.find(2, "m000000004"), (self.shards[1], 1, self.rows[self.shards[1]][1]))
+        self.api_mock.batch_get_values.assert_called_once_with(
+            spreadsheet_id="spreadsheet_id",
+            ranges=[self.shards[1].a1(f"A3:{lookup.SOLD_COLUMN}3")]
+        )
+        self.api_mock.batch_get_values_by_data_filter.assert_not_called()
+        self.api_mock.iter_values.assert_not_called()
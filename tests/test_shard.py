@@ -0,0 +1,97 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase
+import threading
+
+from cropsiss import shard
+
+
+class Test_column_letter(TestCase):
+
+    def test_success(self) -> None:
+        cases = [(0, "A"), (4, "E"), (25, "Z"), (26, "AA"), (51, "AZ"), (52, "BA"), (701, "ZZ"), (702, "AAA")]
+        for column_index, letters in cases:
+            with self.subTest(column_index=column_index):
+                self.assertEqual(shard.column_letter(column_index), letters)
+
+
+class TestShard(TestCase):
+
+    def test_first_tab(self) -> None:
+        sheet_shard = shard.Shard("spreadsheet_id")
+        self.assertEqual(sheet_shard.key, "spreadsheet_id")
+        self.assertEqual(sheet_shard.a1("A2:E"), "A2:E")
+
+    def test_titled_tab(self) -> None:
+        sheet_shard = shard.Shard("spreadsheet_id", 2, "ID管理-3")
+        self.assertEqual(sheet_shard.key, "spreadsheet_id#2")
+        self.assertEqual(sheet_shard.a1("A2:E"), "'ID管理-3'!A2:E")
+
+
+class Test_make_shards(TestCase):
+
+    def test_success(self) -> None:
+        self.assertListEqual(
+            shard.make_shards(["s1", "s2"], 2),
+            [
+                shard.Shard("s1"),
+                shard.Shard("s1", 1, f"{shard.SHEET_TITLE}-2"),
+                shard.Shard("s2"),
+                shard.Shard("s2", 1, f"{shard.SHEET_TITLE}-2")
+            ]
+        )
+
+
+class TestShardRouter(TestCase):
+
+    def setUp(self) -> None:
+        self.shards = shard.make_shards(["spreadsheet_id"], 3)
+        self.router = shard.ShardRouter(self.shards)
+
+    def test_no_shard(self) -> None:
+        with self.assertRaises(ValueError):
+            shard.ShardRouter([])
+
+    def test_route(self) -> None:
+        cases = [("c00001", 0, 0), ("c00002", 1, 0), ("c00003", 2, 0), ("c00004", 0, 1), ("c100000", 0, 33333)]
+        for cropsiss_id, shard_index, row_index in cases:
+            with self.subTest(cropsiss_id=cropsiss_id):
+                self.assertEqual(self.router.route(cropsiss_id), (self.shards[shard_index], row_index))
+
+    def test_route_invalid(self) -> None:
+        for cropsiss_id in ["", "c", "c00000", "x00001", "c0001a"]:
+            with self.subTest(cropsiss_id=cropsiss_id):
+                with self.assertRaises(ValueError):
+                    self.router.route(cropsiss_id)
+
+    def test_number(self) -> None:
+        for number in range(1, 20):
+            with self.subTest(number=number):
+                self.assertEqual(self.router.number(*self.router.route(f"c{number:05}")), number)
+
+    def test_single_shard(self) -> None:
+        router = shard.ShardRouter([shard.Shard("spreadsheet_id")])
+        self.assertEqual(router.route("c00999"), (router.shards[0], 998))
+
+    def test_fan_out(self) -> None:
+        threads: set[int] = set()
+        barrier = threading.Barrier(len(self.shards), timeout=5)
+
+        def func(sheet_shard: shard.Shard) -> str:
+            threads.add(threading.get_ident())
+            barrier.wait()
+            return sheet_shard.key
+
+        self.assertListEqual(self.router.fan_out(func), [s.key for s in self.shards])
+        self.assertEqual(len(threads), len(self.shards))
+
+    def test_fan_out_subset(self) -> None:
+        self.assertListEqual(self.router.fan_out(lambda s: s.sheet_id, self.shards[1:]), [1, 2])
+        self.assertListEqual(self.router.fan_out(lambda s: s.sheet_id, []), [])
+
+    def test_fan_out_error(self) -> None:
+        def func(sheet_shard: shard.Shard) -> None:
+            if sheet_shard.sheet_id == 1:
+                raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            self.router.fan_out(func)
@@ -0,0 +1,196 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase
+import pathlib
+import tempfile
+
+from cropsiss import snapshot
+
+
+class SheetSnapshotTestCase(TestCase):
+    rows = [[f"c{i:05}", f"item{i}", f"m{i:09}", "", "FALSE"] for i in range(1, 6)]
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = pathlib.Path(self.tmpdir.name) / "snapshot.sqlite3"
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "spreadsheet_id", 5)
+
+    def tearDown(self) -> None:
+        self.snapshot.close()
+        self.tmpdir.cleanup()
+
+
+class TestSheetSnapshot_refresh(SheetSnapshotTestCase):
+
+    def test_first(self) -> None:
+        self.assertIsNone(self.snapshot.refreshed_at)
+        self.assertEqual(self.snapshot.refresh(self.rows), len(self.rows))
+        self.assertEqual(len(self.snapshot), len(self.rows))
+        self.assertIsNotNone(self.snapshot.refreshed_at)
+        for index, row in enumerate(self.rows):
+            with self.subTest(index=index):
+                self.assertEqual(self.snapshot.get_row(index), row)
+
+    def test_delta(self) -> None:
+        self.snapshot.refresh(self.rows)
+        rows = [list(row) for row in self.rows]
+        rows[1][3] = "y000000002"
+        rows[3][4] = "TRUE"
+        self.assertEqual(self.snapshot.refresh(rows), 2)
+        self.assertEqual(self.snapshot.get_row(1), rows[1])
+        self.assertEqual(self.snapshot.get_row(3), rows[3])
+        self.assertEqual(self.snapshot.refresh(rows), 0)
+
+    def test_removed(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.assertEqual(self.snapshot.refresh(self.rows[:3]), 2)
+        self.assertEqual(len(self.snapshot), 3)
+        self.assertIsNone(self.snapshot.get_row(3))
+
+    def test_iterator(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.assertEqual(self.snapshot.refresh(iter(self.rows[:3])), 2)
+        self.assertEqual(len(self.snapshot), 3)
+        self.assertEqual(self.snapshot.refresh(iter([])), 3)
+        self.assertEqual(len(self.snapshot), 0)
+
+    def test_normalize(self) -> None:
+        self.snapshot.refresh([["c00001"], ["c00002", "item", "m", "y", True, "extra"]])
+        self.assertEqual(self.snapshot.get_row(0), ["c00001", "", "", "", ""])
+        self.assertEqual(self.snapshot.get_row(1), ["c00002", "item", "m", "y", "True"])
+
+
+class TestSheetSnapshot_find_row(SheetSnapshotTestCase):
+
+    def test_found(self) -> None:
+        self.snapshot.refresh(self.rows)
+        for index, row in enumerate(self.rows):
+            with self.subTest(index=index):
+                self.assertEqual(self.snapshot.find_row(0, row[0]), index)
+                self.assertEqual(self.snapshot.find_row(2, row[2]), index)
+
+    def test_not_found(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.assertIsNone(self.snapshot.find_row(0, "c99999"))
+        self.assertIsNone(self.snapshot.find_row(2, "c00001"))
+
+    def test_first(self) -> None:
+        self.snapshot.refresh([["c00001", "", "m"], ["c00002", "", "m"]])
+        self.assertEqual(self.snapshot.find_row(2, "m"), 0)
+
+
+class TestSheetSnapshot_update_row(SheetSnapshotTestCase):
+
+    def test(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.update_row(2, ["c00003", "", "m999999999"])
+        self.assertEqual(self.snapshot.get_row(2), ["c00003", "", "m999999999", "", ""])
+        self.assertEqual(self.snapshot.find_row(2, "m999999999"), 2)
+        self.assertEqual(self.snapshot.refresh(self.rows), 1)
+
+
+class TestSheetSnapshot_persistence(SheetSnapshotTestCase):
+
+    def test_reopen(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.close()
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "spreadsheet_id", 5)
+        self.assertEqual(len(self.snapshot), len(self.rows))
+        self.assertEqual(self.snapshot.refresh(self.rows), 0)
+
+    def test_other_source(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.close()
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "other_spreadsheet_id", 5)
+        self.assertEqual(len(self.snapshot), 0)
+        self.assertIsNone(self.snapshot.refreshed_at)
+
+
+class TestSheetSnapshot_key_columns(SheetSnapshotTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.snapshot.close()
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "spreadsheet_id", 5, key_columns=[0, 2, 3])
+
+    def test_find_row(self) -> None:
+        self.snapshot.refresh(self.rows)
+        for index, row in enumerate(self.rows):
+            with self.subTest(index=index):
+                self.assertEqual(self.snapshot.find_row(0, row[0]), index)
+                self.assertEqual(self.snapshot.find_row(2, row[2]), index)
+                self.assertEqual(self.snapshot.find_row(1, row[1]), index)
+
+    def test_empty_cell(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.assertIsNone(self.snapshot.find_row(3, ""))
+
+    def test_sync(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.update_row(0, ["c00001", "", "m999999999"])
+        self.assertIsNone(self.snapshot.find_row(2, self.rows[0][2]))
+        self.assertEqual(self.snapshot.find_row(2, "m999999999"), 0)
+        self.snapshot.refresh(self.rows[:2])
+        self.assertIsNone(self.snapshot.find_row(0, self.rows[2][0]))
+        self.assertEqual(self.snapshot.find_row(2, self.rows[0][2]), 0)
+
+    def test_rebuild(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.close()
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "spreadsheet_id", 5, key_columns=[1])
+        self.assertEqual(self.snapshot.find_row(1, self.rows[3][1]), 3)
+        self.assertEqual(self.snapshot._conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0], len(self.rows))
+
+
+class TestSheetSnapshot_update_column(SheetSnapshotTestCase):
+
+    def test_existing_rows(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.update_column(3, ["y1", "y2"], start=1)
+        self.assertEqual(self.snapshot.get_row(0), self.rows[0])
+        self.assertEqual(self.snapshot.get_row(1), [*self.rows[1][:3], "y1", "FALSE"])
+        self.assertEqual(self.snapshot.get_row(2), [*self.rows[2][:3], "y2", "FALSE"])
+
+    def test_new_rows(self) -> None:
+        self.snapshot.update_column(0, ["c00001", "c00002"])
+        self.assertEqual(len(self.snapshot), 2)
+        self.assertEqual(self.snapshot.get_row(1), ["c00002", "", "", "", ""])
+
+
+class TestSheetSnapshot_meta(SheetSnapshotTestCase):
+
+    def test_get_set(self) -> None:
+        self.assertIsNone(self.snapshot.get_meta("key"))
+        self.snapshot.set_meta("key", "value")
+        self.assertEqual(self.snapshot.get_meta("key"), "value")
+
+    def test_other_source(self) -> None:
+        self.snapshot.set_meta("key", "value")
+        self.snapshot.close()
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "other_spreadsheet_id", 5)
+        self.assertIsNone(self.snapshot.get_meta("key"))
+
+
+class TestSheetSnapshot_stamps(SheetSnapshotTestCase):
+
+    def test_stamp(self) -> None:
+        self.assertIsNone(self.snapshot.get_stamp(1))
+        self.snapshot.stamp_row(1, 100.0)
+        self.snapshot.stamp_row(3, 200.0)
+        self.assertEqual(self.snapshot.get_stamp(1), 100.0)
+        self.assertListEqual(self.snapshot.stamped_until(150.0), [1])
+        self.assertListEqual(self.snapshot.stamped_until(200.0), [1, 3])
+        self.snapshot.unstamp_rows([1])
+        self.assertListEqual(self.snapshot.stamped_until(200.0), [3])
+
+    def test_removed(self) -> None:
+        self.snapshot.refresh(self.rows)
+        self.snapshot.stamp_row(1, 100.0)
+        self.snapshot.stamp_row(3, 100.0)
+        self.snapshot.refresh(self.rows[:2])
+        self.assertListEqual(self.snapshot.stamped_until(150.0), [1])
+
+    def test_other_source(self) -> None:
+        self.snapshot.stamp_row(1, 100.0)
+        self.snapshot.close()
+        self.snapshot = snapshot.SheetSnapshot(self.filename, "other_spreadsheet_id", 5)
+        self.assertIsNone(self.snapshot.get_stamp(1))
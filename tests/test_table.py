@@ -0,0 +1,45 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase
+
+from cropsiss import table
+
+
+class TestItemTable(TestCase):
+    rows = [[f"c{i:05}", f"item{i}", f"m{i:09}", "", "FALSE"] for i in range(1, 6)]
+
+    def test_from_columns(self) -> None:
+        item_table = table.ItemTable([list(column) for column in zip(*self.rows)], 5)
+        self.assertEqual(len(item_table), len(self.rows))
+        self.assertListEqual(list(item_table.rows()), self.rows)
+
+    def test_from_rows(self) -> None:
+        item_table = table.ItemTable.from_rows(iter(self.rows), 5)
+        self.assertEqual(len(item_table), len(self.rows))
+        for index, row in enumerate(self.rows):
+            with self.subTest(index=index):
+                self.assertEqual(item_table.row(index), row)
+
+    def test_normalize(self) -> None:
+        item_table = table.ItemTable.from_rows([["c00001"], ["c00002", "item", "m", "y", True, "extra"]], 5)
+        self.assertEqual(item_table.row(0), ["c00001", "", "", "", ""])
+        self.assertEqual(item_table.row(1), ["c00002", "item", "m", "y", "True"])
+        item_table = table.ItemTable([["c00001", "c00002"], [], ["m"]], 5)
+        self.assertEqual(item_table.row(1), ["c00002", "", "", "", ""])
+
+    def test_empty(self) -> None:
+        for item_table in (table.ItemTable([], 5), table.ItemTable.from_rows([], 5)):
+            with self.subTest(item_table=item_table):
+                self.assertEqual(len(item_table), 0)
+                self.assertIsNone(item_table.find(0, "c00001"))
+
+    def test_find(self) -> None:
+        item_table = table.ItemTable.from_rows(self.rows + [["c00006", "", "m000000001"]], 5)
+        self.assertEqual(item_table.find(0, "c00003"), 2)
+        self.assertEqual(item_table.find(2, "m000000001"), 0)
+        self.assertIsNone(item_table.find(2, "m999999999"))
+        self.assertIsNone(item_table.find(3, ""))
+
+    def test_interned(self) -> None:
+        item_table = table.ItemTable.from_rows(self.rows, 5)
+        flags = [row[4] for row in item_table.rows()]
+        self.assertTrue(all(flag is flags[0] for flag in flags))
@@ -0,0 +1,174 @@
+# Copyright (c) 2022 Shuhei Nitta. All rights reserved.
+from unittest import TestCase, mock
+import pathlib
+import queue
+import tempfile
+
+from selenium import webdriver
+
+import cropsiss
+from cropsiss import exceptions, workers
+
+
+def make_options(*args: str) -> webdriver.ChromeOptions:
+    options = webdriver.ChromeOptions()
+    for arg in args:
+        options.add_argument(arg)
+    return options
+
+
+class Test_user_data_dir(TestCase):
+
+    def test_get(self) -> None:
+        self.assertEqual(
+            workers.get_user_data_dir(make_options("--headless", "--user-data-dir=/tmp/profile")),
+            pathlib.Path("/tmp/profile")
+        )
+        self.assertIsNone(workers.get_user_data_dir(make_options("--headless")))
+
+    def test_replace(self) -> None:
+        options = make_options("--user-data-dir=/tmp/profile", "--headless")
+        replaced = workers.with_user_data_dir(options, "/tmp/clone")
+        self.assertListEqual(replaced.arguments, ["--headless", "--user-data-dir=/tmp/clone"])
+        self.assertListEqual(options.arguments, ["--user-data-dir=/tmp/profile", "--headless"])
+
+
+class Test_clone_profile(TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.master = pathlib.Path(self.tmpdir.name) / "master"
+        self.clone = pathlib.Path(self.tmpdir.name) / "clone"
+        (self.master / "Default" / "Cache").mkdir(parents=True)
+        (self.master / "Default" / "Cookies").write_text("cookies")
+        (self.master / "Default" / "Cache" / "data").write_text("cache")
+        (self.master / "SingletonLock").write_text("lock")
+
+    def tearDown(self) -> None:
+        self.tmpdir.cleanup()
+
+    def test_clone(self) -> None:
+        workers.clone_profile(self.master, self.clone)
+        self.assertEqual((self.clone / "Default" / "Cookies").read_text(), "cookies")
+        self.assertFalse((self.clone / "Default" / "Cache").exists())
+        self.assertFalse((self.clone / "SingletonLock").exists())
+
+    def test_refresh(self) -> None:
+        workers.clone_profile(self.master, self.clone)
+        (self.clone / "stale").write_text("stale")
+        (self.master / "Default" / "Cookies").write_text("new cookies")
+        workers.clone_profile(self.master, self.clone)
+        self.assertFalse((self.clone / "stale").exists())
+        self.assertEqual((self.clone / "Default" / "Cookies").read_text(), "new cookies")
+
+    def test_no_master(self) -> None:
+        workers.clone_profile(self.master / "missing", self.clone)
+        self.assertTrue(self.clone.is_dir())
+
+
+class Test_init_worker(TestCase):
+
+    def tearDown(self) -> None:
+        workers._worker_options = None
+
+    def test_profile(self) -> None:
+        profiles: "queue.Queue[str | None]" = queue.Queue()
+        profiles.put("/tmp/clone")
+        workers._init_worker(make_options("--user-data-dir=/tmp/profile"), profiles)  # type: ignore[arg-type]
+        assert workers._worker_options is not None
+        self.assertListEqual(workers._worker_options.arguments, ["--user-data-dir=/tmp/clone"])
+
+    def test_cancel(self) -> None:
+        workers._worker_options = options = make_options()
+        platform = cropsiss.PLATFORMS[0]
+        with mock.patch.object(type(platform), "cancel") as cancel_mock:
+            workers._cancel(platform, "m000000001")
+        cancel_mock.assert_called_once_with("m000000001", options)
+
+
+class TestCancelPool(TestCase):
+
+    def test_inline(self) -> None:
+        options = make_options()
+        platform = cropsiss.PLATFORMS[0]
+        with workers.CancelPool(options) as pool:
+            with mock.patch.object(type(platform), "cancel") as cancel_mock:
+                future = pool.submit(platform, "m000000001")
+            self.assertTrue(future.done())
+            self.assertIsNone(future.result())
+            cancel_mock.assert_called_once_with("m000000001", options)
+            with mock.patch.object(type(platform), "cancel", side_effect=exceptions.NotCancelError()):
+                with self.assertRaises(exceptions.NotCancelError):
+                    pool.submit(platform, "m000000001").result()
+
+    def test_tabs(self) -> None:
+        options = make_options()
+        mercari, yahuoku = cropsiss.PLATFORMS
+        error = exceptions.NotCancelError()
+        with mock.patch.object(type(mercari), "cancel_in_tabs", return_value={"m1": None, "m2": error}) as m_mock, \
+                mock.patch.object(type(yahuoku), "cancel_in_tabs", return_value={"y1": None}) as y_mock:
+            with workers.CancelPool(options, tabs=3) as pool:
+                submitted = [pool.submit(mercari, "m1"), pool.submit(yahuoku, "y1"), pool.submit(mercari, "m2")]
+                self.assertFalse(any(future.done() for future in submitted))
+        m_mock.assert_called_once_with(["m1", "m2"], options, 3)
+        y_mock.assert_called_once_with(["y1"], options, 3)
+        self.assertIsNone(submitted[0].result())
+        self.assertIsNone(submitted[1].result())
+        self.assertIs(submitted[2].exception(), error)
+
+    def test_concurrency_and_tabs(self) -> None:
+        with self.assertRaises(ValueError):
+            workers.CancelPool(make_options(), 2, tabs=2)
+
+    def test_backends(self) -> None:
+        options = make_options()
+        mercari, yahuoku = cropsiss.PLATFORMS
+        with mock.patch.object(type(mercari), "cancel_in_tabs", return_value={"m1": None}) as tabs_mock, \
+                mock.patch.object(type(yahuoku), "cancel_over_http") as http_mock:
+            with workers.CancelPool(options, tabs=2, backends={"yahoo_auction": "http"}) as pool:
+                self.assertTrue(pool.submit(yahuoku, "y1").done())
+                self.assertFalse(pool.submit(mercari, "m1").done())
+            with self.assertRaises(ValueError):
+                workers.CancelPool(options, backends={"mercari": "http"}).submit(mercari, "m1")
+        http_mock.assert_called_once_with("y1", options)
+        tabs_mock.assert_called_once_with(["m1"], options, 2)
+
+    @mock.patch("concurrent.futures.ProcessPoolExecutor")
+    def test_settings_to_workers(self, executor_mock: mock.Mock) -> None:
+        with workers.CancelPool(
+            make_options(), 2, backends={"yahoo_auction": "http"}, timeouts={"yahoo_auction": {"confirm": 1}}
+        ) as pool:
+            pool.submit(cropsiss.PLATFORMS[1], "x000000001")
+        (_, platform, item_id), _ = executor_mock.return_value.submit.call_args
+        self.assertEqual(item_id, "x000000001")
+        self.assertEqual(platform.backend, "http")
+        self.assertEqual(platform.timeouts.confirm, 1)
+        self.assertEqual(cropsiss.PLATFORMS[1].backend, "webdriver")
+
+    @mock.patch("concurrent.futures.ProcessPoolExecutor")
+    def test_workers(self, executor_mock: mock.Mock) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            master = pathlib.Path(tmpdir) / "master"
+            master.mkdir()
+            options = make_options(f"--user-data-dir={master}")
+            with workers.CancelPool(options, 2, pathlib.Path(tmpdir) / "workers") as pool:
+                self.assertFalse((pathlib.Path(tmpdir) / "workers").exists())
+                executor_mock.assert_not_called()
+                pool.submit(cropsiss.PLATFORMS[1], "x000000001")
+                self.assertTrue((pathlib.Path(tmpdir) / "workers" / "worker-0").is_dir())
+                self.assertTrue((pathlib.Path(tmpdir) / "workers" / "worker-1").is_dir())
+        self.assertEqual(executor_mock.call_args.kwargs["max_workers"], 2)
+        self.assertEqual(executor_mock.call_args.kwargs["initializer"], workers._init_worker)
+        executor_mock.return_value.submit.assert_called_once_with(
+            workers._cancel, cropsiss.PLATFORMS[1], "x000000001"
+        )
+        executor_mock.return_value.shutdown.assert_called_once_with(wait=True)
+
+    @mock.patch("concurrent.futures.ProcessPoolExecutor")
+    def test_no_submission(self, executor_mock: mock.Mock) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            options = make_options(f"--user-data-dir={tmpdir}/master")
+            with workers.CancelPool(options, 2, pathlib.Path(tmpdir) / "workers") as pool:
+                pool.flush()
+            self.assertFalse((pathlib.Path(tmpdir) / "workers").exists())
+        executor_mock.assert_not_called()